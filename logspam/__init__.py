@@ -5,3 +5,10 @@
 __version__ = "0.1.4"
 
 WARNING_RE='^WARNING'
+
+# Predefined patterns that can be referred to by name with --patterns.
+PATTERNS = {
+    'warning': WARNING_RE,
+    'assertion': r'^###!!! ASSERTION',
+    'error': r'^\[[^\]]+\] ###!!! ERROR|^###!!! ERROR',
+}
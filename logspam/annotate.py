@@ -0,0 +1,159 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Batch resolution of bugzilla components and blame info for warning source
+locations using a local gecko checkout.
+
+Starting mach or hg has a noticeable fixed cost, so rather than running them
+once per warning all the unknown files are resolved with a single
+`mach file-info` and a single `hg annotate` call. Results are cached on disk
+keyed by (revision, file).
+"""
+
+from collections import namedtuple
+import json
+import os
+
+# |component| is a (product, component) pair, |node| and |user| identify the
+# changeset that last touched the line. Any of them can be None if unknown.
+SourceInfo = namedtuple('SourceInfo', ['file', 'line', 'component', 'node', 'user'])
+
+
+class AnnotateException(Exception):
+    pass
+
+
+class SourceAnnotator(object):
+    """
+    Resolves (file, line) pairs against a checkout at |hgroot|. |revision|
+    defaults to the working directory's parent.
+    """
+    def __init__(self, hgroot, revision='.', cache_dir='annotate-cache'):
+        self.hgroot = hgroot
+        self.revision = self._resolve_revision(revision)
+        self.cache_dir = cache_dir
+        self.cache_path = os.path.join(cache_dir, '%s.json' % self.revision)
+        # Mapping of file to {'component': [product, component],
+        #                     'lines': [[node, user], ...]}
+        self.files = self._load()
+
+    def _run(self, args):
+        # Keep subprocess off the startup path, see tools/check_import_time.py.
+        import subprocess
+
+        p = subprocess.Popen(args, shell=False, cwd=self.hgroot,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (out, err) = p.communicate()
+        if p.returncode:
+            raise AnnotateException("%s failed: %s" % (
+                    ' '.join(args[:3]), err.decode('utf-8', 'replace').strip()))
+        return out
+
+    def _resolve_revision(self, revision):
+        out = self._run(['hg', 'log', '-r', revision, '-T', '{node}'])
+        return out.decode('ascii').strip()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        tmp_path = "%s.%d.tmp" % (self.cache_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self.files, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _components(self, paths):
+        """
+        Returns a mapping of path to [product, component] for all |paths|
+        with a single `mach file-info` call.
+        """
+        out = self._run([os.path.join(self.hgroot, 'mach'), 'file-info',
+                         'bugzilla-component', '--format', 'json'] + paths)
+        return json.loads(out)
+
+    def _annotate(self, paths):
+        """
+        Returns a mapping of path to a list of [node, user] per line for all
+        |paths| with a single `hg annotate` call.
+        """
+        out = self._run(['hg', 'annotate', '-r', self.revision, '-c', '-u',
+                         '-T', 'json'] + paths)
+        return dict((entry['path'],
+                     [[l.get('node'), l.get('user')] for l in entry['lines']])
+                    for entry in json.loads(out))
+
+    def prefetch(self, paths):
+        """
+        Resolves and caches all the |paths| that aren't cached yet.
+        """
+        missing = sorted(set(p for p in paths if p not in self.files))
+        if not missing:
+            return
+
+        # hg aborts the whole batch on a file that isn't in the checkout,
+        # so leave those out.
+        present = [p for p in missing
+                   if os.path.isfile(os.path.join(self.hgroot, p))]
+
+        components = {}
+        annotations = {}
+        failed = False
+        if present:
+            print("Annotating %d files" % len(present))
+            try:
+                components = self._components(present)
+            except (AnnotateException, ValueError) as e:
+                print("Couldn't map components: %s" % e)
+                failed = True
+
+            try:
+                annotations = self._annotate(present)
+            except (AnnotateException, ValueError) as e:
+                print("Couldn't annotate: %s" % e)
+                failed = True
+
+        for path in missing:
+            if failed and path in present:
+                # Don't cache what might be a transient failure.
+                continue
+            self.files[path] = {
+                'component': components.get(path),
+                'lines': annotations.get(path, []),
+            }
+        self._save()
+
+    def resolve(self, locations):
+        """
+        Returns a list of |SourceInfo| for the given (file, line) pairs.
+        """
+        locations = list(locations)
+        self.prefetch([path for (path, _) in locations])
+
+        results = []
+        for (path, line) in locations:
+            entry = self.files.get(path, {})
+            component = entry.get('component')
+            lines = entry.get('lines', [])
+            (node, user) = (None, None)
+            if 0 < line <= len(lines):
+                (node, user) = lines[line - 1]
+
+            results.append(SourceInfo(path, line,
+                                      tuple(component) if component else None,
+                                      node, user))
+        return results
+
+    def component(self, path):
+        """
+        Returns the (product, component) for a single file, or None.
+        """
+        return self.resolve([(path, 0)])[0].component
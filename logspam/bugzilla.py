@@ -2,12 +2,11 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import configparser
-import json
 import os
-import requests
-import subprocess
+import re
 
+from logspam.annotate import AnnotateException, SourceAnnotator
+from logspam.patterns import pattern_from_args
 from logspam.report import (
         ReportCommandLineArgs,
         Warnings,
@@ -17,12 +16,24 @@ from logspam.report import (
 #BUGZILLA_API='https://landfill.bugzilla.org/bugzilla-5.0-branch/rest'
 BUGZILLA_API='https://bugzilla.mozilla.org/rest'
 
-def get_component_info(hgroot, path):
-    p = subprocess.Popen([os.path.join(hgroot, 'mach'), 'file-info', 'bugzilla-component', '--format', 'json', path],
-                         shell=False, cwd=hgroot, stdout=subprocess.PIPE)
-    (out, err) = p.communicate()
-    mappings = json.loads(out)
-    return mappings[path]
+# Meta bug all logspam bugs block.
+META_BUG = 'logspam'
+
+# Extracts the warning text and file from the summaries we file, see
+# |WarningInfo.details|.
+SUMMARY_RE = re.compile(r'instances of "(.*)" emitted from (\S+) during')
+
+def get_component_info(hgroot, path, annotator=None):
+    """
+    Returns the (product, component) of |path|, see |SourceAnnotator|.
+    """
+    if not annotator:
+        annotator = SourceAnnotator(hgroot)
+
+    component = annotator.component(path)
+    if not component:
+        raise AnnotateException("No component found for %s" % path)
+    return component
 
 
 class Bugzilla:
@@ -33,24 +44,60 @@ class Bugzilla:
         self.host = host
 
         if not api_key:
+            import configparser
+
             cfg = configparser.ConfigParser()
             cfg.read(os.path.join(os.path.expanduser('~'), '.hgrc'))
             api_key = cfg.get('bugzilla', 'apikey')
 
         self.api_key = api_key
+        self._session = None
 
-    def post(self, endpoint, data):
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
+    @property
+    def session(self):
+        """
+        Shared session so that consecutive requests reuse the connection.
+        """
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+            self._session.headers.update({
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'
+            })
+        return self._session
+
+    def get(self, endpoint, params=None):
+        params = dict(params or {})
+        params['api_key'] = self.api_key
+        r = self.session.get("%s/%s" % (self.host, endpoint), params=params)
+        return r.json()
 
-        r = requests.post("%s/%s?api_key=%s" % (self.host, endpoint, self.api_key),
-                          json=data, headers=headers)
+    def post(self, endpoint, data):
+        r = self.session.post("%s/%s?api_key=%s" % (self.host, endpoint, self.api_key),
+                              json=data)
         #print r.headers
         #print r.text
         return r.json()
 
+    def logspam_bugs(self):
+        """
+        Returns the bugs blocking the logspam meta bug as a list of dicts
+        with id, summary, status and resolution.
+        """
+        meta = self.get('bug/%s' % META_BUG, {'include_fields': 'depends_on'})
+        ids = meta['bugs'][0]['depends_on'] if meta.get('bugs') else []
+        if not ids:
+            return []
+
+        # Fetch all of them in one request.
+        r = self.get('bug', {
+            'id': ','.join(str(i) for i in ids),
+            'include_fields': 'id,summary,status,resolution',
+        })
+        return r.get('bugs', [])
+
     def create_bug(self, summary, desc, component, product='Core', version='Trunk'):
         """
         Files a bug for the given warning.
@@ -72,28 +119,60 @@ class Bugzilla:
             'description': desc,
             'op_sys': 'All',
             'platform': 'All',
-            'blocks': 'logspam',
+            'blocks': META_BUG,
             'type': 'defect'
         })
 
         return r
 
+
+def find_existing_bugs(bugs):
+    """
+    Maps the (text, file) of each warning we already have a bug for to the
+    bug. Bugs that were fixed are left out so that a warning that came back
+    gets a new bug.
+    """
+    existing = {}
+    for bug in bugs:
+        if bug.get('resolution') == 'FIXED':
+            continue
+        m = SUMMARY_RE.search(bug.get('summary', ''))
+        if m:
+            existing[m.groups()] = bug
+    return existing
+
+
 class FileCommandLineArgs(ReportCommandLineArgs):
     @staticmethod
     def do_file(cmdline):
         warnings = Warnings(cmdline.repo, cmdline.revision, cmdline.platform,
                             cmdline.cache_dir, cmdline.use_cache,
-                            cmdline.warning_re)
+                            pattern_from_args(cmdline))
+
+        annotator = None
+        if cmdline.hgroot:
+            try:
+                annotator = SourceAnnotator(cmdline.hgroot)
+            except (AnnotateException, OSError) as e:
+                print("Couldn't use %s for annotations: %s" % (cmdline.hgroot, e))
+
+        if cmdline.top:
+            return FileCommandLineArgs.file_top(cmdline, warnings, annotator)
+
+        if not cmdline.warning:
+            print("Either a warning or --top is required")
+            return
 
         try:
-            (summary, details, path) = warnings.details(cmdline.warning, cmdline.test_summary_count)
+            (summary, details, path) = warnings.details(
+                    cmdline.warning, cmdline.test_summary_count, annotator)
         except WarningNotFoundException:
             print("There are zero warnings matching %s" % cmdline.warning)
             print("Not filing bug!")
             return
 
         try:
-            bz = Bugzilla(BUGZILLA_API, cmdline.api_key)
+            bz = Bugzilla(cmdline.bugzilla_api, cmdline.api_key)
         except Exception as e:
             print("I'm sorry, I couldn't guess your api key. Please " \
                   "specify it with --api_key")
@@ -103,7 +182,8 @@ class FileCommandLineArgs(ReportCommandLineArgs):
         if not cmdline.component:
             # Try to figure it out.
             try:
-                (product, component) = get_component_info(cmdline.hgroot, path)
+                (product, component) = get_component_info(
+                        cmdline.hgroot, path, annotator)
             except Exception as e:
                 print("Couldn't figure out the component for '%s'. Please " \
                       "specify it with --component" % path)
@@ -120,6 +200,58 @@ class FileCommandLineArgs(ReportCommandLineArgs):
         print(result)
         print("Filed bug %d" % result['id'])
 
+    @staticmethod
+    def file_top(cmdline, warnings, annotator):
+        """
+        Files bugs for the |cmdline.top| most common warnings, skipping the
+        ones that already have an open logspam bug.
+        """
+        try:
+            bz = Bugzilla(cmdline.bugzilla_api, cmdline.api_key)
+        except Exception as e:
+            print("I'm sorry, I couldn't guess your api key. Please " \
+                  "specify it with --api_key")
+            print(e)
+            return
+
+        existing = find_existing_bugs(bz.logspam_bugs())
+        print("Found %d existing logspam bugs" % len(existing))
+
+        filed = []
+        for (warning, (summary, details, path), source) in \
+                warnings.details_for_top(cmdline.top, cmdline.test_summary_count,
+                                         annotator):
+            m = SUMMARY_RE.search(summary)
+            bug = existing.get(m.groups()) if m else None
+            if bug:
+                print("Skipping, already filed as bug %d: %s" % (bug['id'], warning))
+                continue
+
+            if cmdline.component:
+                (product, component) = (cmdline.product, cmdline.component)
+            elif source and source.component:
+                (product, component) = source.component
+            else:
+                print("Skipping, couldn't figure out the component for '%s'" % path)
+                continue
+
+            if cmdline.dry_run:
+                print("Would file in %s :: %s - %s" % (product, component, summary))
+                continue
+
+            result = bz.create_bug(summary, details, component=component,
+                                   product=product)
+            if 'id' not in result:
+                print("Failed to file bug for %s: %s" % (warning, result))
+                continue
+
+            print("Filed bug %d - %s" % (result['id'], summary))
+            filed.append(result['id'])
+            if m:
+                existing[m.groups()] = result
+
+        print("Filed %d bugs" % len(filed))
+
     def add_command(self, p):
        parser = p.add_parser('file',
             help='Files a logspam bug in bugzilla for the given warning.')
@@ -142,4 +274,13 @@ class FileCommandLineArgs(ReportCommandLineArgs):
                        help='Product to file the bug in. Default: Core')
         p.add_argument('--api-key', action='store', default=None,
                        help='The API key to use when creating the bug. Default: extracted from .hgrc')
+        p.add_argument('--top', action='store', default=None, type=int,
+                       metavar='N',
+                       help='File bugs for the N most common warnings instead ' \
+                            'of a single one. Warnings that already have an ' \
+                            'open logspam bug are skipped.')
+        p.add_argument('--dry-run', action='store_true', default=False,
+                       help='Only print the bugs that would be filed.')
+        p.add_argument('--bugzilla-api', action='store', default=BUGZILLA_API,
+                       help='Bugzilla REST endpoint. Default: %s' % BUGZILLA_API)
 
@@ -8,31 +8,42 @@ import io
 import json
 import os
 import re
-import requests
+import shutil
 
 from logspam import WARNING_RE
+from logspam.index import WarningIndex
+from logspam.locks import FileLock
+from logspam.patterns import PatternSet, matches, pattern_key
+from logspam.retriggers import DEFAULT_POLICY, aggregate_entries
+from logspam.sources import is_local_url, open_url
+from logspam.structured import (
+        OUTPUT_ACTIONS,
+        TEST_END,
+        TEST_START,
+        TestAccounting,
+        event_to_line,
+        read_events)
+from logspam.summary import (
+        InvalidSummaryException,
+        JsonLog,
+        SummaryFile,
+        json_to_summary,
+        merge_summaries,
+        summary_path,
+        write_summary)
+from logspam.templates import TemplateAssignments
 
 class CacheFileNotFoundException(Exception):
     pass
 
-def normalize_line(line):
+def normalize_text(line):
     """
-    Normalizes the given line to make comparisons easier. Removes:
+    Normalizes the given line of output to make comparisons easier. Removes:
       - timestamps
       - pids
       - trims file paths
       - stuff that looks like a pointer address
     """
-    line = line.decode('utf-8')
-    try:
-        # Raw logs are now encoded in json
-        json_line = json.loads(line)
-        line = json_line['data']
-    except:
-        # Legacy logs may be plain text, particularly if live_backing.log is
-        # specified.
-        pass
-
     # taskcluster prefixing:
     #   [task 2016-09-20T11:09:35.539828Z] 11:09:35
     line = re.sub(r'^\[task[^\]]+\]\s', '', line)
@@ -59,6 +70,23 @@ def normalize_line(line):
 
     return line
 
+def meta_path(log_path):
+    """
+    Path of the metadata recorded for a normalized log.
+    """
+    return log_path + '.meta.json'
+
+def read_meta(log_path):
+    """
+    Reads the metadata recorded for a normalized log, returns an empty dict
+    if there is none.
+    """
+    try:
+        with open(meta_path(log_path), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
 class CustomEncoder(json.JSONEncoder):
     """
     Custom JSON encoder that handles ParsedLog objects.
@@ -72,58 +100,269 @@ class ParsedLog:
     """
     Represents a log file that was downloaded and processed.
     """
-    def __init__(self, url, job_name, file_name=None):
+    def __init__(self, url, job_name, file_name=None, job_id=None):
         self.url = url
         self.job_name = job_name
         if not file_name:
-            self.fname = os.path.basename(job_name.replace(' ', '_') + '.log')
+            # Retriggers share a job name, the job id keeps their logs apart.
+            suffix = '-%d' % job_id if job_id is not None else ''
+            self.fname = os.path.basename(
+                    job_name.replace(' ', '_') + suffix + '.log')
         else:
             self.fname = file_name
 
         self.warnings = Counter()
+        # Structured (text, file, line) index of |warnings|, built when first
+        # accessed if it's set to None.
+        self._index = WarningIndex()
+        # Template assignments of the push, see |template_id|.
+        self.templates = None
+        # Per-test [warnings, bytes, distinct, duration ms], see
+        # |TestAccounting|.
+        self.tests = {}
+        # Raw log bytes attributable to each warning.
+        self.warning_bytes = Counter()
+        # Size of the raw log and of the normalized log we cached.
+        self.raw_bytes = 0
+        self.normalized_bytes = 0
+        # Raw and normalized size of just the output lines.
+        self.output_bytes = (0, 0)
+        # When matching a |PatternSet|, the warnings matching each pattern.
+        self.pattern_members = {}
 
     def _download_file(self, dest, warning_re):
+        import requests
+
         r = requests.get(self.url, stream=True)
-        with open(dest, 'w') as f:
-            for x in r.iter_lines():
-                if x:
-                    line = normalize_line(x)
-                    self.add_warning(line, warning_re)
-                    f.write(line + '\n')
+        self.normalize_lines(r.iter_lines(), dest, warning_re)
+
+    def normalize_lines(self, lines, dest, warning_re):
+        """
+        Normalizes the raw log |lines| to |dest| and records its metadata.
+        """
+        # Write to a temporary file so an interrupted download never looks
+        # like a complete log.
+        tmp_path = dest + '.part'
+        with io.open(tmp_path, 'w', encoding='utf-8') as f:
+            self._ingest(read_events(lines), warning_re, normalize_text, f)
+
+        os.replace(tmp_path, dest)
+        self._write_meta(dest, warning_re)
+
+    def normalize_stream(self, f, dest, warning_re):
+        """
+        Like |download| for a raw log read from the binary file object |f|.
+        """
+        self.normalize_lines((x.rstrip(b'\r\n') for x in f), dest,
+                             warning_re)
+
+    def _write_meta(self, dest, warning_re):
+        """
+        Records metadata about the raw log next to the normalized one.
+        """
+        with open(meta_path(dest), 'w') as f:
+            json.dump({
+                'url': self.url,
+                'job_name': self.job_name,
+                # Exact size of the normalized log, used to detect truncation.
+                'size': os.path.getsize(dest),
+                'raw_bytes': self.raw_bytes,
+                'normalized_bytes': self.normalized_bytes,
+                'output_raw_bytes': self.output_bytes[0],
+                'output_normalized_bytes': self.output_bytes[1],
+                # Exact raw sizes of the warnings of |warning_re|, they can
+                # only be estimated when the log is re-read with another one.
+                'warning_re': pattern_key(warning_re),
+                'warning_bytes': dict(self.warning_bytes),
+                'test_bytes': dict((test, stats[TestAccounting.BYTES])
+                                   for (test, stats) in self.tests.items()),
+            }, f)
+
+    def _ingest(self, events, warning_re, normalize, out=None, scale=1.0):
+        """
+        Accumulates warnings, their sizes and per-test statistics from a
+        stream of events. Output lines are passed through |normalize| and if
+        |out| is given the normalized log is written to it. Event sizes are
+        multiplied by |scale| to estimate raw sizes.
+        """
+        tests = TestAccounting()
+        raw_bytes = 0
+        normalized_bytes = 0
+        # Raw and normalized sizes of just the output lines, used to
+        # estimate raw sizes when re-reading a normalized log.
+        output_raw_bytes = 0
+        output_normalized_bytes = 0
+        for event in events:
+            raw_bytes += event.size
+
+            duration = None
+            if event.action == TEST_START:
+                tests.start(event)
+            elif event.action == TEST_END:
+                duration = tests.end(event)
+
+            line = event_to_line(event, normalize, duration)
+            if line is None:
+                continue
+
+            normalized_bytes += len(line) + 1
+            if event.action in OUTPUT_ACTIONS:
+                output_raw_bytes += event.size
+                output_normalized_bytes += len(line) + 1
+                if self.add_warning(line, warning_re):
+                    size = int(event.size * scale)
+                    self.warning_bytes[line] += size
+                    tests.warning(line, size)
+
+            if out is not None:
+                out.write(line + '\n')
+
+        self.tests = tests.tests
+        self.raw_bytes = int(raw_bytes * scale)
+        self.normalized_bytes = normalized_bytes
+        self.output_bytes = (output_raw_bytes, output_normalized_bytes)
 
     def download(self, cache_dir, warning_re):
         """
         Downloads the log file and normalizes it. Warnings are also
         accumulated.
         """
-        success = True
-        # Check if we can bypass downloading first.
-        dest = os.path.join(cache_dir, self.fname)
-        if os.path.exists(dest):
-            # Use |io.open| to handle unicode weirdness
-            with io.open(dest, 'r', encoding='utf-8') as f:
-                for x in f:
-                    self.add_warning(x.rstrip(), warning_re)
-        else:
-            success = False
-            for i in range(5):
-                try:
-                    self._download_file(dest, warning_re)
-                    success = True
-                    break
-                except requests.exceptions.ConnectionError:
-                    # TODO(ER): Maybe nuke dest?
-                    self.warnings.clear()
-                    pass
+        # Another process working on the same push might be downloading this
+        # log already, wait for it and reuse its download.
+        with FileLock(cache_dir, self.fname):
+            success = True
+            # Check if we can bypass downloading first.
+            dest = os.path.join(cache_dir, self.fname)
+            if os.path.exists(dest):
+                self.load(dest, warning_re)
+            elif is_local_url(self.url):
+                # Read from a --log-source, see |logspam.sources|.
+                with open_url(self.url) as f:
+                    self.normalize_stream(f, dest, warning_re)
+            else:
+                import requests
+
+                success = False
+                for i in range(5):
+                    try:
+                        self._download_file(dest, warning_re)
+                        success = True
+                        break
+                    except requests.exceptions.ConnectionError:
+                        self.warnings.clear()
+                        self.warning_bytes.clear()
+                        self.index = WarningIndex()
+                        self.tests = {}
+                        self.pattern_members = {}
 
         return success
 
+    def load(self, dest, warning_re):
+        """
+        Accumulates warnings from an already normalized log.
+        """
+        # The raw log is gone, use the sizes recorded when it was downloaded
+        # if they're for the same warnings, scale the normalized sizes by the
+        # ratio recorded then otherwise.
+        meta = read_meta(dest)
+        exact = 'warning_bytes' in meta and \
+                meta.get('warning_re') == pattern_key(warning_re)
+        scale = 1.0
+        if not exact and meta.get('output_normalized_bytes'):
+            scale = float(meta['output_raw_bytes']) / \
+                    meta['output_normalized_bytes']
+
+        # Use |io.open| to handle unicode weirdness
+        with io.open(dest, 'r', encoding='utf-8') as f:
+            # Already normalized.
+            self._ingest(read_events(x.rstrip() for x in f), warning_re,
+                         lambda line: line, scale=scale)
+
+        if 'raw_bytes' in meta:
+            self.raw_bytes = meta['raw_bytes']
+        if exact:
+            self.warning_bytes = Counter(meta['warning_bytes'])
+            for (test, stats) in self.tests.items():
+                stats[TestAccounting.BYTES] = meta['test_bytes'].get(test, 0)
+
     def add_warning(self, line, match_re=WARNING_RE):
         """
         Adds the line to the set of warnings if it contains a warning.
+        |match_re| is either a regex or a |PatternSet|.
+
+        Returns True if the line was a warning.
+        """
+        names = matches(match_re, line)
+        if not names:
+            return False
+
+        if line not in self.warnings:
+            self.index.add(line)
+            if isinstance(match_re, PatternSet):
+                for name in names:
+                    self.pattern_members.setdefault(name, set()).add(line)
+        self.warnings[line] += 1
+        return True
+
+    def select_pattern(self, name):
+        """
+        Restricts the warnings of this log to the ones matching the named
+        pattern.
+        """
+        members = self.pattern_members.get(name, set())
+        self.warnings = Counter(dict(
+                (w, c) for (w, c) in self.warnings.items() if w in members))
+        self.warning_bytes = Counter(dict(
+                (w, b) for (w, b) in self.warning_bytes.items() if w in members))
+        self.index = WarningIndex()
+        for warning in self.warnings:
+            self.index.add(warning)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = WarningIndex()
+            for warning in self.warnings:
+                self._index.add(warning)
+        return self._index
+
+    @index.setter
+    def index(self, value):
+        self._index = value
+
+    def template_id(self, warning):
+        """
+        Returns the id of the template |warning| was assigned, or None if
+        the templates weren't read yet, see |Cache.read_templates|.
+        """
+        if self.templates is None:
+            return None
+        return self.templates.template_id(warning)
+
+    @property
+    def template_ids(self):
+        """
+        Mapping of the warnings of this log to their template id.
         """
-        if re.search(match_re, line):
-            self.warnings[line] += 1
+        return dict((w, self.template_id(w)) for (w, _) in self.iter_warnings())
+
+    def _pattern_indices(self):
+        if not self.pattern_members:
+            return {}
+
+        positions = dict((w, i) for (i, w) in enumerate(self.warnings))
+        return dict((name, sorted(positions[w] for w in members if w in positions))
+                    for (name, members) in self.pattern_members.items())
+
+    def iter_warnings(self):
+        """
+        Iterates over the (warning, count) of the log, see
+        |LazyParsedLog.iter_warnings|.
+        """
+        return iter(self.warnings.items())
+
+    def iter_warning_bytes(self):
+        return iter(self.warning_bytes.items())
 
     def to_json(self):
         """
@@ -133,39 +372,364 @@ class ParsedLog:
             'url': self.url,
             'job_name': self.job_name,
             'fname': self.fname,
-            'warnings': dict(self.warnings)
+            'warnings': dict(self.warnings),
+            # Pattern members are stored as indices into |warnings|.
+            'patterns': self._pattern_indices(),
+            'warning_bytes': dict(self.warning_bytes),
+            'raw_bytes': self.raw_bytes,
+            'normalized_bytes': self.normalized_bytes,
+            'tests': self.tests
         }
 
-def cache_file_path(cache_dir, warning_re):
+class LazyParsedLog(ParsedLog):
     """
-    Generates the cache file name.
+    |ParsedLog| view backed by a binary |SummaryFile|. The warnings Counter and
+    index are only materialized when they're first accessed.
     """
-    if warning_re != WARNING_RE:
-        warning_md5 = hashlib.md5(warning_re).hexdigest()
-        return os.path.join(cache_dir, "results.%s.json" % warning_md5)
-    else:
-        return os.path.join(cache_dir, "results.json")
+    def __init__(self, summary, job):
+        self.summary = summary
+        self.job = job
+        (self.url, self.job_name, self.fname, _, _) = summary.job(job)
+        (self.raw_bytes, self.normalized_bytes) = summary.job_bytes(job)
+        self.templates = None
+        self._warnings = None
+        self._warning_bytes = None
+        self._index = None
+        self._tests = None
+        self._pattern_members = None
+
+    @property
+    def warnings(self):
+        if self._warnings is None:
+            self._warnings = self.summary.job_warnings(self.job)
+        return self._warnings
+
+    @warnings.setter
+    def warnings(self, value):
+        self._warnings = value
+
+    @property
+    def warning_bytes(self):
+        if self._warning_bytes is None:
+            self._warning_bytes = self.summary.job_warning_bytes(self.job)
+        return self._warning_bytes
+
+    @warning_bytes.setter
+    def warning_bytes(self, value):
+        self._warning_bytes = value
+
+    @property
+    def pattern_members(self):
+        if self._pattern_members is None:
+            self._pattern_members = self.summary.job_pattern_members(self.job)
+        return self._pattern_members
+
+    @pattern_members.setter
+    def pattern_members(self, value):
+        self._pattern_members = value
+
+    @property
+    def tests(self):
+        if self._tests is None:
+            self._tests = self.summary.job_tests(self.job)
+        return self._tests
+
+    @tests.setter
+    def tests(self, value):
+        self._tests = value
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = WarningIndex()
+            if self.unmodified():
+                # Use the locations parsed when the summary was written.
+                (_, _, _, first, count) = self.summary.job(self.job)
+                self.summary.add_to_index(self._index, (
+                        w for (_, w, _, _, _) in
+                        self.summary.records(first, count)))
+            else:
+                for warning in self.warnings:
+                    self._index.add(warning)
+        return self._index
+
+    @index.setter
+    def index(self, value):
+        self._index = value
+
+    def unmodified(self):
+        """
+        Whether the warnings of this log are still the ones in the summary,
+        they might have been changed once loaded, see |select_pattern|.
+        """
+        return self._warnings is None and self._warning_bytes is None
+
+    def iter_warnings(self):
+        """
+        Like |warnings| but the counts are read from the summary as they're
+        iterated over rather than kept on the log.
+        """
+        if self._warnings is not None:
+            return iter(self._warnings.items())
+        return self.summary.iter_job_warnings(self.job)
+
+    def iter_warning_bytes(self):
+        if self._warning_bytes is not None:
+            return iter(self._warning_bytes.items())
+        return self.summary.iter_job_warning_bytes(self.job)
+
+    def totals(self):
+        """
+        Returns the total and distinct warning counts without materializing
+        the warnings.
+        """
+        if self._warnings is not None:
+            return (sum(self._warnings.values()), len(self._warnings))
+        return self.summary.job_totals(self.job)
+
+    def __getstate__(self):
+        # The mmap can't be pickled, send a materialized copy instead.
+        state = dict(self.__dict__)
+        state['_warnings'] = self.warnings
+        state['_tests'] = self.tests
+        state['_warning_bytes'] = self.warning_bytes
+        state['_pattern_members'] = self.pattern_members
+        state['_index'] = None
+        state['summary'] = None
+        # The template assignments look warnings up in the summary too.
+        state['templates'] = None
+        return state
+
+def cache_file_path(cache_dir, warning_re, sample=None,
+                    retriggers=DEFAULT_POLICY, job_names=None):
+    """
+    Generates the cache file name. Results of a sample of the jobs, see
+    |logspam.sampling|, of other retrigger policies, see
+    |logspam.retriggers|, and of a subset of the jobs given by |job_names|
+    are kept separate from the default results.
+    """
+    name = "results"
+    if isinstance(warning_re, PatternSet):
+        name += ".%s" % warning_re.key
+    elif warning_re != WARNING_RE:
+        name += ".%s" % hashlib.md5(warning_re.encode('utf-8')).hexdigest()
+
+    if sample:
+        name += ".sample-%s" % sample
+    if retriggers != DEFAULT_POLICY:
+        name += ".retriggers-%s" % retriggers
+    if job_names:
+        name += ".jobs-%s" % hashlib.md5(
+                '\n'.join(sorted(job_names)).encode('utf-8')).hexdigest()[:12]
+
+    return os.path.join(cache_dir, name + ".json")
+
+
+def templates_path(results_path):
+    """
+    Returns the path of the template assignments for a results json file.
+    """
+    return os.path.splitext(results_path)[0] + '.templates.json'
 
 
 class Cache(object):
-    def __init__(self, cache_dir, warning_re):
-        self.path = cache_file_path(cache_dir, warning_re)
+    def __init__(self, cache_dir, warning_re, sample=None,
+                 retriggers=DEFAULT_POLICY, job_names=None):
+        self.path = cache_file_path(cache_dir, warning_re, sample, retriggers,
+                                    job_names)
+        self.summary_path = summary_path(self.path)
+        self.templates_path = templates_path(self.path)
 
     def store_results(self, parsed_logs):
         """
-        Caches the parsed results in a json file.
+        Caches the parsed results in a json file along with a binary summary
+        of the warning counts.
         """
-        with open(self.path, 'w') as f:
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
             json.dump(parsed_logs, f, cls=CustomEncoder)
+        os.replace(tmp_path, self.path)
+
+        write_summary(self.summary_path, parsed_logs)
+        self._remove_templates()
+
+    def partial_path(self, fname):
+        """
+        Path of the results of a single log, see |store_partial|.
+        """
+        (cache_dir, results) = os.path.split(self.path)
+        # Include the pid so processes sharing the cache don't step on each
+        # other's results.
+        return os.path.join(cache_dir, "%s.%d.%s" % (fname, os.getpid(), results))
+
+    def store_partial(self, parsed_log):
+        """
+        Caches the results of a single log so they can be merged later with
+        |merge_partials|, both as json and as a binary summary. Returns the
+        path of the json results.
+        """
+        path = self.partial_path(parsed_log.fname)
+        with open(path, 'w') as f:
+            json.dump(parsed_log, f, cls=CustomEncoder)
+        write_summary(summary_path(path), [parsed_log])
+        return path
+
+    def aggregate_partials(self, paths, policy):
+        """
+        Combines the results written by |store_partial| for several runs of
+        the same job into the first of |paths|, see |aggregate_entries|.
+        Returns its path.
+        """
+        entries = []
+        for path in paths:
+            with open(path, 'r') as f:
+                entries.append(json.load(f))
 
-    def read_results(self):
+        entry = aggregate_entries(entries, policy)
+        with open(paths[0], 'w') as f:
+            json.dump(entry, f)
+        write_summary(summary_path(paths[0]), [JsonLog(entry)])
+        for path in paths[1:]:
+            for p in (path, summary_path(path)):
+                if os.path.isfile(p):
+                    os.remove(p)
+
+        return paths[0]
+
+    def merge_partials(self, paths):
+        """
+        Combines the per-log results written by |store_partial| into the
+        results file. The json entries are concatenated as is rather than
+        being parsed and the binary summary is merged from the per-log ones.
+
+        Returns the merged results, see |read_results|.
+        """
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, 'w') as out:
+            out.write('[')
+            for (i, path) in enumerate(paths):
+                if i:
+                    out.write(', ')
+                with open(path, 'r') as f:
+                    shutil.copyfileobj(f, out)
+            out.write(']')
+        os.replace(tmp_path, self.path)
+
+        summaries = [summary_path(path) for path in paths]
+        if all(os.path.isfile(p) for p in summaries):
+            merge_summaries(self.summary_path, summaries)
+        elif os.path.isfile(self.summary_path):
+            # It's rebuilt from the json results on the next read.
+            os.remove(self.summary_path)
+
+        for path in paths + summaries:
+            if os.path.isfile(path):
+                os.remove(path)
+        self._remove_templates()
+
+        return self.read_results(lazy=True)
+
+    def _remove_templates(self):
+        # The warning ids the templates are stored by are only valid for the
+        # results they were assigned from.
+        if os.path.isfile(self.templates_path):
+            os.remove(self.templates_path)
+
+    def store_templates(self, summary):
+        """
+        Assigns each warning of the binary |summary| a template and caches
+        the assignments, see |read_templates|.
+        """
+        templates = TemplateAssignments.from_summary(summary)
+        tmp_path = "%s.%d.tmp" % (self.templates_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(templates.to_json(), f)
+        os.replace(tmp_path, self.templates_path)
+        return templates
+
+    def read_templates(self, read_only=False, parsed_logs=()):
+        """
+        Returns the |TemplateAssignments| of the cached results and makes
+        them available to |parsed_logs|, see |ParsedLog.template_id|.
+
+        Templates are only mined the first time they're needed, unless
+        |read_only| is set they're then stored for the next read.
+        """
+        templates = self._read_templates(read_only)
+        for log in parsed_logs:
+            log.templates = templates
+        return templates
+
+    def _read_templates(self, read_only):
+        try:
+            summary = self.read_summary(read_only)
+        except (InvalidSummaryException, ValueError) as e:
+            print(e)
+            combined = Counter()
+            for log in self.read_results(read_only=read_only):
+                combined.update(log.warnings)
+            return TemplateAssignments.from_counter(combined)
+
+        if os.path.isfile(self.templates_path) and \
+                os.path.getmtime(self.templates_path) >= os.path.getmtime(self.path):
+            with open(self.templates_path, 'r') as f:
+                stored = json.load(f)
+            if len(stored['ids']) == summary.warning_count:
+                texts = dict((int(i), text)
+                             for (i, text) in stored['templates'].items())
+                return TemplateAssignments(stored['ids'], texts,
+                                           summary.warning_id)
+
+        if read_only:
+            return TemplateAssignments.from_summary(summary)
+        return self.store_templates(summary)
+
+    def read_summary(self, read_only=False):
+        """
+        Returns the binary summary of the cached results, creating it from
+        the json results if needed. If |read_only| is set an out of date
+        summary is never rewritten, an |InvalidSummaryException| is raised
+        instead.
+        """
+        if not os.path.isfile(self.path):
+            raise CacheFileNotFoundException(
+                    "Cache file %s not found" % self.path)
+
+        if not os.path.isfile(self.summary_path) or \
+                os.path.getmtime(self.summary_path) < os.path.getmtime(self.path):
+            if read_only:
+                raise InvalidSummaryException(
+                        "Summary %s is out of date" % self.summary_path)
+            json_to_summary(self.path, self.summary_path)
+
+        return SummaryFile(self.summary_path)
+
+    def read_results(self, lazy=False, read_only=False):
         """
         Reads the cached results from a previous run.
+
+        If |lazy| is set the logs are views backed by the binary summary and
+        their warnings are only loaded when accessed. If |read_only| is set
+        nothing in the cache is created, rewritten or removed, an out of date
+        or corrupt summary is bypassed by reading the json results.
         """
         if not os.path.isfile(self.path):
             raise CacheFileNotFoundException(
                     "Cache file %s not found" % self.path)
 
+        if lazy:
+            try:
+                summary = self.read_summary(read_only)
+                print("Reading cache from %s" % self.summary_path)
+                return [LazyParsedLog(summary, job)
+                        for job in range(summary.job_count)]
+            except (InvalidSummaryException, ValueError) as e:
+                # Fall back to the json results, the summary will be
+                # regenerated the next time it's read.
+                print(e)
+                if not read_only and os.path.isfile(self.summary_path):
+                    os.remove(self.summary_path)
+
         print(("Reading cache from %s" % self.path))
         parsed_logs = []
         with open(self.path, 'r') as f:
@@ -173,7 +737,8 @@ class Cache(object):
                 raw_list = json.load(f)
             except Exception:
                 # Corrupt json file, nuke it.
-                os.remove(self.path)
+                if not read_only:
+                    os.remove(self.path)
                 raise CacheFileNotFoundException(
                         "Cache file %s was corrupt", self.path)
 
@@ -182,6 +747,17 @@ class Cache(object):
                     continue
                 log = ParsedLog(x['url'], x['job_name'], x['fname'])
                 log.warnings.update(x['warnings'])
+                log.tests = x.get('tests', {})
+                if x.get('patterns'):
+                    warnings = list(x['warnings'])
+                    log.pattern_members = dict(
+                            (name, set(warnings[i] for i in indices))
+                            for (name, indices) in x['patterns'].items())
+                log.warning_bytes.update(x.get('warning_bytes', {}))
+                log.raw_bytes = x.get('raw_bytes', 0)
+                log.normalized_bytes = x.get('normalized_bytes', 0)
+                # Only parse the warnings if the index is needed.
+                log.index = None
                 parsed_logs.append(log)
 
         return parsed_logs
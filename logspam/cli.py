@@ -2,7 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from logspam import WARNING_RE
+from logspam import PATTERNS, WARNING_RE
 
 class BaseCommandLineArgs(object):
     """
@@ -18,3 +18,9 @@ class BaseCommandLineArgs(object):
         p.add_argument('--warning-re', action='store', default=WARNING_RE,
                        help='Regex used to match lines. Can be used to match ' \
                             'debug messages that are not proper warnings.')
+        p.add_argument('--patterns', action='append', default=None,
+                       metavar='NAME=REGEX',
+                       help='Match several named patterns in a single pass ' \
+                            'over the logs instead of --warning-re. Can be ' \
+                            'repeated, a bare NAME selects a predefined ' \
+                            'pattern (%s).' % ', '.join(sorted(PATTERNS)))
@@ -10,20 +10,40 @@ Script used as a CLI entry point.
 
 from argparse import ArgumentParser
 
+from logspam import replay
 from logspam.bisect import BisectCommandLineArgs
 from logspam.bugzilla import FileCommandLineArgs
+from logspam.history import HistoryCommandLineArgs
+from logspam.patterns import InvalidPatternException
 from logspam.report import ReportCommandLineArgs
+from logspam.server import ServeCommandLineArgs
+from logspam.verify import CacheCommandLineArgs
 
 def add_arguments(p):
     """
     Adds command-line arguments to the given argparser.
     """
+    p.add_argument('--record', action='store', default=None, metavar='DIR',
+                   help='Record the HTTP responses the command gets into an ' \
+                        'archive in DIR, see --replay.')
+    p.add_argument('--replay', action='store', default=None, metavar='DIR',
+                   help='Serve the HTTP responses recorded by --record from a ' \
+                        'local server instead of going to the network.')
+    p.add_argument('--replay-latency', action='store', type=float, default=0,
+                   metavar='SECONDS',
+                   help='Delay each replayed response. Default: 0')
+    p.add_argument('--replay-bandwidth', action='store', type=float,
+                   default=None, metavar='MB/S',
+                   help='Bandwidth shared by all replayed responses. ' \
+                        'Default: unlimited')
+
     subparsers = p.add_subparsers(
             title='subcommands',
             description='Commands supported by the logspam tool')
 
     for command in (ReportCommandLineArgs, FileCommandLineArgs,
-                    BisectCommandLineArgs):
+                    BisectCommandLineArgs, ServeCommandLineArgs,
+                    CacheCommandLineArgs, HistoryCommandLineArgs):
         args = command()
         args.add_command(subparsers)
 
@@ -33,7 +53,23 @@ def main():
     parser = ArgumentParser()
     add_arguments(parser)
     cmdline = parser.parse_args()
-    cmdline.func(cmdline)
+
+    server = None
+    if cmdline.record:
+        replay.record(cmdline.record)
+    elif cmdline.replay:
+        server = replay.replay(
+                cmdline.replay, cmdline.replay_latency,
+                cmdline.replay_bandwidth and cmdline.replay_bandwidth * 1e6)
+
+    try:
+        cmdline.func(cmdline)
+    except InvalidPatternException as e:
+        parser.error(str(e))
+    finally:
+        if server:
+            print(server.summary())
+            server.stop()
     return
 
 if __name__ == '__main__':
@@ -0,0 +1,274 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Change-point detection over the warning counts of consecutive pushes.
+
+The cached results of each push are loaded into a warnings x pushes matrix.
+Counts are divided by each push's job coverage, ie its number of jobs
+relative to the most complete push, so a push where half the jobs didn't
+run doesn't look like a fix.
+
+For every warning and every split of the pushes into a before and an after
+segment, the difference of the segment means is scored with a pooled
+variance t statistic. Running sums make that a handful of array operations
+over the whole matrix, and the best split of each warning is a candidate
+regression between the last push before it and the first push after it.
+
+Requires numpy, see the `history` extra in setup.py.
+"""
+
+from collections import namedtuple
+import os
+import re
+import shlex
+
+from logspam.cache import CacheFileNotFoundException, Cache
+from logspam.cli import BaseCommandLineArgs
+from logspam.patterns import pattern_from_args
+from logspam.summary import InvalidSummaryException, RECORD
+
+# Cache directories are named <repo>-<revision>-<platform> by default.
+CACHE_DIR_RE = re.compile(r'^.+?-([0-9a-f]{12,40})-.+$')
+
+# Rows of the matrix scored at once, bounds the size of the temporaries.
+CHUNK_ROWS = 2048
+
+Regression = namedtuple('Regression', [
+    'warning', 'good', 'bad', 'before', 'after', 'score'])
+
+
+class HistoryException(Exception):
+    pass
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise HistoryException(
+                "The history command requires numpy, install it with "
+                "`pip install mozilla-log-spam[history]`")
+    return numpy
+
+
+def push_label(cache_dir):
+    """
+    Returns the revision of a push's cache directory, or its name if it
+    doesn't follow the default naming.
+    """
+    name = os.path.basename(os.path.normpath(cache_dir))
+    m = CACHE_DIR_RE.match(name)
+    return m.group(1) if m else name
+
+
+class WarningHistory(object):
+    """
+    Warning counts of a sequence of pushes, oldest first.
+
+      |labels|    the revision of each push
+      |warnings|  the warning of each row
+      |counts|    warnings x pushes array of raw counts
+      |jobs|      number of jobs of each push
+    """
+    def __init__(self, cache_dirs, warning_re):
+        np = _numpy()
+        record = np.dtype([('job', '<u4'), ('warning', '<u4'),
+                           ('count', '<u4'), ('bytes', '<u8'),
+                           ('mask', '<u4')])
+        assert record.itemsize == RECORD.size
+
+        self.labels = []
+        jobs = []
+        # Per push (global warning ids, counts).
+        columns = []
+        ids = {}
+        for cache_dir in cache_dirs:
+            try:
+                summary = Cache(cache_dir, warning_re).read_summary()
+            except (CacheFileNotFoundException, InvalidSummaryException) as e:
+                print("Skipping %s: %s" % (cache_dir, e))
+                continue
+
+            records = np.frombuffer(summary.record_bytes(), dtype=record)
+            totals = np.bincount(records['warning'],
+                                 weights=records['count'],
+                                 minlength=summary.warning_count)
+            local_ids = np.array([ids.setdefault(w, len(ids))
+                                  for w in summary.warnings()], dtype=np.int64)
+            present = totals > 0
+            columns.append((local_ids[present], totals[present]))
+            jobs.append(summary.job_count)
+            self.labels.append(push_label(cache_dir))
+            summary.close()
+
+        self.warnings = [None] * len(ids)
+        for (w, i) in ids.items():
+            self.warnings[i] = w
+
+        self.counts = np.zeros((len(ids), len(columns)), dtype=np.float32)
+        for (push, (rows, totals)) in enumerate(columns):
+            self.counts[rows, push] = totals
+        self.jobs = np.array(jobs, dtype=np.float32)
+
+    def normalized(self):
+        """
+        Returns the counts scaled to the job coverage of the most complete
+        push.
+        """
+        np = _numpy()
+        coverage = self.jobs / max(self.jobs.max(), 1)
+        return self.counts / np.maximum(coverage, 1e-6)
+
+
+def change_points(matrix, min_segment=2, decreases=False):
+    """
+    Finds the largest increase, or decrease with |decreases| set, of each
+    row of |matrix|. Returns arrays of the split (the index of the first
+    push after the change), the before and after means, and the t statistic
+    of the change, which is positive for increases.
+    """
+    np = _numpy()
+    (rows, n) = matrix.shape
+    if n < 2 * min_segment:
+        raise HistoryException(
+                "At least %d pushes are needed" % (2 * min_segment))
+
+    # Candidate splits: the before segment holds the first k pushes.
+    k = np.arange(min_segment, n - min_segment + 1, dtype=np.float64)
+    splits = np.empty(rows, dtype=np.int64)
+    before = np.empty(rows, dtype=np.float64)
+    after = np.empty(rows, dtype=np.float64)
+    score = np.empty(rows, dtype=np.float64)
+
+    for start in range(0, rows, CHUNK_ROWS):
+        x = matrix[start:start + CHUNK_ROWS].astype(np.float64)
+        s = np.cumsum(x, axis=1)
+        q = np.cumsum(x * x, axis=1)
+        (total, total_sq) = (s[:, -1:], q[:, -1:])
+        (s, q) = (s[:, min_segment - 1:n - min_segment],
+                  q[:, min_segment - 1:n - min_segment])
+
+        m1 = s / k
+        m2 = (total - s) / (n - k)
+        # Pooled within-segment variance.
+        ssw = (q - s * s / k) + ((total_sq - q) - (total - s) ** 2 / (n - k))
+        var = np.maximum(ssw / (n - 2), 0)
+        # Keep perfectly flat segments from dividing by zero, a step between
+        # two of them is still the strongest signal there can be.
+        var = np.maximum(var, 1e-6 * np.maximum(m1 * m1 + m2 * m2, 1))
+        t = (m2 - m1) / np.sqrt(var * (1 / k + 1 / (n - k)))
+
+        best = np.argmax(-t if decreases else t, axis=1)
+        r = np.arange(x.shape[0])
+        end = start + x.shape[0]
+        splits[start:end] = best + min_segment
+        before[start:end] = m1[r, best]
+        after[start:end] = m2[r, best]
+        score[start:end] = t[r, best]
+
+    return (splits, before, after, score)
+
+
+def find_regressions(history, min_ratio=2.0, min_delta=10, min_score=5,
+                     min_segment=2, decreases=False):
+    """
+    Returns the candidate |Regression|s of a |WarningHistory|, largest
+    change first. A change must at least multiply the mean count by
+    |min_ratio|, change it by |min_delta| and have a t statistic of
+    |min_score|. With |decreases| set fixes are reported instead.
+    """
+    np = _numpy()
+    if not history.warnings:
+        return []
+
+    (splits, before, after, score) = change_points(history.normalized(),
+                                                   min_segment, decreases)
+    if decreases:
+        # Look for increases going back in time.
+        (before, after, score) = (after, before, -score)
+    delta = after - before
+    grown = np.divide(after, before, out=np.full_like(after, np.inf),
+                      where=before > 0)
+
+    candidates = np.nonzero((score >= min_score) & (delta >= min_delta) &
+                            (grown >= min_ratio))[0]
+    candidates = candidates[np.argsort(-delta[candidates], kind='stable')]
+
+    regressions = []
+    for i in candidates:
+        (b, a) = (before[i], after[i])
+        if decreases:
+            (b, a) = (a, b)
+        regressions.append(Regression(
+                history.warnings[i], history.labels[splits[i] - 1],
+                history.labels[splits[i]], float(b), float(a), float(score[i])))
+    return regressions
+
+
+class HistoryCommandLineArgs(BaseCommandLineArgs):
+    @staticmethod
+    def do_history(cmdline):
+        try:
+            history = WarningHistory(cmdline.cache_dirs,
+                                     pattern_from_args(cmdline))
+            print("Loaded %d warnings across %d pushes" % (
+                    len(history.warnings), len(history.labels)))
+
+            regressions = find_regressions(
+                    history, cmdline.min_ratio, cmdline.min_delta,
+                    cmdline.min_score, cmdline.min_segment, cmdline.fixes)
+        except HistoryException as e:
+            print(e)
+            return
+
+        print("%d candidate %s" % (
+                len(regressions), "fixes" if cmdline.fixes else "regressions"))
+        print("%9s %9s %7s %-12s %-12s %s" % (
+                "before", "after", "t", "good", "bad", "warning"))
+        for r in regressions[:cmdline.count]:
+            print("%9.1f %9.1f %7.1f %-12s %-12s %s" % (
+                    r.before, r.after, r.score, r.good[:12], r.bad[:12],
+                    r.warning))
+
+        if regressions and not cmdline.fixes:
+            r = regressions[0]
+            print("")
+            print("To narrow down the largest one:")
+            print("  log_spam bisect %s %s %s" % (
+                    shlex.quote(r.good), shlex.quote(r.bad),
+                    shlex.quote(r.warning)))
+
+    def add_command(self, p):
+        parser = p.add_parser('history',
+            help='Finds pushes where warnings started, or stopped, showing up '
+                 'from the cached results of consecutive pushes.')
+        self.add_arguments(parser)
+        parser.set_defaults(func=HistoryCommandLineArgs.do_history)
+
+    def add_arguments(self, p):
+        """
+        Adds history specific command-line args.
+        """
+        p.add_argument('cache_dirs', nargs='+', metavar='cache_dir',
+                       help='Cache directories of consecutive pushes, oldest ' \
+                            'first.')
+
+        super(HistoryCommandLineArgs, self).add_arguments(p)
+
+        p.add_argument('--count', action='store', default=40, type=int,
+                       help='Number of changes to list. Default: 40')
+        p.add_argument('--min-ratio', action='store', default=2.0, type=float,
+                       help='Minimum factor a warning\'s mean count must ' \
+                            'change by. Default: 2')
+        p.add_argument('--min-delta', action='store', default=10, type=float,
+                       help='Minimum change of a warning\'s mean count per ' \
+                            'push. Default: 10')
+        p.add_argument('--min-score', action='store', default=5, type=float,
+                       help='Minimum t statistic of a change. Default: 5')
+        p.add_argument('--min-segment', action='store', default=2, type=int,
+                       help='Minimum number of pushes on each side of a ' \
+                            'change. Default: 2')
+        p.add_argument('--fixes', action='store_true', default=False,
+                       help='Report warnings that went away instead.')
@@ -0,0 +1,111 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from functools import lru_cache
+import re
+
+# Extracts the warning text, file name, and line number.
+WARNING_LOCATION_RE = re.compile(
+        r'.*WARNING: (.*)[:,] file ([^,]+), line ([0-9]+).*')
+
+
+@lru_cache(maxsize=65536)
+def locate_warning(warning):
+    """
+    Returns the (text start, text end, file start, file end, line) spans of
+    the location of a warning. The file span is empty if it has none. These
+    are what binary summaries store, see |logspam.summary|.
+    """
+    m = WARNING_LOCATION_RE.match(warning)
+    if m:
+        return m.span(1) + m.span(2) + (int(m.group(3)),)
+
+    return (0, len(warning), 0, 0, 0)
+
+
+def location_from_spans(warning, spans):
+    """
+    Returns the (text, file, line) tuple for the spans returned by
+    |locate_warning|.
+    """
+    (text_start, text_end, file_start, file_end, line) = spans
+    if file_start == file_end:
+        return (warning, "none", 0)
+    return (warning[text_start:text_end], warning[file_start:file_end], line)
+
+
+def parse_warning(warning):
+    """
+    Splits a warning into a (text, file, line) tuple. Warnings that don't
+    include a location are mapped to the "none" file.
+    """
+    return location_from_spans(warning, locate_warning(warning))
+
+
+class WarningIndex(object):
+    """
+    Structured index of warnings. Each warning is parsed once when it is
+    added, unless its location was stored in a binary summary, after that
+    lookups by (text, file) or by file are dictionary lookups.
+    """
+    def __init__(self):
+        self.locations = {}
+        self.by_text_file = {}
+        self.by_file = {}
+
+    def __contains__(self, warning):
+        return warning in self.locations
+
+    def __len__(self):
+        return len(self.locations)
+
+    def add(self, warning, location=None):
+        """
+        Adds the warning to the index if it's not already present. It's only
+        parsed if its (text, file, line) |location| isn't given.
+        """
+        if warning in self.locations:
+            return
+
+        location = location or parse_warning(warning)
+        (text, path, _) = location
+        self.locations[warning] = location
+        self.by_text_file.setdefault((text, path), set()).add(warning)
+        self.by_file.setdefault(path, set()).add(warning)
+
+    def update(self, other):
+        """
+        Merges the entries of another index without reparsing them.
+        """
+        for (warning, location) in other.locations.items():
+            if warning in self.locations:
+                continue
+
+            (text, path, _) = location
+            self.locations[warning] = location
+            self.by_text_file.setdefault((text, path), set()).add(warning)
+            self.by_file.setdefault(path, set()).add(warning)
+
+    def location(self, warning):
+        """
+        Returns the (text, file, line) tuple for the given warning.
+        """
+        return self.locations.get(warning) or parse_warning(warning)
+
+    def variants(self, warning):
+        """
+        Returns all warnings with the same text and file as |warning|,
+        regardless of line number.
+        """
+        (text, path, _) = self.location(warning)
+        return self.by_text_file.get((text, path), set())
+
+    def in_file(self, path):
+        """
+        Returns all warnings emitted from the given file.
+        """
+        return self.by_file.get(path, set())
+
+    def files(self):
+        return self.by_file.keys()
@@ -0,0 +1,135 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+K-way bisection over a list of revisions, oldest first, where the first is
+known good and the last known bad.
+
+Evaluating a revision means downloading a whole push, so rather than one
+midpoint per step each round evaluates |k| evenly spaced revisions at once
+and the range shrinks by a factor of k + 1 instead of 2. Revisions that are
+already cached cost nothing to evaluate and are used before each round.
+When a revision is skipped its nearest untried neighbours, between the
+probes next to it, are evaluated in its place within the same round.
+
+Kept free of mozregression so it can be exercised on its own, see
+|logspam.bisection| for the bisector that uses it.
+"""
+
+GOOD = 'g'
+BAD = 'b'
+SKIP = 's'
+
+
+def spread(indices, k):
+    """
+    Returns |k| evenly spaced elements of |indices|, or all of them if there
+    aren't more.
+    """
+    if len(indices) <= k:
+        return list(indices)
+    return [indices[(j + 1) * len(indices) // (k + 1)] for j in range(k)]
+
+
+def narrow(verdicts):
+    """
+    Returns the (good, bad) indices bounding the change: the first bad
+    revision and the last good one before it.
+    """
+    bad = min(i for (i, v) in verdicts.items() if v == BAD)
+    good = max(i for (i, v) in verdicts.items() if v == GOOD and i < bad)
+    late = [i for (i, v) in verdicts.items() if v == GOOD and i > bad]
+    if late:
+        print("Revisions %s are good after a bad one, the warning might be "
+              "intermittent" % ', '.join(str(i) for i in sorted(late)))
+    return (good, bad)
+
+
+class KWayBisection(object):
+    """
+    Bisects |revisions| with |evaluate_many|, which is given a list of
+    revisions to evaluate concurrently and returns their verdicts ('g', 'b'
+    or 's') in the same order. |is_cached| tells whether evaluating a
+    revision is free.
+    """
+    def __init__(self, revisions, evaluate_many, k, is_cached=None):
+        self.revisions = revisions
+        self.evaluate_many = evaluate_many
+        self.k = max(1, k)
+        self.is_cached = is_cached or (lambda revision: False)
+        # Maps indices into |revisions| to their verdict.
+        self.verdicts = {0: GOOD, len(revisions) - 1: BAD}
+        self.rounds = 0
+        self.evaluated = 0
+
+    def _evaluate(self, indices):
+        results = self.evaluate_many([self.revisions[i] for i in indices])
+        self.verdicts.update(zip(indices, results))
+        self.evaluated += len(indices)
+
+    def _untried(self, lo, hi):
+        return [i for i in range(lo + 1, hi) if i not in self.verdicts]
+
+    def _substitute(self, probes):
+        """
+        Replaces skipped |probes| with their nearest untried neighbours until
+        none are skipped or there's nothing left to try. Only probes within
+        the range the verdicts so far narrowed it down to are replaced.
+        """
+        while True:
+            (lo, hi) = narrow(self.verdicts)
+            probes = [p for p in probes if lo < p < hi]
+            bounds = [lo] + probes + [hi]
+            subs = {}
+            taken = set()
+            for (j, p) in enumerate(probes):
+                if self.verdicts[p] != SKIP:
+                    continue
+                near = sorted((i for i in range(bounds[j] + 1, bounds[j + 2])
+                               if i not in self.verdicts and i not in taken),
+                              key=lambda i: (abs(i - p), i))
+                if near:
+                    subs[p] = near[0]
+                    taken.add(near[0])
+
+            if not subs:
+                return
+            print("Substituting neighbours for %d skipped revisions" % len(subs))
+            self._evaluate(sorted(subs.values()))
+            probes = sorted(subs.get(p, p) for p in probes)
+
+    def run(self):
+        """
+        Returns the (good, bad) revisions the change is between. They're
+        adjacent unless every revision left between them was skipped.
+        """
+        while True:
+            (lo, hi) = narrow(self.verdicts)
+            if hi - lo <= 1:
+                break
+
+            cached = [i for i in self._untried(lo, hi)
+                      if self.is_cached(self.revisions[i])]
+            if cached:
+                print("Evaluating %d cached revisions" % len(cached))
+                self._evaluate(cached)
+                (lo, hi) = narrow(self.verdicts)
+                if hi - lo <= 1:
+                    break
+
+            untried = self._untried(lo, hi)
+            if not untried:
+                print("Every revision between %s and %s was skipped" % (
+                        self.revisions[lo][:12], self.revisions[hi][:12]))
+                break
+
+            self.rounds += 1
+            probes = spread(untried, self.k)
+            print("Round %d: %d revisions between %s and %s, evaluating %d" % (
+                    self.rounds, hi - lo - 1, self.revisions[lo][:12],
+                    self.revisions[hi][:12], len(probes)))
+            self._evaluate(probes)
+            self._substitute(probes)
+
+        return (self.revisions[lo], self.revisions[hi])
@@ -0,0 +1,179 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Cross-process locks for cache directories.
+
+A lock is a file created with O_EXCL holding the owner's host, pid and start
+time. The lock files of a cache directory double as the registry of the
+downloads in progress, so a second process working on the same revision
+waits for a log that's already being downloaded and then reuses it.
+
+Locks left behind by a process that died are broken: on the same host when
+the owning pid is gone, otherwise once they're older than |STALE_AFTER|.
+A stale lock is renamed out of the way before it's removed, so a process
+that raced us to break it and took a fresh lock keeps it.
+"""
+
+import errno
+import json
+import os
+import socket
+import threading
+import time
+
+# Directory, inside a cache directory, holding the lock files.
+LOCK_DIR = '.inprogress'
+
+# Seconds after which a lock held from another host is considered stale.
+STALE_AFTER = 30 * 60
+
+POLL_INTERVAL = 0.5
+
+
+class LockTimeoutException(Exception):
+    pass
+
+
+def lock_path(cache_dir, name):
+    return os.path.join(cache_dir, LOCK_DIR, name + '.lock')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def read_owner(path):
+    """
+    Returns the owner dict of a lock file, or None if it can't be read.
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def is_stale(path, owner=None):
+    if owner is None:
+        owner = read_owner(path)
+    if owner is None:
+        # Either it was just released or the owner died before writing to
+        # it, give it a moment.
+        try:
+            return time.time() - os.path.getmtime(path) > 10
+        except OSError:
+            return False
+
+    if owner.get('host') == socket.gethostname():
+        return not _pid_alive(owner.get('pid', 0))
+    return time.time() - owner.get('time', 0) > STALE_AFTER
+
+
+def in_progress(cache_dir):
+    """
+    Returns a dict of lock name to owner for the live locks in |cache_dir|.
+    """
+    registry = {}
+    try:
+        names = os.listdir(os.path.join(cache_dir, LOCK_DIR))
+    except OSError:
+        return registry
+
+    for name in names:
+        path = os.path.join(cache_dir, LOCK_DIR, name)
+        owner = read_owner(path)
+        if owner and not is_stale(path, owner):
+            registry[name[:-len('.lock')]] = owner
+    return registry
+
+
+class FileLock(object):
+    """
+    Exclusive lock on |name| within |cache_dir|. Blocks until the lock is
+    acquired or |timeout| seconds passed.
+    """
+    def __init__(self, cache_dir, name, timeout=None):
+        self.path = lock_path(cache_dir, name)
+        self.timeout = timeout
+        # Whether we had to wait for another process.
+        self.waited = False
+
+    def _try_acquire(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'time': time.time(),
+            }, f)
+        return True
+
+    def _break_stale(self, stat):
+        """
+        Removes the lock file if it's still the one |stat| was taken of.
+        """
+        broken = "%s.%d.%d.stale" % (self.path, os.getpid(),
+                                     threading.get_ident())
+        try:
+            os.rename(self.path, broken)
+        except OSError:
+            # Someone else broke it first.
+            return
+
+        moved = os.stat(broken)
+        if (moved.st_ino, moved.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+            # Another process broke the stale lock and took a fresh one in
+            # the meantime, give it back unless yet another one took over.
+            try:
+                os.link(broken, self.path)
+            except OSError:
+                pass
+        os.remove(broken)
+
+    def acquire(self):
+        lock_dir = os.path.dirname(self.path)
+        if not os.path.isdir(lock_dir):
+            os.makedirs(lock_dir, exist_ok=True)
+
+        start = time.time()
+        while not self._try_acquire():
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                # Released in the meantime.
+                continue
+            if is_stale(self.path):
+                print("Breaking stale lock %s" % self.path)
+                self._break_stale(stat)
+                continue
+
+            if self.timeout is not None and time.time() - start > self.timeout:
+                raise LockTimeoutException(
+                        "Timed out waiting for %s" % self.path)
+            self.waited = True
+            time.sleep(POLL_INTERVAL)
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
@@ -4,19 +4,22 @@
 
 import datetime
 
-from collections import Counter
-from functools import partial
+from collections import Counter, namedtuple
 
 from logspam import WARNING_RE
+from logspam.index import parse_warning
+from logspam.locks import FileLock, in_progress
+from logspam.retriggers import DEFAULT_POLICY, MAX, MEAN, select_jobs
+from logspam.sampling import job_stratum, stratified_sample, write_strata
+from logspam.scheduler import AdaptiveDownloader, FetchResult, stream_log
+from logspam.sources import DIR, LogSource, iter_members, open_url
+from logspam.structured import OUTPUT_ACTIONS, TEST_START, read_events
 import logspam.cache
 
-import json
-from multiprocessing import Pool
+import io
 import os
 import re
-import requests
 import shutil
-from thclient import TreeherderClient
 
 # Mapping of repo names to their path.
 BRANCH_MAP = {
@@ -29,6 +32,8 @@ BRANCH_MAP = {
 # Magic number for retrieving debug build info from Treeherder
 DEBUG_OPTIONHASH = '32faaecac742100f7753f0c1d0aa0add01b4046b'
 
+HG_URL = 'https://hg.mozilla.org'
+
 class WarningInfo:
     """
     Provides details for a warning.
@@ -37,73 +42,80 @@ class WarningInfo:
         self.full_text = warning_text
         self.count = warning_count
 
-        # Extract the warning text, file name, and line number.
-        m = re.match(r'.*WARNING: (.*)[:,] file ([^,]+), line ([0-9]+).*', warning_text)
-        if m:
-            (self.text, self.file, self.line) = m.group(1, 2, 3)
-        else:
-            self.text = warning_text
-            self.file = "none"
-            self.line = 0
+        (self.text, self.file, self.line) = parse_warning(warning_text)
 
         self.jobs = Counter()
         self.tests = Counter()
+        # Logs the warning couldn't be attributed to tests in, see
+        # |match_in_logs|.
+        self.problems = []
 
     def match_in_logs(self, cache_dir, parsed_logs):
         """
         Finds the number of warnings in each test job and the number of
-        warnings per test and updates |jobs| and |tests|.
+        warnings per test and updates |jobs| and |tests|. Logs where that
+        didn't work out are added to |problems| rather than printed, this
+        also runs in the threads of the query server.
         """
-        warning_re = re.compile(re.escape(self.full_text))
-
         for log in parsed_logs:
             count = log.warnings[self.full_text]
             if not count:
                 continue
 
-            self.jobs[log.job_name] = count
+            # Retriggers share a job name.
+            self.jobs[log.job_name] += count
 
             curr_test = None
             e10s_prefix = '[e10s] ' if 'e10s' in log.job_name else '       '
 
-            with open(os.path.join(cache_dir, log.fname), 'r') as f:
-                for line in f:
-                    # For structured logs the test start info is contained in a
-                    # JSON blob. Try to extract it here and fall back to a
-                    # regex if it doesn't work.
-                    try:
-                        json_line = json.loads(line)
-                        if 'action' in json_line and json_line['action'] == \
-                        'test_start':
-                            curr_test = e10s_prefix + json_line['test']
-                        else:
-                            line = json_line['data']
-                    except:
-                        pass
-
+            path = os.path.join(cache_dir, log.fname)
+            with io.open(path, 'r', encoding='utf-8') as f:
+                for event in read_events(x.rstrip('\n') for x in f):
                     # Check if this is the beginning of a new test.
-                    m = re.search('TEST-START \| (.*)', line)
-                    if m:
-                        curr_test = e10s_prefix + m.group(1)
-
-                    # See if the warning is present in the current line.
-                    try:
-                        if curr_test and warning_re.search(line):
+                    if event.action == TEST_START:
+                        curr_test = e10s_prefix + (event.test or '')
+                    elif curr_test and event.action in OUTPUT_ACTIONS:
+                        # See if the warning is present in the current line.
+                        if self.full_text in event.data:
                             self.tests[curr_test] += 1
-                    except:
-                        # For some reason doing |self.full_text in line| blows
-                        # up when unicode strings are in the line. For now
-                        # switch to regex which hopefully isn't too slow.
-                        print("Can't read line:\n  %s" % line)
 
             if not curr_test:
-                print("No test names matched?")
+                self.problems.append("No test names matched in %s?" % log.job_name)
             elif not self.tests:
-                print("No warnings matched?")
+                self.problems.append("No warnings matched in %s?" % log.job_name)
 
-    def details(self, repo, revision, platform='linux64', test_count=10):
+    @staticmethod
+    def match_all_in_logs(infos, cache_dir, parsed_logs, processes=8):
+        """
+        Like |match_in_logs| for a list of |WarningInfo|s, but each log is
+        only read once and the logs are scanned in parallel.
+        """
+        by_text = dict((info.full_text, info) for info in infos)
+        work = []
+        for log in parsed_logs:
+            present = [t for t in by_text if log.warnings[t]]
+            if not present:
+                continue
+            for text in present:
+                by_text[text].jobs[log.job_name] += log.warnings[text]
+            work.append((os.path.join(cache_dir, log.fname),
+                         'e10s' in log.job_name, present))
+
+        from multiprocessing import Pool
+
+        pool = Pool(processes=processes)
+        try:
+            for tests in pool.imap_unordered(_match_log, work):
+                for (text, counts) in tests.items():
+                    by_text[text].tests.update(counts)
+        finally:
+            pool.close()
+
+    def details(self, repo, revision, platform='linux64', test_count=10,
+                source=None):
         """
         Provides details for the warning suitable for filing in bugzilla.
+        |source| is an optional |SourceInfo| for the warning's location.
 
         Returns a tuple of the summary for a bug and the details for comment #0
         of the bug.
@@ -133,43 +145,183 @@ class WarningInfo:
             details.append("%6d - %s" % (count, test))
         details.append("```")
         details.append("[1] %s" % link)
+        if source and source.node:
+            details.append("")
+            details.append("The line was last changed in %s by %s." % (
+                    source.node[:12], source.user))
 
         return (summary, "\n".join(details), self.file)
 
-def download_log(job, dest, repo, revision, warning_re):
+def _match_log(work):
     """
-    Downloads the log file for the given job.
-
-    Returns the log file name.
+    Process pool worker for |WarningInfo.match_all_in_logs|. Returns a dict
+    of warning to a Counter of the tests it was emitted in.
+    """
+    (path, e10s, texts) = work
+    e10s_prefix = '[e10s] ' if e10s else '       '
+    # Longest first so a warning that's a prefix of another doesn't shadow it.
+    matcher = re.compile('|'.join(
+            re.escape(t) for t in sorted(texts, key=len, reverse=True)))
+
+    tests = dict((t, Counter()) for t in texts)
+    curr_test = None
+    with io.open(path, 'r', encoding='utf-8') as f:
+        for event in read_events(x.rstrip('\n') for x in f):
+            if event.action == TEST_START:
+                curr_test = e10s_prefix + (event.test or '')
+            elif curr_test and event.action in OUTPUT_ACTIONS:
+                for m in matcher.finditer(event.data):
+                    tests[m.group(0)][curr_test] += 1
+
+    return tests
+
+
+def get_job_name(job):
+    """
+    Returns the name used for a treeherder job's |ParsedLog|.
     """
-    job_id = job['id']
     job_name = job['job_type_name']
     if job['job_type_symbol']:
         job_name += " " + job['job_type_symbol'] # Needed for jobs without unique names
+    return job_name
 
-    print("Downloading log for %s %d" % (job_name, job_id))
 
+def get_log_url(job):
+    """
+    Returns the raw log URL for the given job, or None if it can't be
+    determined.
+    """
     try:
         # TODO(ER): We could cleanup log name handling.
         job_log_url = job['url']
+    except KeyError:
+        return None
 
-        # For some jobs errorssummary.log is now the default, but that doesn't
-        # include gecko warnings. Switch over to the raw log.
-        if 'errorsummary.log' in job_log_url:
-            job_log_url = re.sub('errorsummary', 'raw', job_log_url)
+    # For some jobs errorssummary.log is now the default, but that doesn't
+    # include gecko warnings. Switch over to the raw log.
+    if 'errorsummary.log' in job_log_url:
+        job_log_url = re.sub('errorsummary', 'raw', job_log_url)
 
-        print("job_log_url = %s" % job_log_url)
+    return job_log_url
 
-    except:
-        print("Couldn't determine job log URL for %s" % job_name)
-        return None
 
-    parsed_log = logspam.cache.ParsedLog(url=job_log_url, job_name=job_name)
-    if not parsed_log.download(dest, warning_re):
-        print("Couldn't download log URL for %s" % job_name)
-        return None
+# What the cache workers send back to the parent process.
+LogHandle = namedtuple('LogHandle', ['job_name', 'path', 'warning_count'])
+
+
+def normalize_log_to_cache(task):
+    """
+    Process pool worker for |AdaptiveDownloader|. Fetches the log and
+    normalizes it as it downloads if |fetch| is set, or loads the cached log
+    otherwise, and writes its results to the cache.
+
+    Returns a |FetchResult| whose result is a |LogHandle|.
+    """
+    (cache_dir, url, job_name, job_id, fetch, warning_re) = task
+    parsed_log = logspam.cache.ParsedLog(url=url, job_name=job_name,
+                                         job_id=job_id)
+    dest = os.path.join(cache_dir, parsed_log.fname)
+    if fetch:
+        fetched = stream_log(url, lambda lines: parsed_log.normalize_lines(
+                lines, dest, warning_re))
+        if fetched.status != 200:
+            if os.path.exists(dest + '.part'):
+                os.remove(dest + '.part')
+            return fetched
+    else:
+        parsed_log.load(dest, warning_re)
+        fetched = FetchResult(200, 0, 0, None, None, None)
 
-    return parsed_log
+    path = logspam.cache.Cache(cache_dir, warning_re).store_partial(parsed_log)
+    return fetched._replace(result=LogHandle(
+            parsed_log.job_name, path, sum(parsed_log.warnings.values())))
+
+
+def _ingest_log(cache_dir, url, job_name, job_id, warning_re, f):
+    """
+    Normalizes the log read from the binary file object |f|, unless it's
+    already cached, and writes its results to the cache. Returns a
+    |LogHandle|.
+    """
+    parsed_log = logspam.cache.ParsedLog(url=url, job_name=job_name,
+                                         job_id=job_id)
+    dest = os.path.join(cache_dir, parsed_log.fname)
+    with FileLock(cache_dir, parsed_log.fname):
+        if os.path.exists(dest):
+            parsed_log.load(dest, warning_re)
+        else:
+            parsed_log.normalize_stream(f, dest, warning_re)
+
+    path = logspam.cache.Cache(cache_dir, warning_re).store_partial(parsed_log)
+    return LogHandle(parsed_log.job_name, path,
+                     sum(parsed_log.warnings.values()))
+
+
+def ingest_local_log(task):
+    """
+    Process pool worker for |ingest_log_source|, ingests a log of a dir:
+    source. Returns a |LogHandle|.
+    """
+    (cache_dir, url, job_name, job_id, warning_re) = task
+    with open_url(url) as f:
+        return _ingest_log(cache_dir, url, job_name, job_id, warning_re, f)
+
+
+def ingest_tar_logs(task):
+    """
+    Process pool worker for |ingest_log_source|, ingests a run of logs of a
+    tar: source, streaming them from the tarball in the order they're
+    stored. |logs| are (url, job_name, job_id, member, offset) tuples.
+
+    Returns a list of |LogHandle|s.
+    """
+    (cache_dir, path, logs, warning_re) = task
+    members = iter_members(path, [(log[3], log[4]) for log in logs])
+    return [_ingest_log(cache_dir, url, job_name, job_id, warning_re, f)
+            for ((url, job_name, job_id, _, _), (_, f)) in zip(logs, members)]
+
+
+def ingest_log_source(source, jobs, cache_dir, warning_re, processes=None):
+    """
+    Normalizes the logs of the given |LogSource| |jobs| into |cache_dir| in
+    a process pool. Logs of a directory are read by the workers one by one,
+    those of a tarball are split into runs of about the same size that each
+    worker streams from the tarball in a single pass.
+
+    Returns a list of |LogHandle|s.
+    """
+    from multiprocessing import Pool
+
+    processes = processes or os.cpu_count() or 1
+
+    print("Reading %d logs from %s" % (len(jobs), source.spec))
+    pool = Pool(processes=processes)
+    try:
+        if source.kind == DIR:
+            return pool.map(ingest_local_log,
+                            [(cache_dir, job['url'], get_job_name(job),
+                              job['id'], warning_re) for job in jobs])
+
+        logs = sorted((source.offsets[job['member']], job) for job in jobs)
+        # A few runs per worker so they finish at about the same time. Every
+        # run of a compressed tarball decompresses it up to its first log.
+        limit = sum(size for ((_, size), _) in logs) / (2 * processes) + 1
+        runs = [[]]
+        run_size = 0
+        for ((offset, size), job) in logs:
+            if run_size >= limit:
+                runs.append([])
+                run_size = 0
+            runs[-1].append((job['url'], get_job_name(job), job['id'],
+                             job['member'], offset))
+            run_size += size
+
+        results = pool.map(ingest_tar_logs,
+                           [(cache_dir, source.path, run, warning_re)
+                            for run in runs if run])
+        return [handle for run in results for handle in run]
+    finally:
+        pool.close()
 
 
 def add_log_urls_to_jobs(jobs, job_urls):
@@ -201,6 +353,8 @@ def get_latest_revision(repo):
     """
     Gets the latest revision pushed to the given repo.
     """
+    from thclient import TreeherderClient
+
     client = TreeherderClient()
     push_log = client.get_pushes(repo)
 
@@ -217,28 +371,63 @@ def get_latest_revision(repo):
     return
 
 
-def retrieve_test_logs(repo, revision, platform='linux64',
-                       cache_dir=None, use_cache=True,
-                       warning_re=WARNING_RE):
+def _get_push(repo, changeset):
+    """
+    Returns the hg push of |repo| containing |changeset|, with the full
+    details of its changesets, oldest first.
     """
-    Retrieves and processes the test logs for the given revision.
+    import requests
 
-    Returns list of processed files.
+    url = "%s/%s/json-pushes" % (HG_URL, BRANCH_MAP.get(repo, repo))
+    r = requests.get(url, params={'changeset': changeset, 'version': 2,
+                                  'full': 1}, timeout=60)
+    r.raise_for_status()
+    pushes = r.json()['pushes']
+    if not pushes:
+        return None
+    return list(pushes.values())[0]
+
+
+def get_base_revision(repo, revision, base_repo='mozilla-central'):
     """
-    if not cache_dir:
-        cache_dir = "%s-%s-%s" % (repo, revision, platform)
+    Finds the push of |base_repo| that the |revision| push of |repo|, ie a
+    try push, was based on: the push containing the parent of its first
+    changeset.
 
-    cache = logspam.cache.Cache(cache_dir, warning_re)
+    Returns the head revision of that push, or None if it can't be found.
+    """
+    push = _get_push(repo, revision)
+    if not push:
+        print("Failed to find %s in %s" % (revision, repo))
+        return None
 
-    cache_dir_exists = os.path.isdir(cache_dir)
-    if cache_dir_exists and use_cache:
-        # We already have logs for this revision.
-        print("Using cached data")
-        try:
-            return cache.read_results()
-        except logspam.cache.CacheFileNotFoundException as e:
-            print("Cache file for %s not found" % warning_re)
-            print(e)
+    parents = push['changesets'][0]['parents']
+    if not parents:
+        return None
+
+    base = _get_push(base_repo, parents[0])
+    if not base:
+        print("Parent %s of %s isn't in %s" % (parents[0][:12], revision,
+                                               base_repo))
+        return None
+
+    head = base['changesets'][-1]['node']
+    if head != parents[0]:
+        print("%s is based on %s, comparing against the head of its push" % (
+                revision, parents[0][:12]))
+    return head[:12]
+
+
+def get_push_jobs(repo, revision, platform):
+    """
+    Retrieves the completed debug jobs of a push from treeherder, along with
+    their log URLs.
+
+    Returns a list of jobs, or None on failure.
+    """
+    # Keep the network stack out of the cached report path.
+    import requests
+    from thclient import TreeherderClient
 
     client = TreeherderClient()
     print("getting result set")
@@ -276,7 +465,6 @@ def retrieve_test_logs(repo, revision, platform='linux64',
 
     print("getting %d job log urls" % len(jobs))
     job_ids = [ job['id'] for job in jobs ]
-    print(job_ids)
     for x in range(5):
         logs = []
         try:
@@ -296,24 +484,125 @@ def retrieve_test_logs(repo, revision, platform='linux64',
     add_log_urls_to_jobs(jobs, job_logs)
 
     print("got job log urls")
-    print("%s" % jobs)
 
-    if cache_dir_exists:
-        if not use_cache:
-            shutil.rmtree(cache_dir)
-            os.mkdir(cache_dir)
-    else:
-        os.mkdir(cache_dir)
 
-    # Bind fixed arguments to the |download_log| call.
-    partial_download_log = partial(download_log, dest=cache_dir,
-                                  repo=repo, revision=revision,
-                                  warning_re=warning_re)
+    return jobs
 
-    pool = Pool(processes=24)
-    files = pool.map(partial_download_log, jobs)
-    pool.close()
 
-    cache.store_results(files)
+def retrieve_test_logs(repo, revision, platform='linux64',
+                       cache_dir=None, use_cache=True,
+                       warning_re=WARNING_RE, sample=None,
+                       retriggers=DEFAULT_POLICY, log_source=None,
+                       job_names=None):
+    """
+    Retrieves and processes the test logs for the given revision. If
+    |sample| is set only a stratified sample of the jobs is retrieved, see
+    |logspam.sampling|. |retriggers| decides what to do with several runs of
+    the same job, see |logspam.retriggers|. If |log_source| is set the logs
+    are read from a local directory or tarball instead of treeherder, see
+    |logspam.sources|. If |job_names| is set only the jobs with those names
+    are retrieved, cached results of the whole push are used if present.
+
+    Returns list of processed files.
+    """
+    if not cache_dir:
+        cache_dir = "%s-%s-%s" % (repo, revision, platform)
+
+    cache = logspam.cache.Cache(cache_dir, warning_re, sample, retriggers,
+                                job_names)
 
-    return files
+    cache_dir_exists = os.path.isdir(cache_dir)
+    if cache_dir_exists and use_cache:
+        # We already have logs for this revision.
+        print("Using cached data")
+        try:
+            # Views backed by the binary summary, like freshly merged results.
+            return cache.read_results(lazy=True)
+        except logspam.cache.CacheFileNotFoundException as e:
+            print("Cache file for %s not found" % warning_re)
+            print(e)
+
+        if job_names:
+            # The results of the whole push cover any subset of its jobs.
+            full = logspam.cache.Cache(cache_dir, warning_re, sample,
+                                       retriggers)
+            if os.path.isfile(full.path):
+                return [log for log in full.read_results(lazy=True)
+                        if log and log.job_name in job_names]
+
+    if log_source:
+        source = LogSource(log_source)
+        jobs = source.jobs()
+        if not jobs:
+            print("No logs found in %s" % log_source)
+            return None
+    else:
+        jobs = get_push_jobs(repo, revision, platform)
+        if not jobs:
+            return None
+
+    if job_names:
+        matching = [job for job in jobs if get_job_name(job) in job_names]
+        print("Keeping %d of %d jobs matching %d job names" % (
+                len(matching), len(jobs), len(job_names)))
+        jobs = matching
+        if not jobs:
+            return None
+
+    if cache_dir_exists and not use_cache:
+        # Don't pull the directory out from under another process.
+        active = in_progress(cache_dir)
+        if active:
+            print("%d downloads in progress in %s, not clearing it" % (
+                    len(active), cache_dir))
+        else:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    # Another process might be creating it too.
+    os.makedirs(cache_dir, exist_ok=True)
+
+    selected = select_jobs(jobs, retriggers, get_job_name)
+    if len(selected) != len(jobs):
+        print("Skipping %d retriggered jobs" % (len(jobs) - len(selected)))
+        jobs = selected
+
+    if sample:
+        (jobs_sample, strata) = stratified_sample(jobs, sample, seed=revision)
+        print("Sampling %d of %d jobs across %d suites" % (
+                len(jobs_sample), len(jobs), len(strata)))
+        write_strata(cache.path, strata,
+                     dict((get_job_name(job), job_stratum(job)) for job in jobs_sample))
+        jobs = jobs_sample
+
+    if log_source:
+        handles = ingest_log_source(source, jobs, cache_dir, warning_re)
+    else:
+        tasks = []
+        for job in jobs:
+            url = get_log_url(job)
+            if url:
+                tasks.append((url, get_job_name(job), job['id']))
+            else:
+                print("Couldn't determine job log URL for %s" % get_job_name(job))
+
+        # Fetching is network bound and normalizing CPU bound, their
+        # concurrency is tuned separately as the run goes, see
+        # |logspam.scheduler|.
+        downloader = AdaptiveDownloader(cache_dir, warning_re,
+                                        normalize_log_to_cache)
+        handles = downloader.run(tasks)
+
+    handles = [h for h in handles if h]
+    print("Parsed %d of %d logs, %d warnings" % (
+            len(handles), len(jobs), sum(h.warning_count for h in handles)))
+
+    paths = [h.path for h in handles]
+    if retriggers in (MAX, MEAN):
+        runs = {}
+        for h in handles:
+            runs.setdefault(h.job_name, []).append(h.path)
+        paths = [cache.aggregate_partials(p, retriggers) if len(p) > 1 else p[0]
+                 for p in runs.values()]
+
+    # Workers already wrote their results to the cache, merge them without
+    # loading every log into this process.
+    return cache.merge_partials(paths)
@@ -11,25 +11,39 @@ break mach!
 """
 
 from argparse import (ArgumentParser, Namespace)
+from collections import OrderedDict
+import os
 
-from logspam import __version__
+from logspam import __version__, WARNING_RE
 
 from logspam.bisect import BisectCommandLineArgs
 from logspam.bugzilla import FileCommandLineArgs
-from logspam.report import ReportCommandLineArgs
-
-import requests
+from logspam.history import HistoryCommandLineArgs
+from logspam.cache import Cache
+from logspam.logs import get_latest_revision
+from logspam.patterns import pattern_from_args, pattern_key
+from logspam.report import ReportCommandLineArgs, Warnings
+from logspam.retriggers import DEFAULT_POLICY
+from logspam.sketch import top_k
+from logspam.server import ServeCommandLineArgs
+from logspam.verify import CacheCommandLineArgs
 
 ARG_HANDLERS = {
     'report': ReportCommandLineArgs,
     'file': FileCommandLineArgs,
     'bisect': BisectCommandLineArgs,
+    'serve': ServeCommandLineArgs,
+    'cache': CacheCommandLineArgs,
+    'history': HistoryCommandLineArgs,
 }
 
 RUN_HANDLERS = {
     'report': ReportCommandLineArgs.do_report,
     'file': FileCommandLineArgs.do_file,
     'bisect': BisectCommandLineArgs.do_bisect,
+    'serve': ServeCommandLineArgs.do_serve,
+    'cache': CacheCommandLineArgs.do_cache,
+    'history': HistoryCommandLineArgs.do_history,
 }
 
 def new_release_on_pypi():
@@ -39,6 +53,8 @@ def new_release_on_pypi():
     None is returned in case of error or if there is no new version.
     """
     try:
+        import requests
+
         url = "https://pypi.python.org/pypi/mozilla-log-spam/json"
         pypi_version = requests.get(url, timeout=10).json()['info']['version']
     except Exception:
@@ -53,7 +69,8 @@ def parser(subcommand=None):
     be able to handle an ArgumentParser with subcommands properly so we support
     just returning the parser for a given subcommand.
 
-    :param subcommand: Should be one of 'report', 'file', or 'bisect'.
+    :param subcommand: Should be one of 'report', 'file', 'bisect', 'serve',
+                       'cache' or 'history'.
     """
     p = ArgumentParser()
 
@@ -62,7 +79,7 @@ def parser(subcommand=None):
                                       description='valid subcommands',
                                       help='additional help')
 
-        for (_, command) in ARG_HANDLERS.iteritems():
+        for (_, command) in ARG_HANDLERS.items():
             args = command()
             args.add_command(subparsers)
     else:
@@ -71,23 +88,174 @@ def parser(subcommand=None):
     return p
 
 
+def defaults(subcommand):
+    """
+    Returns the default value of every argument of |subcommand|.
+    """
+    return dict((action.dest, action.default)
+                for action in parser(subcommand)._actions
+                if action.dest != 'help')
+
+
 class FakeArgumentParser(object):
     """
     Mach gives us a dictionary of params instead of an argparse named-tuple type
     instance. Here we emulate what argparse would give us where you can do
-    `foo.bar` rather than `foo[bar]`.
+    `foo.bar` rather than `foo[bar]`. Mach only passes the params it knows
+    about, the others get their argparse defaults.
     """
     def __init__(self, entries):
+        self.__dict__.update(defaults(entries['command']))
         self.__dict__.update(entries)
 
 
+class Session(object):
+    """
+    Keeps the |Warnings| of the most recently queried pushes loaded so that
+    repeated queries from a long-lived mach or notebook session don't re-read
+    the cache. A push is reloaded when its results file changes, e.g. after
+    another process re-downloaded it.
+
+    Queries return plain lists and dicts rather than printing.
+    """
+    def __init__(self, max_pushes=8):
+        self.max_pushes = max_pushes
+        # Maps a push key to (results mtime, |Warnings|).
+        self.pushes = OrderedDict()
+        # Maps a repo to its latest revision when it was first queried.
+        self.latest = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, repo, revision, platform, warning_re, cache_dir, sample,
+             approximate, retriggers, pattern, log_source):
+        return (repo, revision, platform, pattern_key(warning_re), cache_dir,
+                sample, approximate, retriggers, pattern, log_source)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def warnings(self, repo, revision, platform='linux1804-64',
+                 warning_re=WARNING_RE, cache_dir=None, use_cache=True,
+                 sample=None, approximate=None, retriggers=DEFAULT_POLICY,
+                 pattern=None, log_source=None):
+        """
+        Returns the |Warnings| for a push, loading it only if it isn't loaded
+        yet or its cached results changed. The arguments are the same as for
+        `log_spam report`, |use_cache| set to False forces a reload. The
+        "latest" revision is only resolved once per session.
+        """
+        if revision == "latest":
+            if repo not in self.latest:
+                self.latest[repo] = get_latest_revision(repo)
+            revision = self.latest[repo]
+        if not cache_dir:
+            cache_dir = "%s-%s-%s" % (repo, revision, platform)
+
+        key = self._key(repo, revision, platform, warning_re, cache_dir,
+                        sample, approximate, retriggers, pattern, log_source)
+        path = Cache(cache_dir, warning_re, sample, retriggers).path
+
+        entry = self.pushes.get(key)
+        if entry and use_cache and entry[0] is not None and \
+                entry[0] == self._mtime(path):
+            self.pushes.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        warnings = Warnings(repo, revision, platform, cache_dir, use_cache,
+                            warning_re, sample, approximate, retriggers,
+                            log_source)
+        if pattern:
+            warnings.select_pattern(pattern)
+
+        self.pushes[key] = (self._mtime(path), warnings)
+        self.pushes.move_to_end(key)
+        if len(self.pushes) > self.max_pushes:
+            self.pushes.popitem(last=False)
+
+        return warnings
+
+    def warnings_for_args(self, cmdline):
+        """
+        Like |warnings| for parsed `log_spam report` arguments.
+        """
+        return self.warnings(
+                cmdline.repo, cmdline.revision, cmdline.platform,
+                pattern_from_args(cmdline), cmdline.cache_dir,
+                cmdline.use_cache, getattr(cmdline, 'sample', None),
+                getattr(cmdline, 'approximate', None),
+                getattr(cmdline, 'retriggers', DEFAULT_POLICY),
+                getattr(cmdline, 'pattern', None),
+                getattr(cmdline, 'log_source', None))
+
+    def top(self, repo, revision, count=40, reverse=False, **options):
+        """
+        Returns the |count| most common warnings of a push as a list of dicts.
+        With |approximate| set the counts are upper bounds and each dict also
+        has the maximum 'error'.
+        """
+        warnings = self.warnings(repo, revision, **options)
+        if warnings.sketch:
+            return [{'warning': warning, 'count': n, 'error': error}
+                    for (warning, n, error) in warnings.sketch.most_common(count)]
+
+        return [{'warning': warning, 'count': n}
+                for (warning, n) in top_k(warnings.combined_warnings, count,
+                                          reverse)]
+
+    def details(self, repo, revision, warning, test_summary_count=10,
+                **options):
+        """
+        Returns the details of a single warning of a push as a dict.
+        """
+        warnings = self.warnings(repo, revision, **options)
+        (summary, details, path) = warnings.details(warning, test_summary_count)
+        return {
+            'warning': warning,
+            'count': warnings.combined_warnings[warning],
+            'summary': summary,
+            'details': details,
+            'file': path,
+        }
+
+    def total(self, repo, revision, **options):
+        """
+        Returns the total number of warnings of a push.
+        """
+        warnings = self.warnings(repo, revision, **options)
+        if warnings.sketch:
+            return warnings.sketch.total
+        return sum(warnings.combined_warnings.values())
+
+    def clear(self):
+        self.pushes.clear()
+        self.latest.clear()
+
+
+# Shared by |run| so that consecutive mach invocations in one process reuse
+# loaded pushes.
+SESSION = Session()
+
+
 def run(options):
     """
     Run logspam given a dict of options.
     """
+    cmdline = FakeArgumentParser(options)
+    if options['command'] == 'report':
+        ReportCommandLineArgs.do_report(cmdline,
+                                        SESSION.warnings_for_args(cmdline))
+        return
+
     # Mach doesn't propagate the `func` param for some reason, so we have to do
     # a manual mapping.
-    RUN_HANDLERS[options['command']](FakeArgumentParser(options))
+    RUN_HANDLERS[options['command']](cmdline)
 
 def test():
     """
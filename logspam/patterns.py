@@ -0,0 +1,125 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Matching of several named warning patterns in a single pass.
+"""
+
+import hashlib
+import re
+
+from logspam import PATTERNS
+
+# Binary summaries record the patterns each warning matched in a 32 bit mask.
+MAX_PATTERNS = 32
+
+
+class InvalidPatternException(Exception):
+    pass
+
+
+class PatternSet(object):
+    """
+    A set of named regexes. All of them are combined into one alternation
+    that's used to reject the vast majority of lines with a single search,
+    only candidate lines are checked against the individual patterns so that
+    overlapping patterns are all reported.
+    """
+    def __init__(self, patterns):
+        if not patterns:
+            raise InvalidPatternException("At least one pattern is required")
+
+        self.patterns = list(patterns)
+        if len(self.patterns) > MAX_PATTERNS:
+            raise InvalidPatternException(
+                "At most %d patterns are supported, got %d" % (
+                    MAX_PATTERNS, len(self.patterns)))
+
+        self.names = [name for (name, _) in self.patterns]
+        if len(set(self.names)) != len(self.names):
+            raise InvalidPatternException("Pattern names must be unique")
+
+        try:
+            self.compiled = [(name, re.compile(regex))
+                             for (name, regex) in self.patterns]
+        except re.error as e:
+            raise InvalidPatternException("Invalid pattern: %s" % e)
+
+        try:
+            self.combined = re.compile('|'.join(
+                    '(?:%s)' % regex for (_, regex) in self.patterns))
+        except re.error:
+            # Patterns with global inline flags can't be combined, fall back
+            # to checking each of them.
+            self.combined = None
+
+    @classmethod
+    def parse(cls, specs):
+        """
+        Creates a PatternSet from a list of NAME=REGEX strings. A bare NAME
+        refers to one of the predefined |PATTERNS|.
+        """
+        patterns = []
+        for spec in specs:
+            (name, sep, regex) = spec.partition('=')
+            if not sep:
+                if name not in PATTERNS:
+                    raise InvalidPatternException(
+                        "Unknown pattern %s, expected NAME=REGEX or one of: %s" % (
+                            name, ', '.join(sorted(PATTERNS))))
+                regex = PATTERNS[name]
+            patterns.append((name, regex))
+
+        return cls(patterns)
+
+    @property
+    def key(self):
+        """
+        Stable identifier used to name the cache file.
+        """
+        spec = '\n'.join('%s=%s' % p for p in self.patterns)
+        return hashlib.md5(spec.encode('utf-8')).hexdigest()
+
+    def match(self, line):
+        """
+        Returns the names of all the patterns matching |line|.
+        """
+        if self.combined is not None and not self.combined.search(line):
+            return []
+
+        return [name for (name, regex) in self.compiled if regex.search(line)]
+
+    def __repr__(self):
+        return 'PatternSet(%r)' % self.patterns
+
+
+def matches(warning_re, line):
+    """
+    Returns the names of the patterns matching |line|. |warning_re| may be
+    a regex string, in which case the single pattern is named 'default', or
+    a |PatternSet|.
+    """
+    if isinstance(warning_re, PatternSet):
+        return warning_re.match(line)
+
+    return ['default'] if re.search(warning_re, line) else []
+
+
+def pattern_key(warning_re):
+    """
+    Returns a string identifying a regex string or |PatternSet|.
+    """
+    if isinstance(warning_re, PatternSet):
+        return warning_re.key
+    return warning_re
+
+
+def pattern_from_args(cmdline):
+    """
+    Returns the matcher to use for the given parsed command-line: a
+    |PatternSet| if --patterns was given, the --warning-re regex otherwise.
+    """
+    if getattr(cmdline, 'patterns', None):
+        return PatternSet.parse(cmdline.patterns)
+    return cmdline.warning_re
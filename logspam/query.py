@@ -0,0 +1,164 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Read-only query API over cached warning data.
+
+Unlike |logspam.report.Warnings| nothing here touches the network, a push
+has to be retrieved with `log_spam report` first.
+"""
+
+from collections import Counter
+import os
+
+from logspam import WARNING_RE
+from logspam.cache import Cache, LazyParsedLog, cache_file_path
+from logspam.index import WarningIndex
+from logspam.logs import WarningInfo
+from logspam.sketch import top_k
+
+
+class WarningNotFoundException(Exception):
+    pass
+
+
+def default_cache_dir(repo, revision, platform, root='.'):
+    """
+    Returns the cache directory `log_spam report` uses for a push.
+    """
+    return os.path.join(root, "%s-%s-%s" % (repo, revision, platform))
+
+
+class WarningQuery(object):
+    """
+    Queries over the cached results of a single push.
+    """
+    def __init__(self, cache_dir, warning_re=WARNING_RE):
+        self.cache_dir = cache_dir
+        self.warning_re = warning_re
+        self.path = cache_file_path(cache_dir, warning_re)
+        self.mtime = os.path.getmtime(self.path) \
+            if os.path.isfile(self.path) else None
+
+        # Queries may run next to `log_spam report` on the same cache, so
+        # leave fixing up out of date or corrupt files to it.
+        cache = Cache(cache_dir, warning_re)
+        self.logs = [log for log in cache.read_results(lazy=True, read_only=True)
+                     if log]
+
+        self.index = WarningIndex()
+        if self.logs and isinstance(self.logs[0], LazyParsedLog):
+            # Sum the fixed width records directly rather than building a
+            # Counter per job.
+            (self.combined_warnings, _) = self.logs[0].summary.combine(
+                    index=self.index)
+        else:
+            self.combined_warnings = Counter()
+            for log in self.logs:
+                self.combined_warnings.update(log.warnings)
+                self.index.update(log.index)
+
+    @classmethod
+    def for_push(cls, repo, revision, platform, root='.',
+                 warning_re=WARNING_RE):
+        return cls(default_cache_dir(repo, revision, platform, root),
+                   warning_re)
+
+    def is_stale(self):
+        """
+        Whether the cached results changed since they were loaded.
+        """
+        try:
+            return os.path.getmtime(self.path) != self.mtime
+        except OSError:
+            return True
+
+    def total(self):
+        return sum(self.combined_warnings.values())
+
+    def top(self, count=40, reverse=False):
+        """
+        Returns the |count| most common warnings as a list of dicts.
+        """
+        return [{'warning': warning, 'count': n}
+                for (warning, n) in top_k(self.combined_warnings, count, reverse)]
+
+    def warning(self, warning, test_count=10):
+        """
+        Returns the details of a single warning, including the per-job and
+        per-test breakdowns and the logs it couldn't be attributed to tests
+        in.
+        """
+        if warning not in self.combined_warnings:
+            raise WarningNotFoundException(
+                "Provided warning %s was not found" % warning)
+
+        info = WarningInfo(warning, self.combined_warnings[warning])
+        info.match_in_logs(self.cache_dir, self.logs)
+
+        return {
+            'warning': warning,
+            'count': info.count,
+            'text': info.text,
+            'file': info.file,
+            'line': int(info.line),
+            'variants': sorted(self.index.variants(warning)),
+            'jobs': [{'job_name': job, 'count': n}
+                     for (job, n) in info.jobs.most_common()],
+            'tests': [{'test': test, 'count': n}
+                      for (test, n) in info.tests.most_common(test_count)],
+            'problems': info.problems,
+        }
+
+    def jobs(self):
+        """
+        Returns the per-job breakdown of warnings, noisiest job first.
+        """
+        jobs = []
+        for log in self.logs:
+            if isinstance(log, LazyParsedLog):
+                (total, distinct) = log.totals()
+            else:
+                (total, distinct) = (sum(log.warnings.values()), len(log.warnings))
+
+            jobs.append({
+                'job_name': log.job_name,
+                'url': log.url,
+                'count': total,
+                'distinct': distinct,
+                'raw_bytes': log.raw_bytes,
+                'normalized_bytes': log.normalized_bytes,
+            })
+
+        return sorted(jobs, key=lambda j: j['count'], reverse=True)
+
+    def job(self, job_name, count=40):
+        """
+        Returns the most common warnings for a single job.
+        """
+        warnings = Counter()
+        for log in self.logs:
+            if log.job_name == job_name:
+                warnings.update(log.warnings)
+
+        return [{'warning': warning, 'count': n}
+                for (warning, n) in warnings.most_common(count)]
+
+    def diff(self, base, count=40):
+        """
+        Compares this push against |base|, another |WarningQuery|. Returns the
+        warnings with the largest absolute change.
+        """
+        delta = Counter(self.combined_warnings)
+        delta.subtract(base.combined_warnings)
+
+        changes = sorted(((w, n) for (w, n) in delta.items() if n),
+                         key=lambda x: abs(x[1]), reverse=True)
+
+        return [{
+            'warning': warning,
+            'before': base.combined_warnings[warning],
+            'after': self.combined_warnings[warning],
+            'delta': n,
+        } for (warning, n) in changes[:count]]
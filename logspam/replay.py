@@ -0,0 +1,301 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Record and replay of the HTTP traffic of a run, so performance work can be
+measured offline and reproducibly.
+
+Treeherder, Bugzilla, mozregression and the log downloads all go through
+requests, so recording hooks its HTTPAdapter and stores every response in
+an archive directory:
+
+  index/<key>.json   the request's method and URL, the response status,
+                     headers and the hash of its body
+  bodies/<hash>.gz   gzipped response bodies, shared by identical responses
+
+Replaying serves the archive from a local HTTP server that every request is
+redirected to, optionally delaying each response by |latency| and sharing a
+fixed |bandwidth| between all connections. Requests that weren't recorded
+get a 404.
+
+The hook is installed in the current process and inherited by forked pool
+workers, so it has to be installed before any pool is created.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Response headers worth replaying, the body is always stored decoded.
+RECORDED_HEADERS = ('Content-Type', 'Retry-After', 'Location')
+
+CHUNK = 16 * 1024
+
+
+class ReplayException(Exception):
+    pass
+
+
+def canonical_url(url):
+    """
+    Sorts the query parameters of |url| so the key of a request doesn't
+    depend on the order they were passed in.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+
+
+def request_key(method, url, body=None):
+    """
+    Returns the archive key of a request.
+    """
+    h = hashlib.sha1()
+    h.update(method.upper().encode('utf-8'))
+    h.update(b' ')
+    h.update(canonical_url(url).encode('utf-8'))
+    if body:
+        h.update(b'\n')
+        h.update(body if isinstance(body, bytes) else body.encode('utf-8'))
+    return h.hexdigest()
+
+
+class Archive(object):
+    """
+    Recorded responses on disk. Several processes can record into the same
+    archive, every file is written once through a rename.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _index_path(self, key):
+        return os.path.join(self.path, 'index', key + '.json')
+
+    def _body_path(self, digest):
+        return os.path.join(self.path, 'bodies', digest + '.gz')
+
+    @staticmethod
+    def _write(path, data):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def store(self, key, method, url, status, headers, body):
+        digest = hashlib.sha1(body).hexdigest()
+        if not os.path.isfile(self._body_path(digest)):
+            self._write(self._body_path(digest), gzip.compress(body))
+
+        entry = {
+            'method': method,
+            'url': url,
+            'status': status,
+            'headers': dict((k, v) for (k, v) in headers.items()
+                            if k.title() in RECORDED_HEADERS),
+            'body': digest,
+            'size': len(body),
+        }
+        self._write(self._index_path(key), json.dumps(entry).encode('utf-8'))
+
+    def load(self, key):
+        """
+        Returns the (entry, body) recorded for |key|, or None.
+        """
+        try:
+            with open(self._index_path(key), 'r') as f:
+                entry = json.load(f)
+            with gzip.open(self._body_path(entry['body']), 'rb') as f:
+                return (entry, f.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def entries(self):
+        try:
+            return len(os.listdir(os.path.join(self.path, 'index')))
+        except OSError:
+            return 0
+
+
+class Bandwidth(object):
+    """
+    Token bucket of |rate| bytes per second shared by all connections.
+    Taking more than is available goes into debt that the caller sleeps
+    off, so a chunk larger than a second's worth of bandwidth still goes
+    through.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 0
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def take(self, n):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _hook(send):
+    """
+    Replaces requests' HTTPAdapter.send with |send|, which is given the
+    original method as its first argument.
+    """
+    from requests.adapters import HTTPAdapter
+
+    original = getattr(HTTPAdapter, '_logspam_send', HTTPAdapter.send)
+    HTTPAdapter._logspam_send = original
+
+    def hooked(adapter, request, *args, **kwargs):
+        return send(original, adapter, request, *args, **kwargs)
+    HTTPAdapter.send = hooked
+
+
+def unhook():
+    from requests.adapters import HTTPAdapter
+
+    if hasattr(HTTPAdapter, '_logspam_send'):
+        HTTPAdapter.send = HTTPAdapter._logspam_send
+        del HTTPAdapter._logspam_send
+
+
+def record(path):
+    """
+    Records the responses to every request made from now on into the
+    archive at |path|.
+    """
+    archive = Archive(path)
+
+    def send(original, adapter, request, *args, **kwargs):
+        response = original(adapter, request, *args, **kwargs)
+        # Reading the content here keeps it available to streaming callers.
+        body = response.content or b''
+        archive.store(request_key(request.method, request.url, request.body),
+                      request.method, request.url, response.status_code,
+                      response.headers, body)
+        return response
+
+    _hook(send)
+    print("Recording HTTP traffic to %s" % path)
+    return archive
+
+
+class ReplayServer(object):
+    """
+    Serves an |Archive| over HTTP on a local port.
+    """
+    def __init__(self, archive, latency=0, bandwidth=None):
+        # http.server is comparatively slow to import, see |logspam.server|.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.archive = archive
+        self.latency = latency
+        self.bandwidth = Bandwidth(bandwidth) if bandwidth else None
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.missing = 0
+        self.bytes_served = 0
+
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _respond(self):
+                replay.serve(self, self.path.strip('/'))
+
+            do_GET = do_POST = do_PUT = do_HEAD = _respond
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def serve(self, handler, key):
+        # Consume the request body, if any, so the connection stays usable.
+        length = int(handler.headers.get('Content-Length') or 0)
+        if length:
+            handler.rfile.read(length)
+
+        recorded = self.archive.load(key)
+        with self.lock:
+            self.requests += 1
+            if recorded is None:
+                self.missing += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if recorded is None:
+            handler.send_response(404)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+
+        (entry, body) = recorded
+        handler.send_response(entry['status'])
+        for (name, value) in entry['headers'].items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if handler.command == 'HEAD':
+            return
+
+        for i in range(0, len(body), CHUNK):
+            chunk = body[i:i + CHUNK]
+            if self.bandwidth:
+                self.bandwidth.take(len(chunk))
+            handler.wfile.write(chunk)
+
+        with self.lock:
+            self.bytes_served += len(body)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def summary(self):
+        return "Replayed %d requests, %d bytes, %d not recorded" % (
+                self.requests, self.bytes_served, self.missing)
+
+
+def replay(path, latency=0, bandwidth=None):
+    """
+    Redirects every request made from now on to a |ReplayServer| for the
+    archive at |path|. |latency| is in seconds and |bandwidth| in bytes per
+    second. Returns the server.
+    """
+    archive = Archive(path)
+    if not archive.entries():
+        raise ReplayException("No recorded responses in %s" % path)
+
+    server = ReplayServer(archive, latency, bandwidth)
+    base = 'http://127.0.0.1:%d/' % server.port
+
+    def send(original, adapter, request, *args, **kwargs):
+        if not request.url.startswith(base):
+            request.url = base + request_key(request.method, request.url,
+                                             request.body)
+        # Don't let proxy settings send the local requests elsewhere.
+        kwargs['proxies'] = {}
+        return original(adapter, request, *args, **kwargs)
+
+    _hook(send)
+    print("Replaying HTTP traffic from %s (%d responses)" % (
+            path, archive.entries()))
+    return server
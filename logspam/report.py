@@ -3,9 +3,17 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from collections import Counter
+import os
+
+from logspam.cache import Cache, LazyParsedLog
 from logspam.cli import BaseCommandLineArgs
-from logspam.logs import (get_latest_revision, retrieve_test_logs, WarningInfo)
-import re
+from logspam.index import WarningIndex
+from logspam.logs import (get_base_revision, get_latest_revision,
+                          retrieve_test_logs, WarningInfo)
+from logspam.patterns import PatternSet, matches, pattern_from_args
+from logspam.retriggers import DEFAULT_POLICY, POLICIES
+from logspam.sampling import SampleEstimate, read_strata
+from logspam.sketch import SpaceSaving, top_k
 
 class InvalidRegexException(Exception):
     pass
@@ -15,7 +23,9 @@ class WarningNotFoundException(Exception):
 
 class Warnings(object):
     def __init__(self, repo, revision, platform,
-                 cache_dir, use_cache, warning_re):
+                 cache_dir, use_cache, warning_re, sample=None,
+                 approximate=None, retriggers=DEFAULT_POLICY, log_source=None,
+                 job_names=None):
 
         if revision == "latest":
             revision = get_latest_revision(repo)
@@ -24,66 +34,412 @@ class Warnings(object):
         self.revision = revision
         self.platform = platform
         self.warning_re = warning_re
+        # Capacity of the heavy hitters sketch, exact counts are kept if
+        # this isn't set.
+        self.approximate = approximate
 
         if not cache_dir:
             cache_dir = "%s-%s-%s" % (repo, revision, platform)
         self.cache_dir = cache_dir
 
         files = retrieve_test_logs(repo, revision, platform,
-                                   cache_dir, use_cache, warning_re)
-        self.logs = [f for f in files if f]
+                                   cache_dir, use_cache, warning_re, sample,
+                                   retriggers, log_source, job_names)
+        self.logs = [f for f in files or [] if f]
+        self._combine()
+
+        self.cache = Cache(cache_dir, warning_re, sample, retriggers, job_names)
+        if job_names and not os.path.isfile(self.cache.path):
+            # The jobs were read from the results of the whole push, see
+            # |retrieve_test_logs|.
+            self.cache = Cache(cache_dir, warning_re, sample, retriggers)
+
+        self.sample = None
+        if sample:
+            (strata, job_strata) = read_strata(
+                    Cache(cache_dir, warning_re, sample, retriggers).path)
+            self.sample = SampleEstimate(self.logs, strata, job_strata)
 
+    def _combine(self):
         self.combined_warnings = Counter()
+        self.warning_bytes = Counter()
+        self.raw_bytes = 0
+        self.index = WarningIndex()
+        self.sketch = None
+
+        if self.approximate:
+            self._combine_approximate()
+            return
+
+        # Logs backed by a binary summary are summed from its records rather
+        # than building a Counter per job.
+        by_summary = {}
+        for log in self.logs:
+            if isinstance(log, LazyParsedLog) and log.unmodified():
+                by_summary.setdefault(log.summary, []).append(log.job)
+            else:
+                self.combined_warnings.update(log.warnings)
+                self.warning_bytes.update(log.warning_bytes)
+            self.raw_bytes += log.raw_bytes
+
+        for (summary, jobs) in by_summary.items():
+            (counts, sizes) = summary.combine(jobs, self.index)
+            self.combined_warnings.update(counts)
+            self.warning_bytes.update(sizes)
+
+        for warning in self.combined_warnings:
+            self.index.add(warning)
+
+    def _combine_approximate(self):
+        """
+        Like |_combine| but only the heavy hitters are kept, so memory is
+        bounded by the sketch capacity rather than the number of distinct
+        warnings.
+        """
+        self.sketch = SpaceSaving(self.approximate)
+        # Stream each log's counts, the logs are read from the binary summary
+        # and don't keep them.
         for log in self.logs:
-            self.combined_warnings.update(log.warnings)
+            for (warning, count) in log.iter_warnings():
+                self.sketch.add(warning, count)
+            self.raw_bytes += log.raw_bytes
+
+        for (warning, count, _) in self.sketch.most_common():
+            self.combined_warnings[warning] = count
+            self.index.add(warning)
+
+        for log in self.logs:
+            for (warning, size) in log.iter_warning_bytes():
+                if warning in self.combined_warnings:
+                    self.warning_bytes[warning] += size
+
+    def select_pattern(self, name):
+        """
+        Restricts the report to warnings matching one pattern of the
+        |PatternSet| the logs were parsed with.
+        """
+        if not isinstance(self.warning_re, PatternSet) or \
+                name not in self.warning_re.names:
+            raise InvalidRegexException(
+                "Pattern %s was not passed to --patterns" % name)
+
+        for log in self.logs:
+            log.select_pattern(name)
+        self._combine()
+        if self.sample:
+            self.sample = SampleEstimate(self.logs, self.sample.strata,
+                                         self.sample.job_strata)
 
     def top(self, warning_count, reverse=False):
+        if self.sketch:
+            return self.top_approximate(warning_count, reverse)
+
         print("Top %d Warnings" % warning_count)
         print("===============")
-        most_common = self.combined_warnings.most_common()
-
-        if reverse:
-            warnings_list = most_common[:-warning_count:-1]
-        else:
-            warnings_list = most_common[:warning_count]
+        warnings_list = top_k(self.combined_warnings, warning_count, reverse)
 
         for (warning, count) in warnings_list:
             print("%6d %s" % (count, warning))
 
         print("TOTAL WARNINGS: %d" % sum(self.combined_warnings.values()))
 
-    def details(self, warning, test_summary_count):
+    def top_approximate(self, warning_count, reverse=False):
+        """
+        Like |top| using the heavy hitters sketch. Counts are upper bounds,
+        the true count is within the given error below them.
+        """
+        if reverse:
+            print("The least common warnings aren't tracked with --approximate")
+            return
+
+        print("Top %d Warnings (APPROXIMATE)" % warning_count)
+        print("=============================")
+        print("%7s %7s %s" % ("~count", "error", "warning"))
+        for (warning, count, error) in self.sketch.most_common(warning_count):
+            print("~%6d %7d %s" % (count, error, warning))
+
+        print("TOTAL WARNINGS: %d" % self.sketch.total)
+        print("TRACKED WARNINGS: %d (capacity %d)" % (
+                len(self.sketch), self.sketch.capacity))
+
+    def top_estimated(self, warning_count):
+        """
+        Like |top| for a sampled push, the counts are extrapolated to the
+        whole push.
+        """
+        print("Top %d Warnings (ESTIMATED from %d of %d jobs)" % (
+                warning_count, self.sample.sampled_jobs(),
+                self.sample.total_jobs()))
+        print("=================================================")
+        print("%9s %9s %6s %s" % ("~count", "95% CI", "seen", "warning"))
+        for (warning, estimate, ci) in self.sample.most_common(warning_count):
+            print("~%8d %s%8d %6d %s" % (estimate, u'\u00b1', ci,
+                                         self.combined_warnings[warning], warning))
+
+        if self.sample.missing:
+            print("Not extrapolated, no logs for: %s" % ', '.join(self.sample.missing))
+        print("ESTIMATED TOTAL WARNINGS: ~%d" % sum(
+                est for (_, est, _) in self.sample.most_common()))
+        print("SAMPLED WARNINGS: %d" % sum(self.combined_warnings.values()))
+
+    def top_bytes(self, warning_count, reverse=False):
+        """
+        Like |top| but warnings are ranked by the raw log bytes they account
+        for.
+        """
+        print("Top %d Warnings by Size" % warning_count)
+        print("=======================")
+        warnings_list = top_k(self.warning_bytes, warning_count, reverse)
+
+        total = float(self.raw_bytes or 1)
+        print("%6s %12s %6s %s" % ("count", "bytes", "share", "warning"))
+        for (warning, size) in warnings_list:
+            print("%6d %12d %5.2f%% %s" % (
+                    self.combined_warnings[warning], size,
+                    100 * size / total, warning))
+
+        warning_bytes = sum(self.warning_bytes.values())
+        print("TOTAL WARNINGS: %d" % sum(self.combined_warnings.values()))
+        print("TOTAL WARNING BYTES: %d (%.2f%% of %d log bytes)" % (
+                warning_bytes, 100 * warning_bytes / total, self.raw_bytes))
+
+    def top_templates(self, warning_count, reverse=False):
+        """
+        Like |top| but near-duplicate warnings are grouped by the template
+        they were assigned when the results were cached.
+        """
+        templates = self.cache.read_templates(parsed_logs=self.logs)
+        combined = Counter()
+        variants = Counter()
+        for (warning, count) in self.combined_warnings.items():
+            template_id = templates.template_id(warning)
+            combined[template_id] += count
+            variants[template_id] += 1
+
+        print("Top %d Warning Templates" % warning_count)
+        print("========================")
+        templates_list = top_k(combined, warning_count, reverse)
+
+        for (template_id, count) in templates_list:
+            print("%6d %s (%d variants)" % (
+                    count, templates.text(template_id), variants[template_id]))
+
+        print("TOTAL TEMPLATES: %d" % len(combined))
+        print("TOTAL WARNINGS: %d" % sum(self.combined_warnings.values()))
+
+    def top_files(self, file_count, reverse=False):
+        """
+        Like |top| but warnings are aggregated by the file they're emitted from.
+        """
+        files = Counter()
+        for path in self.index.files():
+            files[path] = sum(self.combined_warnings[w]
+                              for w in self.index.in_file(path))
+
+        print("Top %d Files" % file_count)
+        print("=============")
+        files_list = top_k(files, file_count, reverse)
+
+        for (path, count) in files_list:
+            print("%6d %s (%d warnings)" % (count, path, len(self.index.in_file(path))))
+
+        print("TOTAL FILES: %d" % len(files))
+        print("TOTAL WARNINGS: %d" % sum(self.combined_warnings.values()))
+
+    def top_tests(self, test_count, reverse=False):
+        """
+        Ranks tests by the number of warnings, and then bytes of warnings,
+        they emitted across all jobs.
+        """
+        tests = {}
+        for log in self.logs:
+            for (test, stats) in log.tests.items():
+                combined = tests.setdefault(test, [0, 0, 0, 0])
+                (warnings, size, distinct, duration) = stats
+                combined[0] += warnings
+                combined[1] += size
+                combined[2] = max(combined[2], distinct)
+                combined[3] += duration
+
+        ranked = sorted(tests.items(), key=lambda x: (x[1][0], x[1][1]),
+                        reverse=not reverse)
+
+        print("Top %d Tests" % test_count)
+        print("=============")
+        print("%8s %10s %8s %9s %s" % (
+                "warnings", "bytes", "distinct", "time (s)", "test"))
+        for (test, (warnings, size, distinct, duration)) in ranked[:test_count]:
+            print("%8d %10d %8d %9.1f %s" % (
+                    warnings, size, distinct, duration / 1000.0, test))
+
+        print("TOTAL TESTS: %d" % len(tests))
+        print("TOTAL WARNINGS: %d" % sum(self.combined_warnings.values()))
+
+    def job_names(self):
+        return set(log.job_name for log in self.logs)
+
+    def compare(self, base, warning_count, warning=None):
+        """
+        Prints the warnings whose count changed the most relative to |base|,
+        another |Warnings|, or with |warning| set its change in each job.
+        Only jobs that ran on both pushes are compared.
+        """
+        comparable = self.job_names() & base.job_names()
+        missing = sorted(self.job_names() - comparable)
+
+        def counts(logs):
+            combined = Counter()
+            by_job = Counter()
+            for log in logs:
+                if log.job_name not in comparable:
+                    continue
+                combined.update(log.warnings)
+                if warning:
+                    by_job[log.job_name] += log.warnings[warning]
+            return (combined, by_job)
+
+        (before, before_jobs) = counts(base.logs)
+        (after, after_jobs) = counts(self.logs)
+
+        if warning:
+            rows = [(job, before_jobs[job], after_jobs[job])
+                    for job in comparable]
+            (title, column) = ("Changes of %s by job" % warning, "job")
+        else:
+            rows = [(w, before[w], after[w]) for w in set(before) | set(after)]
+            (title, column) = ("Top %d Changes" % warning_count, "warning")
+        rows = [r for r in rows if r[1] != r[2]]
+        rows.sort(key=lambda r: (-abs(r[2] - r[1]), r[0]))
+
+        title += " against %s (%d comparable jobs)" % (base.revision,
+                                                       len(comparable))
+        print(title)
+        print("=" * len(title))
+        print("%8s %8s %8s %s" % ("before", "after", "delta", column))
+        for (name, b, a) in rows[:warning_count]:
+            print("%8d %8d %+8d %s" % (b, a, a - b, name))
+
+        if missing:
+            print("Not compared, no base run for %d jobs: %s" % (
+                    len(missing), ', '.join(missing)))
+        print("TOTAL WARNINGS: %d before, %d after (%+d)" % (
+                sum(before.values()), sum(after.values()),
+                sum(after.values()) - sum(before.values())))
+
+    def details(self, warning, test_summary_count, annotator=None):
+        """
+        Returns the (summary, details, file) of a single warning. If an
+        |annotator| is given the details include who last changed the line.
+        """
         # Sanity check the warning format.
-        if not re.match(self.warning_re, warning):
+        if not matches(self.warning_re, warning):
             raise InvalidRegexException(
                 "Provided warning %s does not match warning regex %s" %
                     (warning, self.warning_re))
 
         info = WarningInfo(warning, self.combined_warnings[warning])
         info.match_in_logs(self.cache_dir, self.logs)
+        for problem in info.problems:
+            print(problem)
 
         if not info.count:
             raise WarningNotFoundException(
                 "Provided warning %s was not found" % warning)
 
+        source = None
+        if annotator:
+            source = annotator.resolve([(info.file, int(info.line))])[0]
+
         return info.details(
                 self.repo, self.revision,
-                self.platform, test_summary_count)
+                self.platform, test_summary_count, source)
+
+    def details_for_top(self, warning_count, test_summary_count, annotator=None):
+        """
+        Like |details| for each of the |warning_count| most common warnings.
+        The logs are only scanned once and all the sources are annotated in
+        a single batch.
+
+        Returns a list of (warning, (summary, details, file), source) tuples,
+        |source| is None without an |annotator|.
+        """
+        infos = [WarningInfo(warning, count) for (warning, count)
+                 in self.combined_warnings.most_common(warning_count)]
+        WarningInfo.match_all_in_logs(infos, self.cache_dir, self.logs)
+
+        sources = [None] * len(infos)
+        if annotator:
+            sources = annotator.resolve(
+                    [(info.file, int(info.line)) for info in infos])
+
+        return [(info.full_text,
+                 info.details(self.repo, self.revision, self.platform,
+                              test_summary_count, source),
+                 source)
+                for (info, source) in zip(infos, sources)]
 
 
 class ReportCommandLineArgs(BaseCommandLineArgs):
     @staticmethod
-    def do_report(cmdline):
-        warnings = Warnings(cmdline.repo, cmdline.revision, cmdline.platform,
-                            cmdline.cache_dir, cmdline.use_cache,
-                            cmdline.warning_re)
+    def do_report(cmdline, warnings=None):
+        """
+        Prints the report for |cmdline|. An already loaded |warnings| for the
+        same push and options can be passed in to avoid reloading it, see
+        |logspam.mach_interface.Session|.
+        """
+        if warnings is None:
+            warnings = Warnings(cmdline.repo, cmdline.revision, cmdline.platform,
+                                cmdline.cache_dir, cmdline.use_cache,
+                                pattern_from_args(cmdline), cmdline.sample,
+                                cmdline.approximate, cmdline.retriggers,
+                                cmdline.log_source)
+
+            if cmdline.pattern:
+                warnings.select_pattern(cmdline.pattern)
 
-        if not cmdline.warning:
-            warnings.top(cmdline.warning_count, cmdline.reverse)
+        if getattr(cmdline, 'compare_base', False):
+            ReportCommandLineArgs.do_compare(cmdline, warnings)
+        elif not cmdline.warning:
+            if cmdline.by_template:
+                warnings.top_templates(cmdline.warning_count, cmdline.reverse)
+            elif cmdline.by_file:
+                warnings.top_files(cmdline.warning_count, cmdline.reverse)
+            elif cmdline.by_test:
+                warnings.top_tests(cmdline.warning_count, cmdline.reverse)
+            elif cmdline.sample:
+                warnings.top_estimated(cmdline.warning_count)
+            elif cmdline.sort == 'bytes':
+                warnings.top_bytes(cmdline.warning_count, cmdline.reverse)
+            else:
+                warnings.top(cmdline.warning_count, cmdline.reverse)
         else:
             (summary, details, _) = warnings.details(cmdline.warning, cmdline.test_summary_count)
             print("\n".join([summary, "", details]))
 
+    @staticmethod
+    def do_compare(cmdline, warnings):
+        """
+        Compares the push of |cmdline|, ie a try push, against the push it was
+        based on. Only the jobs that ran on it are retrieved for the base.
+        """
+        base_revision = cmdline.base_revision or get_base_revision(
+                cmdline.repo, warnings.revision, cmdline.base_repo)
+        if not base_revision:
+            print("Couldn't find the base of %s, pass --base-revision" %
+                    warnings.revision)
+            return
+
+        job_names = warnings.job_names()
+        print("Comparing %d jobs against %s %s" % (
+                len(job_names), cmdline.base_repo, base_revision))
+        base = Warnings(cmdline.base_repo, base_revision, cmdline.platform,
+                        None, True, warnings.warning_re,
+                        retriggers=cmdline.retriggers, job_names=job_names)
+        if cmdline.pattern:
+            base.select_pattern(cmdline.pattern)
+
+        warnings.compare(base, cmdline.warning_count, cmdline.warning)
+
     def add_command(self, p):
        parser = p.add_parser('report',
             help='Generates an overall warning report or a report for a '
@@ -114,3 +470,49 @@ class ReportCommandLineArgs(BaseCommandLineArgs):
                        help='Number of tests to list in warning summary mode. Default: 10')
         p.add_argument('--reverse', action='store_true', default=False,
                        help='Print the least common warnings instead.')
+        p.add_argument('--by-template', action='store_true', default=False,
+                       help='Group warnings that only differ by numbers, ' \
+                            'addresses, urls, paths or line numbers.')
+        p.add_argument('--by-file', action='store_true', default=False,
+                       help='Aggregate warnings by the file they are emitted from.')
+        p.add_argument('--sort', action='store', default='count',
+                       choices=('count', 'bytes'),
+                       help='Rank warnings by number of instances or by the ' \
+                            'raw log bytes they account for. Default: count')
+        p.add_argument('--by-test', action='store_true', default=False,
+                       help='Rank tests by the number and size of the ' \
+                            'warnings they emit.')
+        p.add_argument('--sample', action='store', default=None,
+                       metavar='FRACTION|N',
+                       help='Only download a stratified sample of the jobs, ' \
+                            'either a fraction of each suite or about N jobs ' \
+                            'in total, and report estimated counts.')
+        p.add_argument('--approximate', action='store', default=None,
+                       type=int, metavar='CAPACITY',
+                       help='Only track about CAPACITY of the most common ' \
+                            'warnings, bounding memory use. Counts are ' \
+                            'reported with their maximum error.')
+        p.add_argument('--retriggers', action='store', default=DEFAULT_POLICY,
+                       choices=POLICIES,
+                       help='How to handle several runs of the same job: ' \
+                            'only download the first, or download all of ' \
+                            'them and take the max or mean of each count, ' \
+                            'or add them all up. Default: %s' % DEFAULT_POLICY)
+        p.add_argument('--pattern', action='store', default=None,
+                       help='Only report warnings matching this one of the ' \
+                            '--patterns.')
+        p.add_argument('--log-source', action='store', default=None,
+                       metavar='dir:PATH|tar:PATH',
+                       help='Read the logs from a local directory or tarball ' \
+                            'instead of treeherder. The revision is only ' \
+                            'used to name the cache directory.')
+        p.add_argument('--compare-base', action='store_true', default=False,
+                       help='Compare against the push the revision is ' \
+                            'based on, ie for a try push. Only the jobs that ' \
+                            'ran on the revision are retrieved for the base.')
+        p.add_argument('--base-repo', action='store', default='mozilla-central',
+                       help='Repository of the base push. ' \
+                            'Default: mozilla-central')
+        p.add_argument('--base-revision', action='store', default=None,
+                       help='Revision to compare against instead of looking ' \
+                            'up the base of the push.')
@@ -0,0 +1,94 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Handling of retriggered jobs, ie several runs of the same job type on a push.
+
+  first  only the first run (lowest job id) is downloaded
+  max    all runs are downloaded, each count is the max across runs
+  mean   all runs are downloaded, each count is the mean across runs
+  all    all runs are downloaded and counted separately
+"""
+
+FIRST = 'first'
+MAX = 'max'
+MEAN = 'mean'
+ALL = 'all'
+
+POLICIES = (FIRST, MAX, MEAN, ALL)
+DEFAULT_POLICY = FIRST
+
+
+def select_jobs(jobs, policy, job_name):
+    """
+    Returns the jobs to download for the given |policy|. |job_name| maps a
+    job to the name runs of the same job share.
+    """
+    if policy != FIRST:
+        return list(jobs)
+
+    first = {}
+    for job in sorted(jobs, key=lambda j: j['id']):
+        first.setdefault(job_name(job), job)
+    return sorted(first.values(), key=lambda j: j['id'])
+
+
+def _combine(values, policy, n):
+    if policy == MAX:
+        return max(values)
+    # Runs without the value count as 0.
+    return int(round(float(sum(values)) / n))
+
+
+def _combine_counts(dicts, policy):
+    keys = set()
+    for d in dicts:
+        keys.update(d)
+
+    combined = {}
+    for key in keys:
+        value = _combine([d.get(key, 0) for d in dicts], policy, len(dicts))
+        if value:
+            combined[key] = value
+    return combined
+
+
+def aggregate_entries(entries, policy):
+    """
+    Combines the results json entries of several runs of one job into a
+    single entry according to |policy|. The entry keeps the url and file of
+    the noisiest run so warning details still have a log to read.
+    """
+    if len(entries) == 1:
+        return entries[0]
+
+    entry = dict(max(entries, key=lambda x: sum(x['warnings'].values())))
+    entry['runs'] = len(entries)
+    entry['warnings'] = _combine_counts([x['warnings'] for x in entries], policy)
+    entry['warning_bytes'] = _combine_counts(
+            [x.get('warning_bytes', {}) for x in entries], policy)
+
+    for field in ('raw_bytes', 'normalized_bytes'):
+        entry[field] = _combine([x.get(field, 0) for x in entries],
+                                policy, len(entries))
+
+    tests = {}
+    for name in set(t for x in entries for t in x.get('tests', {})):
+        stats = [x.get('tests', {}).get(name, [0, 0, 0, 0]) for x in entries]
+        tests[name] = [_combine(column, policy, len(entries))
+                       for column in zip(*stats)]
+    entry['tests'] = tests
+
+    # Pattern members are indices into the warnings of each entry.
+    members = {}
+    for x in entries:
+        warnings = list(x['warnings'])
+        for (name, indices) in x.get('patterns', {}).items():
+            members.setdefault(name, set()).update(warnings[i] for i in indices)
+    positions = dict((w, i) for (i, w) in enumerate(entry['warnings']))
+    entry['patterns'] = dict(
+            (name, sorted(positions[w] for w in ws if w in positions))
+            for (name, ws) in members.items())
+
+    return entry
@@ -0,0 +1,170 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Stratified sampling of the jobs of a push and extrapolation of the warning
+counts of the sample to the whole push.
+
+Jobs are grouped by suite (chunks of the same suite are expected to look
+alike) and the same fraction of each suite is downloaded, with at least two
+jobs per suite so its variance can be estimated. Totals are estimated with
+the usual stratified estimator:
+
+  total = sum_h N_h * mean_h
+  var   = sum_h N_h^2 * (1 - n_h / N_h) * s_h^2 / n_h
+
+where N_h is the number of jobs in suite h, n_h the number that were sampled
+and s_h^2 the sample variance of the per-job counts.
+"""
+
+from collections import Counter
+import json
+import math
+import random
+import re
+
+# z value for the reported confidence intervals.
+Z_95 = 1.96
+
+# Trailing chunk number of a job name, ie:
+#   test-linux1804-64/debug-mochitest-browser-chrome-e10s-3
+CHUNK_RE = re.compile(r'-[0-9]+$')
+
+
+class InvalidSampleException(Exception):
+    pass
+
+
+def parse_sample(spec):
+    """
+    Parses a --sample value, either a fraction in (0, 1] or a number of jobs.
+    Returns a (fraction, count) tuple with one of them set.
+    """
+    try:
+        value = float(spec)
+    except ValueError:
+        raise InvalidSampleException(
+            "Sample must be a fraction or a number of jobs, got %s" % spec)
+
+    if 0 < value <= 1 and '.' in spec:
+        return (value, None)
+    elif value >= 1 and value == int(value):
+        return (None, int(value))
+
+    raise InvalidSampleException(
+        "Sample must be a fraction in (0, 1] or a number of jobs, got %s" % spec)
+
+
+def job_stratum(job):
+    """
+    Returns the suite a treeherder job belongs to.
+    """
+    return CHUNK_RE.sub('', job['job_type_name'])
+
+
+def stratified_sample(jobs, spec, seed=None):
+    """
+    Selects a stratified sample of |jobs| according to the --sample |spec|.
+
+    Returns the list of sampled jobs and a dict of stratum to the total
+    number of jobs in it.
+    """
+    (fraction, count) = parse_sample(spec)
+    if fraction is None:
+        fraction = min(1.0, float(count) / max(len(jobs), 1))
+
+    strata = {}
+    for job in jobs:
+        strata.setdefault(job_stratum(job), []).append(job)
+
+    rng = random.Random(seed)
+    sampled = []
+    for name in sorted(strata):
+        members = strata[name]
+        n = min(len(members), max(2, int(round(fraction * len(members)))))
+        sampled.extend(rng.sample(members, n))
+
+    return (sampled, dict((name, len(members))
+                          for (name, members) in strata.items()))
+
+
+def strata_path(results_path):
+    """
+    Path of the strata recorded for sampled results.
+    """
+    return results_path + '.strata'
+
+
+def write_strata(results_path, strata, job_strata):
+    """
+    Records the size of each stratum and the stratum of each sampled job
+    (by job name) next to the sampled results.
+    """
+    with open(strata_path(results_path), 'w') as f:
+        json.dump({'strata': strata, 'jobs': job_strata}, f)
+
+
+def read_strata(results_path):
+    with open(strata_path(results_path), 'r') as f:
+        blob = json.load(f)
+    return (blob['strata'], blob['jobs'])
+
+
+class SampleEstimate(object):
+    """
+    Estimates of the total count of each warning in a push from the
+    |ParsedLog|s of a stratified sample of its jobs.
+    """
+    def __init__(self, logs, strata, job_strata):
+        self.strata = strata
+        self.job_strata = job_strata
+
+        # Per stratum number of sampled logs and per warning sums of the
+        # counts and of their squares. Jobs without the warning count as 0.
+        self.sampled = Counter()
+        sums = {}
+        for log in logs:
+            stratum = job_strata.get(log.job_name)
+            if stratum is None:
+                continue
+            self.sampled[stratum] += 1
+            for (warning, count) in log.warnings.items():
+                s = sums.setdefault(warning, {}).setdefault(stratum, [0, 0])
+                s[0] += count
+                s[1] += count * count
+
+        # Strata where no log could be downloaded can't be extrapolated.
+        self.missing = sorted(h for h in strata if not self.sampled[h])
+
+        self.estimates = {}
+        for (warning, by_stratum) in sums.items():
+            total = 0.0
+            variance = 0.0
+            for (stratum, (s, ss)) in by_stratum.items():
+                (N, n) = (strata[stratum], self.sampled[stratum])
+                total += N * float(s) / n
+                if n > 1:
+                    var = (ss - float(s) * s / n) / (n - 1)
+                    variance += N * N * (1 - float(n) / N) * var / n
+            self.estimates[warning] = (total, Z_95 * math.sqrt(variance))
+
+    def sampled_jobs(self):
+        return sum(self.sampled.values())
+
+    def total_jobs(self):
+        return sum(self.strata.values())
+
+    def estimate(self, warning):
+        """
+        Returns the (estimated total, 95% confidence half width) of a warning.
+        """
+        return self.estimates.get(warning, (0.0, 0.0))
+
+    def most_common(self, count=None):
+        """
+        Returns (warning, estimate, half width) tuples, largest estimate first.
+        """
+        ranked = sorted(self.estimates.items(), key=lambda x: x[1][0],
+                        reverse=True)
+        return [(w, est, ci) for (w, (est, ci)) in ranked[:count]]
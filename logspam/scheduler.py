@@ -0,0 +1,422 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Adaptive scheduling of log downloads.
+
+A process pool worker normalizes each log as its response streams in, so
+fetching is paced by the network, while loading logs that are already cached
+is CPU bound. The number of fetches in flight and of cached logs being
+loaded are limited separately and each limit is tuned by an AIMD controller:
+
+  downloads      +1 while aggregate throughput keeps up with the best seen,
+                 halved on HTTP 429/5xx or connection errors, cut when
+                 latency balloons
+  normalization  +1 while all slots are busy and the CPUs aren't saturated,
+                 halved when the number of runnable tasks exceeds the
+                 number of CPUs
+
+Every decision is recorded in the controller's |events| and printed.
+"""
+
+from collections import namedtuple
+import os
+import threading
+import time
+
+# Response codes that mean the server wants us to back off.
+THROTTLE_CODES = (429, 500, 502, 503, 504)
+
+MAX_ATTEMPTS = 5
+
+# Bytes read from a response at a time.
+CHUNK_SIZE = 64 * 1024
+
+# Seconds over which the number of runnable tasks is averaged.
+LOAD_WINDOW = 1.0
+
+# The 1 minute load average lags by about that long, decreases based on it
+# are spaced out so a single spike isn't counted over and over.
+LOADAVG_COOLDOWN = 60.0
+
+
+def process_pool(processes):
+    """
+    Returns a multiprocessing Pool. Forking while other threads might hold
+    locks can deadlock the children, so unless this is the only thread the
+    workers are spawned instead.
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context(
+            'spawn' if threading.active_count() > 1 else None)
+    return context.Pool(processes=processes)
+
+
+class DynamicLimiter(object):
+    """
+    Semaphore whose limit can change while it's in use.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def set_limit(self, limit):
+        with self.cond:
+            self.limit = limit
+            self.cond.notify_all()
+
+    def saturated(self):
+        return self.active >= self.limit
+
+
+class AIMDController(object):
+    """
+    Additive increase, multiplicative decrease of a |DynamicLimiter|'s
+    limit. Decreases are rate limited by |cooldown| so that a burst of
+    errors caused by a single overload only counts once.
+    """
+    def __init__(self, name, limiter, minimum=1, maximum=24, increase=1,
+                 decrease=0.5, cooldown=2.0):
+        self.name = name
+        self.limiter = limiter
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = increase
+        self.factor = decrease
+        self.cooldown = cooldown
+        self.start = time.time()
+        self.last_decrease = 0
+        self.peak = limiter.limit
+        # (seconds since start, old limit, new limit, reason)
+        self.events = []
+        self.lock = threading.Lock()
+
+    def _set(self, limit, reason):
+        old = self.limiter.limit
+        limit = max(self.minimum, min(self.maximum, limit))
+        if limit == old:
+            return
+        self.limiter.set_limit(limit)
+        self.peak = max(self.peak, limit)
+        self.events.append((time.time() - self.start, old, limit, reason))
+        print("[%s] %d -> %d: %s" % (self.name, old, limit, reason))
+
+    def increase(self, reason):
+        with self.lock:
+            self._set(self.limiter.limit + self.step, reason)
+
+    def decrease(self, reason, factor=None):
+        """
+        Returns False if the decrease was skipped because of |cooldown|.
+        """
+        with self.lock:
+            now = time.time()
+            if now - self.last_decrease < self.cooldown:
+                return False
+            self.last_decrease = now
+            self._set(int(self.limiter.limit * (factor or self.factor)), reason)
+            return True
+
+    def summary(self):
+        increases = len([e for e in self.events if e[2] > e[1]])
+        return "[%s] limit %d, peak %d, %d increases, %d decreases" % (
+                self.name, self.limiter.limit, self.peak, increases,
+                len(self.events) - increases)
+
+
+class DownloadController(AIMDController):
+    """
+    Tunes the number of fetches in flight from their throughput, latency
+    and errors.
+    """
+    # Completed fetches per throughput measurement.
+    WINDOW = 4
+    # Latency this many times the best seen is treated as congestion.
+    LATENCY_FACTOR = 4
+
+    def __init__(self, limiter, **kwargs):
+        super(DownloadController, self).__init__('downloads', limiter, **kwargs)
+        self.window_bytes = 0
+        self.window_count = 0
+        self.window_start = time.time()
+        self.best_throughput = 0
+        self.best_latency = None
+
+    def completed(self, size, latency):
+        """
+        Records a successful fetch of |size| bytes whose response started
+        after |latency| seconds.
+        """
+        with self.lock:
+            if self.best_latency is None or latency < self.best_latency:
+                self.best_latency = latency
+            congested = latency > self.LATENCY_FACTOR * max(self.best_latency, 0.05)
+
+            self.window_bytes += size
+            self.window_count += 1
+            if self.window_count < self.WINDOW:
+                measured = None
+            else:
+                now = time.time()
+                measured = self.window_bytes / max(now - self.window_start, 1e-3)
+                (self.window_bytes, self.window_count, self.window_start) = (0, 0, now)
+
+        if congested:
+            self.decrease("latency %.2fs" % latency, factor=0.75)
+        elif measured is not None:
+            if measured >= 0.9 * self.best_throughput:
+                self.best_throughput = max(self.best_throughput, measured)
+                if self.limiter.saturated():
+                    self.increase("throughput %.1f MB/s" % (measured / 1e6))
+
+    def decrease(self, reason, factor=None):
+        if not super(DownloadController, self).decrease(reason, factor):
+            return False
+        # Throughput at the new limit is measured from scratch, otherwise the
+        # best seen before backing off would keep the limit from growing.
+        with self.lock:
+            self.best_throughput = 0
+            (self.window_bytes, self.window_count) = (0, 0)
+            self.window_start = time.time()
+        return True
+
+    def throttled(self, reason):
+        self.decrease(reason)
+
+
+def running_tasks():
+    """
+    Returns the number of currently runnable tasks, or None if unknown.
+    """
+    try:
+        with open('/proc/stat', 'r') as f:
+            for line in f:
+                if line.startswith('procs_running '):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+class NormalizeController(AIMDController):
+    """
+    Tunes the number of logs being normalized from the CPU load: the number
+    of runnable tasks averaged over |LOAD_WINDOW| where /proc/stat is
+    available, so a spike is over as soon as it's gone, and the 1 minute
+    load average otherwise.
+    """
+    def __init__(self, limiter, **kwargs):
+        super(NormalizeController, self).__init__('normalize', limiter, **kwargs)
+        self.cpus = os.cpu_count() or 1
+        self.fast = running_tasks() is not None
+        if not self.fast:
+            self.cooldown = max(self.cooldown, LOADAVG_COOLDOWN)
+        self.window = []
+        self.window_start = time.time()
+        self.window_lock = threading.Lock()
+
+    def load(self):
+        """
+        Returns the load per CPU, or None if unknown or the current window
+        isn't over yet.
+        """
+        if not self.fast:
+            try:
+                return os.getloadavg()[0] / self.cpus
+            except (AttributeError, OSError):
+                return None
+
+        running = running_tasks()
+        if running is None:
+            return None
+        with self.window_lock:
+            # Don't count the thread sampling.
+            self.window.append(max(0, running - 1))
+            now = time.time()
+            if now - self.window_start < LOAD_WINDOW:
+                return None
+            load = float(sum(self.window)) / len(self.window) / self.cpus
+            (self.window, self.window_start) = ([], now)
+        return load
+
+    def sample(self):
+        load = self.load()
+        if load is None:
+            if self.fast:
+                return
+            if self.limiter.saturated():
+                self.increase("all workers busy")
+        elif load > 1.0:
+            self.decrease("load %.2f per cpu" % load)
+        elif load < 0.8 and self.limiter.saturated():
+            self.increase("load %.2f per cpu" % load)
+
+
+# Outcome of a fetch by |stream_log|. |status| is None if the request failed
+# with the exception named |error|, |result| is what |consume| returned.
+FetchResult = namedtuple('FetchResult', ['status', 'size', 'latency',
+                                         'retry_after', 'error', 'result'])
+
+# requests.Session of a pool worker, see |stream_log|.
+_session = None
+
+
+def stream_log(url, consume):
+    """
+    Fetches |url| and hands its lines to |consume| as they arrive, so the raw
+    log is never written out. Runs in the pool workers, each keeps its own
+    connection pool. Returns a |FetchResult|.
+    """
+    import requests
+
+    global _session
+    if _session is None:
+        _session = requests.Session()
+
+    start = time.time()
+    try:
+        r = _session.get(url, stream=True, timeout=120)
+        latency = time.time() - start
+        if r.status_code != 200:
+            r.close()
+            return FetchResult(r.status_code, 0, latency,
+                               r.headers.get('Retry-After'), None, None)
+
+        size = [0]
+        def lines():
+            # Splitting whole chunks is a lot faster than |iter_lines|.
+            pending = b''
+            for chunk in r.iter_content(CHUNK_SIZE):
+                size[0] += len(chunk)
+                chunk_lines = (pending + chunk).split(b'\n')
+                pending = chunk_lines.pop()
+                for line in chunk_lines:
+                    yield line.rstrip(b'\r')
+            if pending:
+                yield pending.rstrip(b'\r')
+
+        result = consume(lines())
+        return FetchResult(200, size[0], latency, None, None, result)
+    except requests.exceptions.RequestException as e:
+        return FetchResult(None, 0, time.time() - start, None,
+                           type(e).__name__, None)
+
+
+class AdaptiveDownloader(object):
+    """
+    Fetches and normalizes logs with adaptive concurrency. |normalize| is a
+    picklable function run in the process pool, it's given a task tuple of
+    (cache_dir, url, job_name, job_id, fetch, warning_re) where fetch is
+    False if the normalized log is already cached, and returns a
+    |FetchResult|. Fetching logs are normalized while they download with
+    |stream_log|.
+    """
+    def __init__(self, cache_dir, warning_re, normalize, max_downloads=24,
+                 max_workers=None):
+        self.cache_dir = cache_dir
+        self.warning_re = warning_re
+        self.normalize = normalize
+        self.max_downloads = max_downloads
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # Fetching logs are normalized by the workers while they stream in,
+        # paced by the network, so there's a worker for every download slot
+        # on top of those loading cached logs.
+        self.processes = self.max_downloads + self.max_workers
+
+        self.downloads = DynamicLimiter(min(4, max_downloads))
+        self.download_control = DownloadController(
+                self.downloads, maximum=max_downloads)
+        self.workers = DynamicLimiter(max(1, self.max_workers // 2))
+        self.normalize_control = NormalizeController(
+                self.workers, maximum=self.max_workers)
+
+    def fetch(self, pool, task):
+        """
+        Fetches and normalizes the log of |task|, backing off when
+        throttled. Returns the result of |normalize|, or None on failure.
+        """
+        url = task[1]
+        for attempt in range(MAX_ATTEMPTS):
+            self.downloads.acquire()
+            try:
+                fetched = pool.apply(self.normalize, (task,))
+                if fetched.status == 200:
+                    self.download_control.completed(fetched.size,
+                                                    fetched.latency)
+                    return fetched.result
+                elif fetched.status is None:
+                    self.download_control.throttled(fetched.error)
+                elif fetched.status in THROTTLE_CODES:
+                    self.download_control.throttled("HTTP %d" % fetched.status)
+                else:
+                    print("Couldn't fetch %s: HTTP %d" % (url, fetched.status))
+                    return None
+            finally:
+                self.downloads.release()
+
+            try:
+                wait = float(fetched.retry_after)
+            except (TypeError, ValueError):
+                wait = 2 ** attempt
+            time.sleep(min(wait, 60))
+
+        print("Giving up on %s" % url)
+        return None
+
+    def _process(self, pool, job):
+        from logspam.cache import ParsedLog
+        from logspam.locks import FileLock
+
+        (url, job_name, job_id) = job
+        fname = ParsedLog(url, job_name, job_id=job_id).fname
+        dest = os.path.join(self.cache_dir, fname)
+
+        # Hold the log's lock until it's normalized, see |ParsedLog.download|.
+        with FileLock(self.cache_dir, fname):
+            fetch = not os.path.exists(dest)
+            task = (self.cache_dir, url, job_name, job_id, fetch,
+                    self.warning_re)
+            if fetch:
+                return self.fetch(pool, task)
+
+            self.workers.acquire()
+            try:
+                return pool.apply(self.normalize, (task,)).result
+            finally:
+                self.workers.release()
+                self.normalize_control.sample()
+
+    def run(self, jobs):
+        """
+        Processes the (url, job_name, job_id) |jobs|, returns the result of
+        |normalize| for each of them, or None if it couldn't be fetched.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        pool = process_pool(self.processes)
+        # Enough threads to keep every download and worker slot busy, the
+        # limiters decide how many actually run.
+        threads = ThreadPool(processes=self.max_downloads + self.max_workers)
+        try:
+            results = threads.map(lambda job: self._process(pool, job), jobs)
+        finally:
+            threads.close()
+            pool.close()
+
+        print(self.download_control.summary())
+        print(self.normalize_control.summary())
+        return results
@@ -0,0 +1,221 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Small local HTTP service that serves JSON queries over cached pushes so one
+warmed host can answer for everyone.
+
+Endpoints, all GET:
+  /pushes
+  /<repo>/<revision>/<platform>/top?count=N&reverse=1
+  /<repo>/<revision>/<platform>/warning?text=<warning>&tests=N
+  /<repo>/<revision>/<platform>/jobs
+  /<repo>/<revision>/<platform>/job?name=<job name>&count=N
+  /<repo>/<revision>/<platform>/diff?base=<revision>&count=N
+"""
+
+from collections import OrderedDict
+import json
+import os
+import threading
+from urllib.parse import parse_qs, urlsplit, unquote
+
+from logspam.cache import CacheFileNotFoundException, cache_file_path
+from logspam.cli import BaseCommandLineArgs
+from logspam.patterns import pattern_from_args
+from logspam.query import (
+        WarningNotFoundException,
+        WarningQuery,
+        default_cache_dir)
+
+
+class NotFoundException(Exception):
+    pass
+
+
+class BadRequestException(Exception):
+    pass
+
+
+class QueryService(object):
+    """
+    Dispatches requests to |WarningQuery| objects. Both loaded pushes and
+    rendered responses are kept in LRU caches that are invalidated when the
+    underlying results file changes.
+    """
+    def __init__(self, root, warning_re, max_pushes=8, max_responses=1024):
+        self.root = root
+        self.warning_re = warning_re
+        self.max_pushes = max_pushes
+        self.max_responses = max_responses
+
+        self.pushes = OrderedDict()
+        self.responses = OrderedDict()
+        self.lock = threading.Lock()
+
+    def push(self, repo, revision, platform):
+        # These end up in the cache path, an encoded separator mustn't let
+        # them reach outside of the cache root.
+        for part in (repo, revision, platform):
+            if not part or '/' in part or '..' in part:
+                raise BadRequestException("Invalid push %s/%s/%s" % (
+                        repo, revision, platform))
+
+        key = (repo, revision, platform)
+        with self.lock:
+            query = self.pushes.get(key)
+            if query and not query.is_stale():
+                self.pushes.move_to_end(key)
+                return query
+
+        cache_dir = default_cache_dir(repo, revision, platform, self.root)
+        try:
+            query = WarningQuery(cache_dir, self.warning_re)
+        except CacheFileNotFoundException:
+            raise NotFoundException("%s is not cached" % cache_dir)
+
+        with self.lock:
+            self.pushes[key] = query
+            if len(self.pushes) > self.max_pushes:
+                self.pushes.popitem(last=False)
+
+        return query
+
+    def list_pushes(self):
+        pushes = []
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if os.path.isfile(cache_file_path(path, self.warning_re)):
+                pushes.append(name)
+        return pushes
+
+    def handle(self, path, params):
+        """
+        Returns the JSON encoded response for the given request, rendering it
+        only if it isn't already cached.
+        """
+        parts = [unquote(p) for p in path.strip('/').split('/') if p]
+        key = (tuple(parts), tuple(sorted((k, tuple(v)) for (k, v) in params.items())))
+
+        with self.lock:
+            cached = self.responses.get(key)
+        if cached:
+            (queries, body) = cached
+            if not any(q.is_stale() for q in queries):
+                with self.lock:
+                    self.responses.move_to_end(key)
+                return body
+
+        (queries, result) = self.dispatch(parts, params)
+        body = json.dumps(result).encode('utf-8')
+
+        # Push listings depend on the directory contents, don't cache them.
+        if queries:
+            with self.lock:
+                self.responses[key] = (queries, body)
+                if len(self.responses) > self.max_responses:
+                    self.responses.popitem(last=False)
+
+        return body
+
+    def dispatch(self, parts, params):
+        def param(name, default=None):
+            return params.get(name, [default])[0]
+
+        if parts == ['pushes']:
+            return ([], self.list_pushes())
+
+        if len(parts) != 4:
+            raise NotFoundException("Unknown endpoint /%s" % '/'.join(parts))
+
+        (repo, revision, platform, endpoint) = parts
+        query = self.push(repo, revision, platform)
+        queries = [query]
+        count = int(param('count', 40))
+
+        if endpoint == 'top':
+            result = query.top(count, param('reverse') == '1')
+        elif endpoint == 'warning':
+            try:
+                result = query.warning(param('text', ''), int(param('tests', 10)))
+            except WarningNotFoundException as e:
+                raise NotFoundException(str(e))
+        elif endpoint == 'jobs':
+            result = query.jobs()
+        elif endpoint == 'job':
+            result = query.job(param('name', ''), count)
+        elif endpoint == 'diff':
+            base = self.push(repo, param('base', ''), platform)
+            queries.append(base)
+            result = query.diff(base, count)
+        else:
+            raise NotFoundException("Unknown endpoint %s" % endpoint)
+
+        return (queries, result)
+
+
+def serve(host, port, root, warning_re):
+    # http.server is comparatively slow to import, keep it out of the rest of
+    # the cli.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class QueryRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                body = self.server.service.handle(url.path, parse_qs(url.query))
+                status = 200
+            except NotFoundException as e:
+                body = json.dumps({'error': str(e)}).encode('utf-8')
+                status = 404
+            except (BadRequestException, ValueError) as e:
+                body = json.dumps({'error': str(e)}).encode('utf-8')
+                status = 400
+            except Exception as e:
+                self.log_error("Failed to handle %s: %r", self.path, e)
+                body = json.dumps({'error': 'Internal error'}).encode('utf-8')
+                status = 500
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    server.service = QueryService(root, warning_re)
+    print("Serving cached warnings from %s on http://%s:%d/" % (
+            os.path.abspath(root), host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class ServeCommandLineArgs(BaseCommandLineArgs):
+    @staticmethod
+    def do_serve(cmdline):
+        serve(cmdline.host, cmdline.port, cmdline.cache_root,
+              pattern_from_args(cmdline))
+
+    def add_command(self, p):
+       parser = p.add_parser('serve',
+            help='Serves JSON queries over already cached pushes.')
+       self.add_arguments(parser)
+       parser.set_defaults(func=ServeCommandLineArgs.do_serve)
+
+    def add_arguments(self, p):
+        """
+        Adds serve specific command-line args.
+        """
+        super(ServeCommandLineArgs, self).add_arguments(p)
+
+        p.add_argument('--host', action='store', default='127.0.0.1',
+                       help='Address to listen on. Default: 127.0.0.1')
+        p.add_argument('--port', action='store', default=8000, type=int,
+                       help='Port to listen on. Default: 8000')
+        p.add_argument('--cache-root', action='store', default='.',
+                       help='Directory containing the cached pushes. Default: .')
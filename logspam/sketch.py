@@ -0,0 +1,134 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Top-K helpers. |top_k| selects from exact counts without sorting all of
+them, |SpaceSaving| approximates the heavy hitters of a stream in bounded
+memory.
+"""
+
+import heapq
+from operator import itemgetter
+
+
+def top_k(counts, k, reverse=False):
+    """
+    Returns the |k| (item, count) pairs with the largest counts, or the
+    smallest if |reverse| is set, using a heap rather than a full sort.
+    """
+    if reverse:
+        return heapq.nsmallest(k, counts.items(), key=itemgetter(1))
+    return heapq.nlargest(k, counts.items(), key=itemgetter(1))
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving heavy hitters sketch (Metwally et al.). At most |capacity|
+    items are tracked. When a new item arrives and the sketch is full the
+    item with the smallest count is replaced and the new item inherits its
+    count as the error bound, so counts are overestimates by at most
+    |error|. Any item with a true count above total / capacity is
+    guaranteed to be tracked.
+
+    Sketches are mergeable, so per-job sketches can be combined into a push
+    and pushes into a longer history.
+    """
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        # Mapping of item to [count, error].
+        self.counters = {}
+        # Lazy min heap of (count, item), entries go stale when an item's
+        # count grows and are skipped when popped.
+        self.heap = []
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counters)
+
+    def _pop_min(self):
+        while True:
+            (count, item) = heapq.heappop(self.heap)
+            counter = self.counters.get(item)
+            if counter is None:
+                continue
+            if counter[0] != count:
+                heapq.heappush(self.heap, (counter[0], item))
+                continue
+            del self.counters[item]
+            return count
+
+    def _push(self, item, count):
+        heapq.heappush(self.heap, (count, item))
+        # Keep the stale entries in check.
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(c, i) for (i, (c, _)) in self.counters.items()]
+            heapq.heapify(self.heap)
+
+    def add(self, item, count=1):
+        self.total += count
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+            return
+
+        error = 0
+        if len(self.counters) >= self.capacity:
+            error = self._pop_min()
+
+        self.counters[item] = [error + count, error]
+        self._push(item, error + count)
+
+    def update(self, counts):
+        """
+        Adds a mapping of item to count, ie a |Counter|.
+        """
+        for (item, count) in counts.items():
+            self.add(item, count)
+
+    def min_count(self):
+        """
+        Upper bound of the count of any item that isn't tracked.
+        """
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(c for (c, _) in self.counters.values())
+
+    def merge(self, other):
+        """
+        Merges |other| into this sketch. Items missing from one of the
+        sketches are assumed to have that sketch's |min_count|.
+        """
+        (mine, theirs) = (self.min_count(), other.min_count())
+        merged = {}
+        for (item, (count, error)) in self.counters.items():
+            if item not in other.counters:
+                merged[item] = [count + theirs, error + theirs]
+        for (item, (count, error)) in other.counters.items():
+            (c, e) = self.counters.get(item, (mine, mine))
+            merged[item] = [count + c, error + e]
+
+        kept = heapq.nlargest(self.capacity, merged.items(),
+                              key=lambda x: x[1][0])
+        self.counters = dict(kept)
+        self.heap = [(c, i) for (i, (c, _)) in kept]
+        heapq.heapify(self.heap)
+        self.total += other.total
+
+    def count(self, item):
+        """
+        Returns the (estimated count, error) of an item.
+        """
+        counter = self.counters.get(item)
+        if counter is None:
+            return (self.min_count(), self.min_count())
+        return tuple(counter)
+
+    def most_common(self, k=None):
+        """
+        Returns (item, estimated count, error) tuples, largest first.
+        """
+        if k is None:
+            k = len(self.counters)
+        return [(item, c, e) for (item, (c, e)) in heapq.nlargest(
+                k, self.counters.items(), key=lambda x: x[1][0])]
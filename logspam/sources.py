@@ -0,0 +1,217 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Local sources of logs, for mirrors of the log artifacts and for bundles
+received from isolated runners, so they can be analyzed without a network.
+
+  dir:/path            every log under /path
+  tar:/path.tar.gz     every log in the tarball, which may be compressed
+
+Logs are files ending in one of |LOG_SUFFIXES|, optionally gzipped. Their
+job names come from a `manifest.json` at the root of the source mapping
+paths, relative to the root, to job names. Logs missing from the manifest
+are named after their file, or after their top level directory when the
+file has a generic name like `live_backing.log`. Job ids are derived from the
+path of the log so that its cached files keep their names when other logs are
+added to or removed from the source.
+"""
+
+from contextlib import contextmanager
+import gzip
+import json
+import os
+import tarfile
+import zlib
+
+DIR = 'dir'
+TAR = 'tar'
+KINDS = (DIR, TAR)
+
+MANIFEST = 'manifest.json'
+
+LOG_SUFFIXES = ('.log', '.txt')
+
+# File names that don't say anything about the job they're from.
+GENERIC_NAMES = ('live_backing', 'live', 'log', 'raw', 'output')
+
+
+class InvalidLogSourceException(Exception):
+    pass
+
+
+def parse_log_source(spec):
+    """
+    Splits a --log-source |spec| into its kind and path.
+    """
+    (kind, sep, path) = spec.partition(':')
+    if not sep or kind not in KINDS or not path:
+        raise InvalidLogSourceException(
+                "Invalid log source %s, expected dir:PATH or tar:PATH" % spec)
+
+    if kind == DIR and not os.path.isdir(path):
+        raise InvalidLogSourceException("%s is not a directory" % path)
+    if kind == TAR and not os.path.isfile(path):
+        raise InvalidLogSourceException("%s is not a file" % path)
+
+    return (kind, path)
+
+
+def is_log(name):
+    if name.endswith('.gz'):
+        name = name[:-len('.gz')]
+    return name.endswith(LOG_SUFFIXES)
+
+
+def job_name_from_path(relpath):
+    """
+    Infers a job name from the path of a log relative to the source root.
+    """
+    parts = relpath.replace(os.sep, '/').split('/')
+    stem = parts[-1]
+    if stem.endswith('.gz'):
+        stem = stem[:-len('.gz')]
+    stem = os.path.splitext(stem)[0]
+
+    if stem in GENERIC_NAMES and len(parts) > 1:
+        return parts[0]
+    return stem
+
+
+def _member_name(info):
+    return info.name[2:] if info.name.startswith('./') else info.name
+
+
+def open_log(name, f):
+    """
+    Wraps the binary file object |f| of the log |name| so it reads the
+    uncompressed log.
+    """
+    if name.endswith('.gz'):
+        return gzip.GzipFile(fileobj=f)
+    return f
+
+
+def is_local_url(url):
+    return url.startswith((DIR + ':', TAR + ':'))
+
+
+def job_id_from_path(relpath):
+    """
+    Returns a stable job id for the log at |relpath|.
+    """
+    return zlib.crc32(relpath.encode('utf-8'))
+
+
+@contextmanager
+def open_url(url):
+    """
+    Opens a log given the URL |LogSource.url| recorded for it. Yields a
+    binary file object streaming the uncompressed log.
+    """
+    (kind, _, path) = url.partition(':')
+    if kind == DIR:
+        with open(path, 'rb') as f:
+            yield open_log(path, f)
+        return
+
+    (path, _, member) = path.rpartition('!')
+    with tarfile.open(path, 'r:*') as tar:
+        for info in tar:
+            if _member_name(info) == member:
+                yield open_log(member, tar.extractfile(info))
+                return
+
+    raise IOError("%s not found in %s" % (member, path))
+
+
+def iter_members(path, members):
+    """
+    Generates (member, f) for the (member, offset) |members| of the tarball
+    |path|, where offset is the member's |LogSource.offsets| and f a binary
+    file object streaming the uncompressed log, valid until the next member
+    is generated. Seeking in a compressed tarball decompresses everything
+    before the offset, so |members| should be in the order they're stored.
+    """
+    with tarfile.open(path, 'r:*') as tar:
+        for (member, offset) in members:
+            tar.fileobj.seek(offset)
+            info = tarfile.TarInfo.fromtarfile(tar)
+            yield (member, open_log(member, tar.extractfile(info)))
+
+
+class LogSource(object):
+    """
+    Discovers the logs of a --log-source and presents them as treeherder
+    style jobs, see |jobs|.
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        (self.kind, self.path) = parse_log_source(spec)
+        # Maps the logs of a tar: source to the (offset, size) of their member.
+        self.offsets = {}
+
+    def _members(self):
+        """
+        Returns the relative paths of the logs and the manifest, if any.
+        """
+        manifest = None
+        members = []
+        if self.kind == DIR:
+            for (root, _, files) in os.walk(self.path):
+                for name in files:
+                    relpath = os.path.relpath(os.path.join(root, name), self.path)
+                    relpath = relpath.replace(os.sep, '/')
+                    if relpath == MANIFEST:
+                        with open(os.path.join(self.path, relpath), 'r') as f:
+                            manifest = json.load(f)
+                    elif is_log(name):
+                        members.append(relpath)
+        else:
+            # Listing a compressed tarball means decompressing it once, the
+            # logs themselves are streamed by the workers from their offsets,
+            # see |iter_members|.
+            with tarfile.open(self.path, 'r:*') as tar:
+                for info in tar:
+                    name = _member_name(info)
+                    if not info.isfile():
+                        continue
+                    if name == MANIFEST:
+                        manifest = json.load(tar.extractfile(info))
+                    elif is_log(name):
+                        members.append(name)
+                        self.offsets[name] = (info.offset, info.size)
+
+        return (sorted(members), manifest or {})
+
+    def jobs(self):
+        """
+        Returns a job dict for each log, with the fields of a treeherder job
+        the rest of logspam relies on plus the log's 'member' path.
+        """
+        (members, manifest) = self._members()
+        jobs = []
+        for member in members:
+            jobs.append({
+                'id': job_id_from_path(member),
+                'job_type_name': manifest.get(member, job_name_from_path(member)),
+                'job_type_symbol': None,
+                'url': self.url(member),
+                'member': member,
+            })
+        return jobs
+
+    def url(self, member):
+        """
+        Returns the URL recorded for a log, in place of its treeherder URL.
+        """
+        if self.kind == DIR:
+            return 'dir:%s' % self.local_path(member)
+        return 'tar:%s!%s' % (self.path, member)
+
+    def local_path(self, member):
+        """
+        Returns the path of a log of a dir: source.
+        """
+        return os.path.join(self.path, member)
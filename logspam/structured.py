@@ -0,0 +1,202 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Streaming reader for test logs. Handles both mozlog structured (json) logs
+and legacy plain text logs, classifying each line exactly once.
+
+mozlog always serializes the action first, so for most json lines the action
+can be determined with a prefix check and lines we don't care about are
+skipped without running |json.loads| on them.
+"""
+
+from collections import namedtuple
+import json
+import re
+
+# Event types.
+TEXT = 'text'
+LOG = 'log'
+PROCESS_OUTPUT = 'process_output'
+TEST_START = 'test_start'
+TEST_END = 'test_end'
+OTHER = 'other'
+
+# Events that carry a line of output that warnings can be matched against.
+# mozlog log messages used to be kept as raw json lines, they're matched on
+# their message now. Other actions are still kept as their raw json line.
+OUTPUT_ACTIONS = (TEXT, LOG, PROCESS_OUTPUT, OTHER)
+
+# Actions we need the json payload for, everything else is skipped.
+PARSED_ACTIONS = (LOG, PROCESS_OUTPUT, TEST_START, TEST_END)
+
+ACTION_PREFIX = '{"action": "'
+
+# Test boundaries as written to normalized logs and in legacy text logs.
+TEST_START_MARKER = 'TEST-START | '
+TEST_END_MARKER = 'TEST-END | '
+
+# Prefixes taskcluster and mozharness put in front of plain text lines, ie:
+#   [task 2016-09-20T11:09:35.539828Z] 11:09:35     INFO -  TEST-START | ...
+#   12 INFO TEST-START | ...
+PREFIX_RE = re.compile(
+        r'(?:\[task[^\]]+\]\s)?(?:[0-9:]+\s+INFO\s+-\s+|[0-9]+\s+INFO\s+)?')
+
+# Duration recorded on test end markers, ie:
+#   TEST-END | dom/test.html | took 123ms
+#   TEST-END | dom/test.html | finished in 123ms
+DURATION_RE = re.compile(r'(?:took|finished in) ([0-9]+)ms')
+
+# Bucket for warnings emitted outside of a test.
+NO_TEST = '(no test)'
+
+# |size| is the size of the line in the log, including the newline.
+LogEvent = namedtuple('LogEvent', ['action', 'data', 'test', 'time', 'size'])
+
+
+def _from_json(blob, line, size):
+    action = blob.get('action')
+    time = blob.get('time')
+    if action == PROCESS_OUTPUT:
+        return LogEvent(PROCESS_OUTPUT, blob.get('data', ''), None, time, size)
+    elif action in (TEST_START, TEST_END):
+        return LogEvent(action, None, blob.get('test'), time, size)
+    elif action == LOG:
+        return LogEvent(LOG, blob.get('message', ''), None, time, size)
+    elif 'data' in blob:
+        # Not an action we know about, but it has output.
+        return LogEvent(PROCESS_OUTPUT, blob['data'], None, time, size)
+
+    return LogEvent(OTHER, line, None, time, size)
+
+
+def _from_text(line, size):
+    # Cheap substring check before doing any real work.
+    if 'TEST-' in line:
+        rest = line[PREFIX_RE.match(line).end():]
+        if rest.startswith(TEST_START_MARKER):
+            test = rest[len(TEST_START_MARKER):].strip()
+            return LogEvent(TEST_START, line, test, None, size)
+        if rest.startswith(TEST_END_MARKER):
+            test = rest[len(TEST_END_MARKER):].split(' | ')[0].strip()
+            return LogEvent(TEST_END, line, test, None, size)
+
+    return LogEvent(TEXT, line, None, None, size)
+
+
+def classify(line):
+    """
+    Classifies a single log line, returns a |LogEvent|.
+    """
+    # For bytes this is exact, for already decoded lines it's the number of
+    # characters which is close enough for the mostly ascii logs.
+    size = len(line) + 1
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', 'replace')
+
+    if not line.startswith('{'):
+        return _from_text(line, size)
+
+    if line.startswith(ACTION_PREFIX):
+        end = line.find('"', len(ACTION_PREFIX))
+        action = line[len(ACTION_PREFIX):end]
+        if action not in PARSED_ACTIONS:
+            return LogEvent(OTHER, line, None, None, size)
+
+    try:
+        blob = json.loads(line)
+    except ValueError:
+        return _from_text(line, size)
+
+    if not isinstance(blob, dict):
+        return _from_text(line, size)
+
+    return _from_json(blob, line, size)
+
+
+def read_events(lines):
+    """
+    Generates a |LogEvent| for each non-empty line.
+    """
+    for line in lines:
+        if line:
+            yield classify(line)
+
+
+def event_to_line(event, normalize, duration=None):
+    """
+    Returns the line to write to a normalized log for |event|, or None if the
+    event should be dropped. |normalize| is applied to output lines and
+    |duration| is recorded on test end markers.
+    """
+    if event.action in OUTPUT_ACTIONS:
+        return normalize(event.data)
+    elif event.action == TEST_START:
+        return TEST_START_MARKER + (event.test or '')
+    elif event.action == TEST_END:
+        line = TEST_END_MARKER + (event.test or '')
+        if duration is not None:
+            line += ' | took %dms' % duration
+        return line
+
+    return None
+
+
+class TestAccounting(object):
+    """
+    Accumulates per-test warning statistics from a stream of events.
+
+    |tests| maps a test name to a [warnings, bytes, distinct warnings,
+    duration in ms] list.
+    """
+    WARNINGS = 0
+    BYTES = 1
+    DISTINCT = 2
+    DURATION = 3
+
+    def __init__(self):
+        self.tests = {}
+        self.current = NO_TEST
+        self.start_time = None
+        self.seen = set()
+
+    def _stats(self, test):
+        stats = self.tests.get(test)
+        if stats is None:
+            stats = self.tests[test] = [0, 0, 0, 0]
+        return stats
+
+    def start(self, event):
+        self.current = event.test or NO_TEST
+        self.start_time = event.time
+        self.seen = set()
+
+    def end(self, event):
+        """
+        Closes the current test, returns its duration in ms if known.
+        """
+        duration = None
+        if event.time is not None and self.start_time is not None:
+            # Skewed clocks or out of order records can make it negative.
+            duration = max(0, int(event.time - self.start_time))
+        elif event.data:
+            m = DURATION_RE.search(event.data)
+            if m:
+                duration = int(m.group(1))
+
+        if duration is not None:
+            self._stats(event.test or self.current)[self.DURATION] += duration
+
+        self.current = NO_TEST
+        self.start_time = None
+        self.seen = set()
+        return duration
+
+    def warning(self, line, size):
+        stats = self._stats(self.current)
+        stats[self.WARNINGS] += 1
+        stats[self.BYTES] += size
+        if line not in self.seen:
+            self.seen.add(line)
+            stats[self.DISTINCT] += 1
@@ -0,0 +1,556 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Compact binary summary of the per-job warning counts of a push.
+
+The file can be mmap'd and queried without deserializing it. Layout, all
+integers are little endian:
+
+  header       magic, version, string count, warning count, job count,
+               record count, test count, pattern count
+  offsets      (string count + 1) u64 offsets into the string data
+  strings      utf-8 string data, padded to 8 bytes. The first |warning
+               count| strings are the warnings sorted bytewise so they can be
+               binary searched, followed by the job urls, names, file names
+               and test names. The last |pattern count| strings are the
+               pattern names
+  jobs         per job (url, job name, file name) string ids followed by the
+               index of its first record, its record count, the index of its
+               first test, its test count, the raw log size and the
+               normalized log size
+  records      fixed width (job, warning id, count, raw bytes, pattern mask)
+               records sorted by job and then warning id. Bit N of the mask
+               is set if the warning matched the Nth pattern
+  tests        fixed width (test name id, warnings, bytes, distinct warnings,
+               duration ms) records grouped by job
+  locations    per warning, in warning id order, the (text start, text end,
+               file start, file end, line) of its location so it doesn't
+               have to be parsed again, see |logspam.index.locate_warning|
+"""
+
+from collections import Counter
+import json
+import mmap
+import os
+import struct
+
+from logspam.index import locate_warning, location_from_spans
+from logspam.patterns import MAX_PATTERNS
+
+MAGIC = b'LSPS'
+VERSION = 5
+
+HEADER = struct.Struct('<4sIIIIIII')
+OFFSET = struct.Struct('<Q')
+JOB = struct.Struct('<IIIIIIIQQ')
+RECORD = struct.Struct('<IIIQI')
+TEST = struct.Struct('<IIQII')
+U32_MAX = 2 ** 32 - 1
+LOCATION = struct.Struct('<IIIII')
+
+
+class InvalidSummaryException(Exception):
+    pass
+
+
+class JsonLog(object):
+    """
+    Minimal stand-in for a |ParsedLog| loaded from a results json entry.
+    """
+    def __init__(self, entry):
+        self.url = entry['url']
+        self.job_name = entry['job_name']
+        self.fname = entry['fname']
+        self.warnings = entry['warnings']
+        self.tests = entry.get('tests', {})
+        self.warning_bytes = entry.get('warning_bytes', {})
+        self.raw_bytes = entry.get('raw_bytes', 0)
+        self.normalized_bytes = entry.get('normalized_bytes', 0)
+        self.pattern_members = {}
+        if entry.get('patterns'):
+            warnings = list(self.warnings)
+            self.pattern_members = dict(
+                    (name, set(warnings[i] for i in indices))
+                    for (name, indices) in entry['patterns'].items())
+
+
+def summary_path(results_path):
+    """
+    Returns the path of the binary summary for a results json file.
+    """
+    return os.path.splitext(results_path)[0] + '.bin'
+
+
+def write_summary(path, parsed_logs):
+    """
+    Writes the binary summary for the given list of |ParsedLog|s, or anything
+    else with url, job_name, fname and warnings attributes.
+    """
+    logs = [log for log in parsed_logs if log]
+
+    warnings = set()
+    for log in logs:
+        warnings.update(log.warnings)
+    encoded = sorted(w.encode('utf-8') for w in warnings)
+    decoded = [w.decode('utf-8') for w in encoded]
+    warning_ids = dict((w, i) for (i, w) in enumerate(decoded))
+    # The logs were just parsed, so these are usually cache hits.
+    locations = [locate_warning(w) for w in decoded]
+
+    pattern_names = set()
+    for log in logs:
+        pattern_names.update(getattr(log, 'pattern_members', {}))
+    pattern_names = sorted(pattern_names)[:MAX_PATTERNS]
+    pattern_bits = dict((name, 1 << i) for (i, name) in enumerate(pattern_names))
+
+    strings = list(encoded)
+    test_ids = {}
+    jobs = []
+    records = []
+    tests = []
+    for (job, log) in enumerate(logs):
+        meta = []
+        for value in (log.url, log.job_name, log.fname):
+            meta.append(len(strings))
+            strings.append((value or '').encode('utf-8'))
+
+        first = len(records)
+        warning_bytes = getattr(log, 'warning_bytes', {})
+        masks = {}
+        for (name, members) in getattr(log, 'pattern_members', {}).items():
+            for warning in members:
+                masks[warning] = masks.get(warning, 0) | pattern_bits.get(name, 0)
+
+        for (warning_id, count, size, mask) in sorted(
+                (warning_ids[w], c, warning_bytes.get(w, 0), masks.get(w, 0))
+                for (w, c) in log.warnings.items()):
+            records.append((job, warning_id, count, size, mask))
+
+        first_test = len(tests)
+        for (test, stats) in getattr(log, 'tests', {}).items():
+            if test not in test_ids:
+                test_ids[test] = len(strings)
+                strings.append(test.encode('utf-8'))
+            tests.append((test_ids[test],) + tuple(stats))
+
+        jobs.append(tuple(meta) + (first, len(records) - first,
+                                   first_test, len(tests) - first_test,
+                                   getattr(log, 'raw_bytes', 0),
+                                   getattr(log, 'normalized_bytes', 0)))
+
+    _write(path, strings, len(encoded), jobs, records, tests, pattern_names,
+           locations)
+
+
+def merge_summaries(path, paths):
+    """
+    Combines the binary summaries at |paths|, each usually holding the
+    results of a single log, into one at |path|. Unlike |json_to_summary|
+    only the strings and fixed width records are read.
+    """
+    summaries = [SummaryFile(p) for p in paths]
+    try:
+        warnings = set()
+        pattern_names = set()
+        for summary in summaries:
+            warnings.update(summary._string_bytes(i)
+                            for i in range(summary.warning_count))
+            pattern_names.update(summary.patterns())
+        encoded = sorted(warnings)
+        warning_ids = dict((w, i) for (i, w) in enumerate(encoded))
+        pattern_names = sorted(pattern_names)[:MAX_PATTERNS]
+        pattern_bits = dict((name, 1 << i)
+                            for (i, name) in enumerate(pattern_names))
+
+        strings = list(encoded)
+        locations = [None] * len(encoded)
+        test_ids = {}
+        jobs = []
+        records = []
+        tests = []
+        for summary in summaries:
+            # Warning ids and pattern bits of this summary to the merged ones.
+            ids = [warning_ids[summary._string_bytes(i)]
+                   for i in range(summary.warning_count)]
+            for (i, spans) in enumerate(summary.location_spans()):
+                locations[ids[i]] = spans
+            bits = [pattern_bits.get(name, 0) for name in summary.patterns()]
+
+            for job in range(summary.job_count):
+                (url, job_name, fname, first, count, _, _, raw, normalized) = \
+                        JOB.unpack_from(summary.buf,
+                                        summary.jobs_pos + job * JOB.size)
+                meta = []
+                for value in (url, job_name, fname):
+                    meta.append(len(strings))
+                    strings.append(summary._string_bytes(value))
+
+                job_first = len(records)
+                for (warning, c, size, mask) in sorted(
+                        (ids[w], c, size, mask)
+                        for (_, w, c, size, mask) in summary.records(first, count)):
+                    merged = 0
+                    for (i, bit) in enumerate(bits):
+                        if mask & (1 << i):
+                            merged |= bit
+                    records.append((len(jobs), warning, c, size, merged))
+
+                first_test = len(tests)
+                for (test, stats) in summary.job_tests(job).items():
+                    if test not in test_ids:
+                        test_ids[test] = len(strings)
+                        strings.append(test.encode('utf-8'))
+                    tests.append((test_ids[test],) + tuple(stats))
+
+                jobs.append(tuple(meta) + (job_first, len(records) - job_first,
+                                           first_test, len(tests) - first_test,
+                                           raw, normalized))
+    finally:
+        for summary in summaries:
+            summary.close()
+
+    _write(path, strings, len(encoded), jobs, records, tests, pattern_names,
+           locations)
+
+
+def _write(path, strings, warning_count, jobs, records, tests, pattern_names,
+           locations):
+    strings = strings + [name.encode('utf-8') for name in pattern_names]
+
+    offsets = [0]
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    data = b''.join(strings)
+    data += b'\0' * (-len(data) % 8)
+
+    # Processes sharing a cache directory can write the same summary.
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(strings), warning_count,
+                            len(jobs), len(records), len(tests),
+                            len(pattern_names)))
+        f.write(b''.join(OFFSET.pack(o) for o in offsets))
+        f.write(data)
+        f.write(b''.join(JOB.pack(*j) for j in jobs))
+        f.write(b''.join(RECORD.pack(*r) for r in records))
+        # Counts and durations are clamped rather than failing the write,
+        # durations come from timestamps in the logs.
+        f.write(b''.join(TEST.pack(test, min(warnings, U32_MAX), size,
+                                   min(distinct, U32_MAX),
+                                   max(0, min(duration, U32_MAX)))
+                         for (test, warnings, size, distinct, duration) in tests))
+        f.write(b''.join(LOCATION.pack(*l[:4] + (min(l[4], U32_MAX),))
+                         for l in locations))
+    os.replace(tmp_path, path)
+
+
+def json_to_summary(json_path, path=None):
+    """
+    Converts an existing results json file to a binary summary.
+    """
+    with open(json_path, 'r') as f:
+        raw_list = json.load(f)
+
+    logs = [JsonLog(x) for x in raw_list if x]
+
+    path = path or summary_path(json_path)
+    write_summary(path, logs)
+    return path
+
+
+def summary_to_json(path, json_path):
+    """
+    Converts a binary summary back to the results json format.
+    """
+    summary = SummaryFile(path)
+    try:
+        with open(json_path, 'w') as f:
+            json.dump(summary.to_json(), f)
+    finally:
+        summary.close()
+
+
+class SummaryFile(object):
+    """
+    Read-only, mmap backed view of a binary summary.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise InvalidSummaryException("%s is empty" % path)
+
+        try:
+            (magic, version, self.string_count, self.warning_count,
+             self.job_count, self.record_count, self.test_count,
+             self.pattern_count) = HEADER.unpack_from(self.buf, 0)
+        except struct.error:
+            raise InvalidSummaryException("%s is truncated" % path)
+
+        if magic != MAGIC or version != VERSION:
+            raise InvalidSummaryException(
+                    "%s is not a version %d summary" % (path, VERSION))
+
+        self.offsets_pos = HEADER.size
+        self.strings_pos = self.offsets_pos + (self.string_count + 1) * OFFSET.size
+        (data_size,) = OFFSET.unpack_from(
+                self.buf, self.offsets_pos + self.string_count * OFFSET.size)
+        self.jobs_pos = self.strings_pos + data_size + (-data_size % 8)
+        self.records_pos = self.jobs_pos + self.job_count * JOB.size
+        self.tests_pos = self.records_pos + self.record_count * RECORD.size
+        self.locations_pos = self.tests_pos + self.test_count * TEST.size
+
+        if self.locations_pos + self.warning_count * LOCATION.size != \
+                len(self.buf):
+            raise InvalidSummaryException("%s has an invalid size" % path)
+
+    def close(self):
+        self.buf.close()
+
+    def _string_bytes(self, string_id):
+        (start, end) = struct.unpack_from(
+                '<QQ', self.buf, self.offsets_pos + string_id * OFFSET.size)
+        return self.buf[self.strings_pos + start:self.strings_pos + end]
+
+    def string(self, string_id):
+        return self._string_bytes(string_id).decode('utf-8')
+
+    def warning_id(self, warning):
+        """
+        Binary searches for the id of |warning|, returns None if it's not
+        present.
+        """
+        encoded = warning.encode('utf-8')
+
+        (lo, hi) = (0, self.warning_count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._string_bytes(mid) < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < self.warning_count and self._string_bytes(lo) == encoded:
+            return lo
+        return None
+
+    def job(self, job):
+        """
+        Returns the (url, job_name, fname, first_record, record_count) tuple
+        for the given job index.
+        """
+        (url, job_name, fname, first, count, _, _, _, _) = JOB.unpack_from(
+                self.buf, self.jobs_pos + job * JOB.size)
+        return (self.string(url), self.string(job_name), self.string(fname),
+                first, count)
+
+    def job_tests(self, job):
+        """
+        Returns the per-test statistics of a job, see |TestAccounting|.
+        """
+        (_, _, _, _, _, first, count, _, _) = JOB.unpack_from(
+                self.buf, self.jobs_pos + job * JOB.size)
+        start = self.tests_pos + first * TEST.size
+        return dict((self.string(test), list(stats))
+                    for (test, *stats) in TEST.iter_unpack(
+                        self.buf[start:start + count * TEST.size]))
+
+    def job_bytes(self, job):
+        """
+        Returns the (raw, normalized) log sizes of a job.
+        """
+        return JOB.unpack_from(self.buf, self.jobs_pos + job * JOB.size)[7:]
+
+    def records(self, first=0, count=None):
+        """
+        Iterates over (job, warning id, count, raw bytes, pattern mask)
+        records.
+        """
+        if count is None:
+            count = self.record_count
+        start = self.records_pos + first * RECORD.size
+        return RECORD.iter_unpack(self.buf[start:start + count * RECORD.size])
+
+    def record_bytes(self):
+        """
+        Returns all the records as a single buffer of |RECORD|s, for readers
+        that decode them in bulk.
+        """
+        return self.buf[self.records_pos:
+                        self.records_pos + self.record_count * RECORD.size]
+
+    def warnings(self):
+        """
+        Returns the warning strings, in warning id order.
+        """
+        # Warnings are the first strings, read their offsets in one go.
+        offsets = struct.unpack_from('<%dQ' % (self.warning_count + 1),
+                                     self.buf, self.offsets_pos)
+        data = self.buf[self.strings_pos:self.strings_pos + offsets[-1]]
+        return [data[start:end].decode('utf-8')
+                for (start, end) in zip(offsets, offsets[1:])]
+
+    def job_warnings(self, job):
+        """
+        Returns a Counter of the warnings for a single job.
+        """
+        return Counter(dict(self.iter_job_warnings(job)))
+
+    def iter_job_warnings(self, job):
+        """
+        Iterates over the (warning, count) of a single job without building
+        a Counter.
+        """
+        (_, _, _, first, count) = self.job(job)
+        for (_, w, c, _, _) in self.records(first, count):
+            yield (self.string(w), c)
+
+    def patterns(self):
+        """
+        Returns the names of the patterns, in mask bit order.
+        """
+        first = self.string_count - self.pattern_count
+        return [self.string(first + i) for i in range(self.pattern_count)]
+
+    def job_pattern_members(self, job):
+        """
+        Returns a dict of pattern name to the set of warnings of a job that
+        matched it.
+        """
+        names = self.patterns()
+        if not names:
+            return {}
+
+        (_, _, _, first, count) = self.job(job)
+        members = {}
+        for (_, w, _, _, mask) in self.records(first, count):
+            for (i, name) in enumerate(names):
+                if mask & (1 << i):
+                    members.setdefault(name, set()).add(self.string(w))
+        return members
+
+    def job_warning_bytes(self, job):
+        """
+        Returns a Counter of the raw bytes of each warning for a single job.
+        """
+        return Counter(dict(self.iter_job_warning_bytes(job)))
+
+    def iter_job_warning_bytes(self, job):
+        """
+        Iterates over the (warning, raw bytes) of a single job without
+        building a Counter.
+        """
+        (_, _, _, first, count) = self.job(job)
+        for (_, w, _, b, _) in self.records(first, count):
+            yield (self.string(w), b)
+
+    def job_totals(self, job):
+        """
+        Returns the (total, distinct) warning counts of a job without
+        decoding any strings.
+        """
+        (_, _, _, first, count) = self.job(job)
+        return (sum(c for (_, _, c, _, _) in self.records(first, count)), count)
+
+    def totals(self):
+        """
+        Returns a Counter of warning id to its count across all jobs.
+        """
+        totals = Counter()
+        for (_, warning, count, _, _) in self.records():
+            totals[warning] += count
+        return totals
+
+    def location_spans(self):
+        """
+        Returns the stored location spans of every warning, in warning id
+        order, see |logspam.index.locate_warning|.
+        """
+        start = self.locations_pos
+        return list(LOCATION.iter_unpack(
+                self.buf[start:start + self.warning_count * LOCATION.size]))
+
+    def location(self, warning_id, warning=None):
+        """
+        Returns the stored (text, file, line) location of a warning.
+        """
+        spans = LOCATION.unpack_from(
+                self.buf, self.locations_pos + warning_id * LOCATION.size)
+        return location_from_spans(warning or self.string(warning_id), spans)
+
+    def add_to_index(self, index, warning_ids):
+        """
+        Adds the warnings with the given ids to a |WarningIndex| along with
+        their stored locations.
+        """
+        for warning_id in warning_ids:
+            warning = self.string(warning_id)
+            index.add(warning, self.location(warning_id, warning))
+
+    def combine(self, jobs=None, index=None):
+        """
+        Returns Counters of the count and of the raw bytes of each warning,
+        summed over the |jobs| indices or every job, straight from the
+        records. Each warning is only decoded once. If a |WarningIndex| is
+        given the warnings are added to it with their stored locations.
+        """
+        if jobs is None:
+            jobs = range(self.job_count)
+
+        counts = Counter()
+        sizes = Counter()
+        for job in jobs:
+            (_, _, _, first, count) = JOB.unpack_from(
+                    self.buf, self.jobs_pos + job * JOB.size)[:5]
+            for (_, warning, c, size, _) in self.records(first, count):
+                counts[warning] += c
+                sizes[warning] += size
+
+        strings = dict((w, self.string(w)) for w in counts)
+        if index is not None:
+            for (w, warning) in strings.items():
+                index.add(warning, self.location(w, warning))
+        return (Counter(dict((strings[w], c) for (w, c) in counts.items())),
+                Counter(dict((strings[w], b) for (w, b) in sizes.items())))
+
+    def combined_warnings(self):
+        return Counter(dict((self.string(w), c)
+                            for (w, c) in self.totals().items()))
+
+    def count(self, warning):
+        """
+        Returns the total count of a single warning across all jobs.
+        """
+        warning_id = self.warning_id(warning)
+        if warning_id is None:
+            return 0
+        return sum(c for (_, w, c, _, _) in self.records() if w == warning_id)
+
+    def to_json(self):
+        """
+        Returns the list of per-job dicts used by the results json format.
+        """
+        results = []
+        for job in range(self.job_count):
+            (url, job_name, fname, _, _) = self.job(job)
+            warnings = self.job_warnings(job)
+            positions = dict((w, i) for (i, w) in enumerate(warnings))
+            patterns = dict(
+                    (name, sorted(positions[w] for w in members))
+                    for (name, members) in self.job_pattern_members(job).items())
+            results.append({
+                'url': url,
+                'job_name': job_name,
+                'fname': fname,
+                'warnings': dict(warnings),
+                'patterns': patterns,
+                'warning_bytes': dict(self.job_warning_bytes(job)),
+                'raw_bytes': self.job_bytes(job)[0],
+                'normalized_bytes': self.job_bytes(job)[1],
+                'tests': self.job_tests(job),
+            })
+        return results
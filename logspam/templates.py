@@ -0,0 +1,259 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Streaming template extraction for warnings.
+
+Warnings that only differ by a value (a count, a pointer, a url, a line
+number) are grouped into a single template using a simplified version of the
+Drain log parser: each line is masked, split into tokens and routed through a
+fixed depth prefix tree keyed on the token count, the source file and the
+leading tokens. The leaf holds a handful of clusters and the line joins the
+most similar one, turning any differing tokens into a wildcard.
+
+The warnings of a push are assigned their templates the first time they're
+grouped and the assignments are cached with its results, see
+|TemplateAssignments|, so reports group them the same way every time.
+"""
+
+from array import array
+from collections import Counter, OrderedDict
+import re
+
+WILDCARD = '<*>'
+
+# Masks applied before tokenizing. Order matters, urls and absolute paths
+# need to be removed before their components get treated as numbers.
+MASKS = (
+    (re.compile(r'\b[a-z][a-z0-9+.-]*://\S+'), '<URL>'),
+    (re.compile(r'(?<![\w.])(?:[A-Za-z]:)?(?:/[\w.+-]+){2,}/?'), '<PATH>'),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '<HEX>'),
+    (re.compile(r'\b(?=[a-f]*[0-9])[0-9a-f]{8,}\b'), '<HEX>'),
+    (re.compile(r'(?<![\w.])-?[0-9]+(?:\.[0-9]+)?\b'), '<NUM>'),
+)
+
+# Relative source paths, ie: dom/base/nsDocument.cpp. The file a warning is
+# emitted from is part of its identity so these are never generalized.
+SOURCE_FILE_RE = re.compile(r'^[\w.+-]+(?:/[\w.+-]+)*\.[A-Za-z]+[,:]?$')
+
+
+def mask_line(line):
+    """
+    Replaces the variable parts of a line with placeholders.
+    """
+    for (regex, placeholder) in MASKS:
+        line = regex.sub(placeholder, line)
+    return line
+
+
+class Template(object):
+    """
+    A group of lines that share the same structure.
+    """
+    def __init__(self, template_id, tokens):
+        self.id = template_id
+        self.tokens = tokens
+        self.size = 0
+        # Leaf of the prefix tree this template lives in, needed for eviction.
+        self.leaf = None
+
+    @property
+    def text(self):
+        return ' '.join(self.tokens)
+
+    def similarity(self, tokens):
+        """
+        Returns the fraction of tokens that match this template exactly and
+        the number of wildcards that were matched.
+        """
+        same = 0
+        wildcards = 0
+        for (mine, theirs) in zip(self.tokens, tokens):
+            if mine == WILDCARD:
+                wildcards += 1
+            elif mine == theirs:
+                same += 1
+        return (float(same) / len(tokens), wildcards)
+
+    def merge(self, tokens):
+        self.tokens = [mine if mine == theirs else WILDCARD
+                       for (mine, theirs) in zip(self.tokens, tokens)]
+
+
+class TemplateMiner(object):
+    """
+    Groups lines into templates in a single streaming pass.
+
+    Memory is bounded by |max_templates|, the least recently used template is
+    dropped once the limit is hit, and by |cache_size| which limits the number
+    of exact lines remembered so that repeated lines skip the tree walk. If
+    |max_templates| is None templates are never dropped and memory grows with
+    the number of templates.
+    """
+    def __init__(self, depth=4, similarity=0.5, max_children=100,
+                 max_templates=50000, cache_size=200000):
+        self.depth = max(depth - 2, 1)
+        self.similarity = similarity
+        self.max_children = max_children
+        self.max_templates = max_templates
+        self.cache_size = cache_size
+
+        self.root = {}
+        self.templates = OrderedDict()
+        self.line_cache = OrderedDict()
+        self.next_id = 1
+
+    def add(self, line, count=1):
+        """
+        Adds |count| instances of |line|, returns the matching template.
+        """
+        template_id = self.line_cache.get(line)
+        template = self.templates.get(template_id) if template_id else None
+        if template:
+            self.line_cache.move_to_end(line)
+        else:
+            template = self._add_tokens(mask_line(line).split())
+            self.line_cache[line] = template.id
+            if len(self.line_cache) > self.cache_size:
+                self.line_cache.popitem(last=False)
+
+        template.size += count
+        self.templates.move_to_end(template.id)
+        return template
+
+    def get(self, template_id):
+        return self.templates.get(template_id)
+
+    def _leaf_for(self, tokens):
+        anchors = tuple(t for t in tokens if SOURCE_FILE_RE.match(t) and '/' in t)
+        node = self.root.setdefault((len(tokens), anchors), {})
+        for token in tokens[:self.depth]:
+            if any(c.isdigit() for c in token):
+                token = WILDCARD
+
+            if token not in node:
+                if len(node) >= self.max_children:
+                    token = WILDCARD
+                node = node.setdefault(token, {})
+            else:
+                node = node[token]
+
+        return node.setdefault(None, [])
+
+    def _add_tokens(self, tokens):
+        if not tokens:
+            tokens = ['']
+
+        leaf = self._leaf_for(tokens)
+
+        best = None
+        best_score = (-1, -1)
+        for template in leaf:
+            score = template.similarity(tokens)
+            if score > best_score:
+                (best, best_score) = (template, score)
+
+        if best and best_score[0] >= self.similarity:
+            best.merge(tokens)
+            return best
+
+        template = Template(self.next_id, list(tokens))
+        template.leaf = leaf
+        self.next_id += 1
+        leaf.append(template)
+        self.templates[template.id] = template
+
+        if self.max_templates and len(self.templates) > self.max_templates:
+            (_, evicted) = self.templates.popitem(last=False)
+            evicted.leaf.remove(evicted)
+
+        return template
+
+
+def group_warnings(warnings, miner=None):
+    """
+    Groups a Counter of warnings by template.
+
+    Returns the miner used and a mapping of template id to a Counter of the
+    warnings in that template.
+    """
+    if miner is None:
+        miner = TemplateMiner()
+
+    groups = {}
+    # Feed the most common warnings first so the templates are seeded with
+    # the variants that matter.
+    for (warning, count) in warnings.most_common():
+        template = miner.add(warning, count)
+        groups.setdefault(template.id, Counter())[warning] = count
+
+    return (miner, groups)
+
+
+class TemplateAssignments(object):
+    """
+    The template each warning of a push was assigned. |ids| holds the
+    template id of each warning id, |warning_id| maps a warning to its id or
+    None and |texts| maps template ids to their text.
+    """
+    def __init__(self, ids, texts, warning_id):
+        self.ids = ids
+        self.texts = texts
+        self.warning_id = warning_id
+
+    @classmethod
+    def mine(cls, warning, counts, warning_id):
+        """
+        Assigns templates to the warnings with the given total |counts|,
+        indexed by warning id. |warning| returns the text of a warning id,
+        they're only needed one at a time so they can be read straight from
+        a binary summary.
+        """
+        # Seed the templates with the most common warnings. Every warning is
+        # seen once and nothing is evicted, so a template never splits. The
+        # templates are kept in memory along with an id per warning.
+        miner = TemplateMiner(max_templates=None, cache_size=0)
+        ids = array('I', bytes(4 * len(counts)))
+        for i in sorted(range(len(counts)), key=lambda i: -counts[i]):
+            ids[i] = miner.add(warning(i)).id
+
+        texts = dict((t.id, t.text) for t in miner.templates.values())
+        return cls(ids, texts, warning_id)
+
+    @classmethod
+    def from_summary(cls, summary):
+        """
+        Mines the templates of the warnings of a |SummaryFile|.
+        """
+        counts = array('Q', bytes(8 * summary.warning_count))
+        for (_, warning, count, _, _) in summary.records():
+            counts[warning] += count
+        return cls.mine(summary.string, counts, summary.warning_id)
+
+    @classmethod
+    def from_counter(cls, warnings):
+        """
+        Mines the templates of a Counter of warnings.
+        """
+        order = list(warnings)
+        positions = dict((w, i) for (i, w) in enumerate(order))
+        return cls.mine(order.__getitem__, [warnings[w] for w in order],
+                        positions.get)
+
+    def template_id(self, warning):
+        """
+        Returns the id of the template |warning| was assigned, or None if it
+        isn't a warning of this push.
+        """
+        i = self.warning_id(warning)
+        return None if i is None else self.ids[i]
+
+    def text(self, template_id):
+        return self.texts[template_id]
+
+    def to_json(self):
+        return {
+            'ids': list(self.ids),
+            'templates': self.texts,
+        }
@@ -0,0 +1,317 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Verification and repair of cache directories.
+
+Each normalized log is checked against the metadata recorded when it was
+downloaded, see |ParsedLog._write_meta|. Logs are only re-downloaded if they
+are truly broken, the results and the binary summary are rebuilt from the
+local logs.
+"""
+
+from collections import namedtuple
+import json
+import os
+import re
+
+from logspam.cache import (
+        Cache,
+        CacheFileNotFoundException,
+        ParsedLog,
+        meta_path,
+        read_meta)
+from logspam.cli import BaseCommandLineArgs
+from logspam.patterns import pattern_from_args
+from logspam.retriggers import DEFAULT_POLICY, select_jobs
+from logspam.summary import InvalidSummaryException, SummaryFile
+
+OK = 'ok'
+UNVERIFIED = 'unverified'
+BROKEN = 'broken'
+MISSING = 'missing'
+STALE = 'stale'
+
+# Logs that verified fine, keyed by file name, so unchanged logs aren't
+# checked again.
+VERIFIED_FILE = '.verified.json'
+
+# Job id suffix of a cached log, see |ParsedLog|.
+JOB_ID_RE = re.compile(r'-([0-9]+)\.log$')
+
+LogStatus = namedtuple('LogStatus', ['cache_dir', 'fname', 'status', 'reason'])
+
+
+def log_files(cache_dir):
+    return sorted(f for f in os.listdir(cache_dir) if f.endswith('.log'))
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime]
+
+
+def read_verified(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, VERIFIED_FILE), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_verified(cache_dir, verified):
+    with open(os.path.join(cache_dir, VERIFIED_FILE), 'w') as f:
+        json.dump(verified, f)
+
+
+def verify_log(task):
+    """
+    Checks a single normalized log against its metadata. |require_meta| is
+    set if other logs in the directory have metadata, in which case a
+    missing one means the download never finished.
+    """
+    (cache_dir, fname, require_meta) = task
+    path = os.path.join(cache_dir, fname)
+
+    meta = read_meta(path)
+    if not meta:
+        if require_meta:
+            return LogStatus(cache_dir, fname, BROKEN, 'no metadata, incomplete download')
+        return LogStatus(cache_dir, fname, UNVERIFIED, 'no metadata')
+
+    size = os.path.getsize(path)
+    if 'size' in meta:
+        if size != meta['size']:
+            return LogStatus(cache_dir, fname, BROKEN,
+                             'size %d, expected %d' % (size, meta['size']))
+    elif size < meta.get('normalized_bytes', 0):
+        # Older metadata only has the number of characters written.
+        return LogStatus(cache_dir, fname, BROKEN,
+                         'size %d, expected at least %d' % (
+                             size, meta['normalized_bytes']))
+
+    if size:
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                return LogStatus(cache_dir, fname, BROKEN, 'truncated line')
+
+    return LogStatus(cache_dir, fname, OK, None)
+
+
+def check_results(cache):
+    """
+    Returns the (status, reason, entries) of a results file. |entries| is
+    the list of per-job dicts if it could be read.
+    """
+    if not os.path.isfile(cache.path):
+        return (MISSING, None, [])
+
+    try:
+        with open(cache.path, 'r') as f:
+            entries = [x for x in json.load(f) if x]
+    except ValueError as e:
+        return (BROKEN, str(e), [])
+
+    return (OK, None, entries)
+
+
+def check_summary(cache):
+    if not os.path.isfile(cache.summary_path):
+        return (MISSING, None)
+    if os.path.isfile(cache.path) and \
+            os.path.getmtime(cache.summary_path) < os.path.getmtime(cache.path):
+        return (STALE, None)
+
+    try:
+        SummaryFile(cache.summary_path).close()
+    except InvalidSummaryException as e:
+        return (BROKEN, str(e))
+
+    return (OK, None)
+
+
+def verify_dirs(cache_dirs, processes=8):
+    """
+    Verifies the logs of all the |cache_dirs| in parallel. Logs that
+    verified fine before and didn't change since are skipped.
+
+    Returns a dict of cache dir to the list of |LogStatus| of its logs.
+    """
+    tasks = []
+    results = dict((d, []) for d in cache_dirs)
+    for cache_dir in cache_dirs:
+        logs = log_files(cache_dir)
+        require_meta = any(os.path.isfile(meta_path(os.path.join(cache_dir, f)))
+                           for f in logs)
+        verified = read_verified(cache_dir)
+        for fname in logs:
+            if verified.get(fname) == _stamp(os.path.join(cache_dir, fname)):
+                results[cache_dir].append(LogStatus(cache_dir, fname, OK, 'unchanged'))
+            else:
+                tasks.append((cache_dir, fname, require_meta))
+
+    if tasks:
+        from multiprocessing import Pool
+
+        pool = Pool(processes=processes)
+        try:
+            for status in pool.imap_unordered(verify_log, tasks, chunksize=16):
+                results[status.cache_dir].append(status)
+        finally:
+            pool.close()
+
+    for (cache_dir, statuses) in results.items():
+        write_verified(cache_dir, dict(
+                (s.fname, _stamp(os.path.join(cache_dir, s.fname)))
+                for s in statuses if s.status == OK))
+
+    return results
+
+
+def _rebuild_log(task):
+    """
+    Process pool worker for |repair|. Parses a local log, downloading it
+    first if it was removed, and stores its results for merging if |store|
+    is set.
+    """
+    (cache_dir, url, job_name, fname, warning_re, store) = task
+    log = ParsedLog(url, job_name, fname)
+    if not log.download(cache_dir, warning_re):
+        print("Couldn't download %s" % url)
+        return None
+
+    if not store:
+        return None
+    return Cache(cache_dir, warning_re).store_partial(log)
+
+
+def _first_runs(cache_dir):
+    """
+    Returns the logs of |cache_dir| the default results are built from: the
+    first run of each job, see |logspam.retriggers|.
+    """
+    jobs = []
+    for fname in log_files(cache_dir):
+        m = JOB_ID_RE.search(fname)
+        meta = read_meta(os.path.join(cache_dir, fname))
+        jobs.append({
+            'id': int(m.group(1)) if m else 0,
+            'fname': fname,
+            'job_name': meta.get('job_name') or os.path.splitext(fname)[0],
+        })
+    return [job['fname'] for job in
+            select_jobs(jobs, DEFAULT_POLICY, lambda job: job['job_name'])]
+
+
+def repair(cache_dir, statuses, warning_re, processes=8):
+    """
+    Repairs a cache directory given the |statuses| of its logs from
+    |verify_dirs|. Broken logs are re-downloaded, then the results and the
+    summary are rebuilt if needed.
+
+    The directory can also hold retriggers and the logs of sampled runs, so
+    the results are rebuilt from the logs listed in the existing results,
+    or if they can't be read from the first run of each job.
+    """
+    cache = Cache(cache_dir, warning_re)
+    (results_status, _, entries) = check_results(cache)
+    by_fname = dict((x['fname'], x) for x in entries)
+    included = set(by_fname) if entries else set(_first_runs(cache_dir))
+
+    broken = set(s.fname for s in statuses if s.status == BROKEN)
+    # Jobs we have results for but whose log went missing.
+    broken.update(f for f in by_fname
+                  if not os.path.isfile(os.path.join(cache_dir, f)))
+
+    tasks = []
+    for fname in sorted(included | broken):
+        path = os.path.join(cache_dir, fname)
+        meta = read_meta(path)
+        entry = by_fname.get(fname, {})
+        url = meta.get('url') or entry.get('url')
+        job_name = meta.get('job_name') or entry.get('job_name') or \
+                   os.path.splitext(fname)[0]
+
+        if fname in broken:
+            if not url:
+                print("Can't re-download %s, its url is unknown" % fname)
+                continue
+            print("Re-downloading %s: %s" % (fname, url))
+            for p in (path, meta_path(path)):
+                if os.path.isfile(p):
+                    os.remove(p)
+
+        tasks.append((cache_dir, url, job_name, fname, warning_re,
+                      fname in included))
+
+    if broken or results_status != OK:
+        print("Rebuilding %s from %d logs" % (cache.path, len(included)))
+        from multiprocessing import Pool
+
+        pool = Pool(processes=processes)
+        try:
+            paths = [p for p in pool.map(_rebuild_log, tasks) if p]
+        finally:
+            pool.close()
+        cache.merge_partials(paths)
+    elif check_summary(cache)[0] != OK:
+        print("Rebuilding %s" % cache.summary_path)
+        if os.path.isfile(cache.summary_path):
+            os.remove(cache.summary_path)
+        cache.read_summary().close()
+
+
+class CacheCommandLineArgs(BaseCommandLineArgs):
+    @staticmethod
+    def do_cache(cmdline):
+        warning_re = pattern_from_args(cmdline)
+        cache_dirs = [d for d in cmdline.cache_dirs if os.path.isdir(d)]
+        for d in set(cmdline.cache_dirs) - set(cache_dirs):
+            print("%s is not a directory" % d)
+
+        results = verify_dirs(cache_dirs, cmdline.processes)
+        for cache_dir in cache_dirs:
+            statuses = results[cache_dir]
+            cache = Cache(cache_dir, warning_re)
+
+            print("%s:" % cache_dir)
+            for s in sorted(statuses):
+                if s.status != OK:
+                    print("  %-10s %s (%s)" % (s.status, s.fname, s.reason))
+            (status, reason, _) = check_results(cache)
+            print("  results  %s%s" % (status, " (%s)" % reason if reason else ""))
+            (status, reason) = check_summary(cache)
+            print("  summary  %s%s" % (status, " (%s)" % reason if reason else ""))
+            print("  %d logs, %d broken, %d unverified" % (
+                    len(statuses),
+                    len([s for s in statuses if s.status == BROKEN]),
+                    len([s for s in statuses if s.status == UNVERIFIED])))
+
+            if cmdline.action == 'repair':
+                try:
+                    repair(cache_dir, statuses, warning_re, cmdline.processes)
+                except CacheFileNotFoundException as e:
+                    print(e)
+
+    def add_command(self, p):
+        parser = p.add_parser('cache',
+            help='Verifies or repairs cache directories.')
+        self.add_arguments(parser)
+        parser.set_defaults(func=CacheCommandLineArgs.do_cache)
+
+    def add_arguments(self, p):
+        """
+        Adds cache specific command-line args.
+        """
+        p.add_argument('action', choices=('verify', 'repair'),
+                       help='Only report problems, or also fix them. Only ' \
+                            'broken logs are downloaded again.')
+        p.add_argument('cache_dirs', nargs='+', metavar='cache_dir',
+                       help='Cache directories to check.')
+
+        super(CacheCommandLineArgs, self).add_arguments(p)
+
+        p.add_argument('--processes', action='store', default=8, type=int,
+                       help='Number of processes to use. Default: 8')
@@ -24,6 +24,10 @@ setup(
       "requests>=2.24,<2.25",
       "treeherder-client>=5.0,<5.1",
     ],
+    extras_require={
+      # Only needed by the history command.
+      'history': ["numpy>=1.17"],
+    },
     entry_points={
       'console_scripts': ['log_spam=logspam.cli_entry:main']
     }
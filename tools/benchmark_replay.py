@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Times |retrieve_test_logs|, and optionally |WarningTestRunner.evaluate|,
+end to end against traffic recorded with `log_spam --record`, so changes
+to the download and parsing pipeline can be compared offline. Every run
+starts from an empty cache directory.
+
+Record once:
+  log_spam --record traffic report --no-cache --platform linux1804-64 fc15477ce628
+
+Then:
+  python tools/benchmark_replay.py traffic fc15477ce628 [--runs N]
+      [--latency SECONDS] [--bandwidth MB/s] [--warning WARNING]
+"""
+
+from argparse import ArgumentParser
+from collections import namedtuple
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from logspam import WARNING_RE, replay
+
+# The parts of mozregression's BuildInfo |evaluate| looks at.
+BuildInfo = namedtuple('BuildInfo', ['repo_name', 'changeset'])
+
+
+def timed(f):
+    start = time.time()
+    result = f()
+    return (time.time() - start, result)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('archive', help='Directory given to --record.')
+    parser.add_argument('revision')
+    parser.add_argument('--repo', default='mozilla-central')
+    parser.add_argument('--platform', default='linux1804-64')
+    parser.add_argument('--warning-re', default=WARNING_RE)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds added to each replayed response')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='Bandwidth of the replay server in MB/s')
+    parser.add_argument('--warning', default=None,
+                        help='Also time WarningTestRunner.evaluate for this '
+                             'warning, requires mozregression.')
+    args = parser.parse_args()
+
+    server = replay.replay(args.archive, args.latency,
+                           args.bandwidth and args.bandwidth * 1e6)
+
+    from logspam.logs import retrieve_test_logs
+
+    runner = None
+    if args.warning:
+        from logspam.bisection import WarningTestRunner
+        runner = WarningTestRunner(args.warning, args.platform,
+                                   warning_re=args.warning_re)
+
+    timings = {'retrieve_test_logs': [], 'evaluate': []}
+    cwd = os.getcwd()
+    try:
+        for i in range(args.runs):
+            work_dir = tempfile.mkdtemp()
+            try:
+                # |evaluate| uses the default cache directory.
+                os.chdir(work_dir)
+                (elapsed, logs) = timed(lambda: retrieve_test_logs(
+                        args.repo, args.revision, args.platform,
+                        os.path.join(work_dir, 'retrieve'), use_cache=False,
+                        warning_re=args.warning_re))
+                timings['retrieve_test_logs'].append(elapsed)
+                print("run %d: retrieve_test_logs %.2fs, %d logs" % (
+                        i, elapsed, len(logs or [])))
+
+                if runner:
+                    (elapsed, verdict) = timed(lambda: runner.evaluate(
+                            BuildInfo(args.repo, args.revision)))
+                    timings['evaluate'].append(elapsed)
+                    print("run %d: evaluate %.2fs, %s" % (i, elapsed, verdict))
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(work_dir)
+    finally:
+        print(server.summary())
+        server.stop()
+
+    for (name, values) in sorted(timings.items()):
+        if values:
+            values.sort()
+            print("%s: min %.2fs, median %.2fs, max %.2fs" % (
+                    name, values[0], values[len(values) // 2], values[-1]))
+
+
+if __name__ == '__main__':
+    main()
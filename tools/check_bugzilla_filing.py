@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Runs `log_spam file --top` against a local stand-in for the Bugzilla REST
+API and checks that warnings which already have an open logspam bug are
+not filed again. The stand-in starts out with an open bug for the most
+common warning and a fixed one for the second, so a first run has to skip
+the former and refile the latter, and a second run has to file nothing.
+
+Exits with a non-zero status if a duplicate bug was filed.
+
+Usage: python tools/check_bugzilla_filing.py [--top N]
+"""
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from logspam import WARNING_RE
+from logspam.bugzilla import META_BUG, SUMMARY_RE
+from logspam.cli_entry import add_arguments
+from logspam.report import Warnings
+
+API_KEY = 'fake-api-key'
+
+# Fields |Bugzilla.create_bug| has to send.
+REQUIRED_FIELDS = ('product', 'component', 'version', 'summary',
+                   'description', 'blocks')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class BugzillaHandler(BaseHTTPRequestHandler):
+    """
+    Just enough of the Bugzilla REST API for |logspam.bugzilla.Bugzilla|:
+    reading the meta bug, reading bugs by id and creating bugs.
+    """
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _parse(self):
+        url = urlparse(self.path)
+        params = dict((k, v[0]) for (k, v) in parse_qs(url.query).items())
+        if params.get('api_key') != API_KEY:
+            self._reply(401, {'error': True, 'message': 'Invalid API key'})
+            return None
+        return (url.path.rstrip('/').split('/')[2:], params)
+
+    def do_GET(self):
+        parsed = self._parse()
+        if not parsed:
+            return
+        (path, params) = parsed
+        bugzilla = self.server.bugzilla
+        with bugzilla.lock:
+            if path == ['bug', META_BUG]:
+                self._reply(200, {'bugs': [{'depends_on': list(bugzilla.bugs)}]})
+            elif path == ['bug'] and 'id' in params:
+                ids = [int(i) for i in params['id'].split(',')]
+                self._reply(200, {'bugs': [bugzilla.bugs[i] for i in ids
+                                           if i in bugzilla.bugs]})
+            else:
+                self._reply(404, {'error': True, 'message': 'Not found'})
+
+    def do_POST(self):
+        parsed = self._parse()
+        if not parsed:
+            return
+        (path, _) = parsed
+        length = int(self.headers.get('Content-Length', 0))
+        bug = json.loads(self.rfile.read(length).decode('utf-8'))
+
+        missing = [f for f in REQUIRED_FIELDS if not bug.get(f)]
+        if path != ['bug'] or missing or bug['blocks'] != META_BUG:
+            self._reply(400, {'error': True,
+                              'message': 'Invalid bug, missing %s' % missing})
+            return
+
+        self._reply(200, {'id': self.server.bugzilla.add(bug['summary'])})
+
+
+class FakeBugzilla(object):
+    """
+    Bugs blocking the logspam meta bug, served on a local port.
+    """
+    def __init__(self):
+        self.bugs = {}
+        self.filed = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), BugzillaHandler)
+        self.server.bugzilla = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/rest' % self.server.server_port
+
+    def add(self, summary, resolution='', filed=True):
+        with self.lock:
+            bug_id = 1000 + len(self.bugs)
+            self.bugs[bug_id] = {
+                'id': bug_id,
+                'summary': summary,
+                'status': 'RESOLVED' if resolution else 'NEW',
+                'resolution': resolution,
+            }
+            if filed:
+                self.filed.append(bug_id)
+            return bug_id
+
+    def duplicates(self):
+        """
+        Returns the (text, file) of the warnings with several open bugs.
+        """
+        seen = {}
+        for bug in self.bugs.values():
+            m = SUMMARY_RE.search(bug['summary'])
+            if m and not bug['resolution']:
+                seen[m.groups()] = seen.get(m.groups(), 0) + 1
+        return [key for (key, n) in seen.items() if n > 1]
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def write_logs(log_dir, warnings):
+    """
+    Writes a log per job, the i-th warning is emitted 10 * (len - i) times
+    so they're ranked in order.
+    """
+    for job in range(3):
+        with open(os.path.join(log_dir, 'mochitest-%d.log' % job), 'w') as f:
+            for (i, warning) in enumerate(warnings):
+                f.write('TEST-START | dom/test_%d.html\n' % i)
+                for _ in range(10 * (len(warnings) - i)):
+                    f.write('%s\n' % warning)
+                f.write('TEST-END | dom/test_%d.html | took 10ms\n' % i)
+
+
+def run(args):
+    parser = ArgumentParser()
+    add_arguments(parser)
+    cmdline = parser.parse_args(args)
+    cmdline.func(cmdline)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--top', type=int, default=4)
+    args = parser.parse_args()
+
+    warnings = ['WARNING: NS_ENSURE_TRUE(%s) failed: file dom/base/File%d.cpp, '
+                'line %d' % (name, i, 10 * i + 1)
+                for (i, name) in enumerate(('mDocShell', 'aContent', 'rv',
+                                            'mWindow', 'aNode', 'mFrame'))]
+
+    tmp = tempfile.mkdtemp()
+    bugzilla = FakeBugzilla()
+    try:
+        log_dir = os.path.join(tmp, 'logs')
+        cache_dir = os.path.join(tmp, 'cache')
+        os.makedirs(log_dir)
+        write_logs(log_dir, warnings)
+        run(['report', 'local', '--cache-dir', cache_dir,
+             '--log-source', 'dir:%s' % log_dir, '--warning-count', '0'])
+
+        # Summaries exactly as `file` generates them.
+        top = Warnings('mozilla-central', 'local', 'linux1804-64', cache_dir,
+                       True, WARNING_RE).details_for_top(2, 10)
+        bugzilla.add(top[0][1][0], filed=False)
+        bugzilla.add(top[1][1][0], resolution='FIXED', filed=False)
+
+        command = ['file', 'local', '--cache-dir', cache_dir, '--top',
+                   str(args.top), '--component', 'General',
+                   '--bugzilla-api', bugzilla.url, '--api-key', API_KEY]
+        run(command)
+        first = len(bugzilla.filed)
+        run(command)
+        second = len(bugzilla.filed) - first
+    finally:
+        bugzilla.stop()
+        shutil.rmtree(tmp)
+
+    expected = min(args.top, len(warnings)) - 1
+    duplicates = bugzilla.duplicates()
+    print("")
+    print("first run filed %d bugs, expected %d" % (first, expected))
+    print("second run filed %d bugs, expected 0" % second)
+    print("warnings with several open bugs: %d" % len(duplicates))
+    for (text, path) in duplicates:
+        print("  %s (%s)" % (text, path))
+
+    if first != expected or second or duplicates:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Guards the startup time of the log_spam cli. Runs `python -X importtime` on
+the cli entry point and fails if a module that's only needed on a cache miss
+gets imported eagerly, or if the cumulative import time exceeds the budget.
+
+Usage: python tools/check_import_time.py [--budget-ms N] [--runs N]
+"""
+
+from argparse import ArgumentParser
+import re
+import subprocess
+import sys
+
+ENTRY_MODULE = 'logspam.cli_entry'
+
+# Modules that must only be imported once we know we need them.
+FORBIDDEN = (
+    'requests',
+    'thclient',
+    'mozregression',
+    'numpy',
+    'multiprocessing',
+    'http.server',
+    'subprocess',
+    'logspam.bisection',
+)
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def measure():
+    """
+    Returns a dict of top level module name to cumulative import time in
+    microseconds for a single run.
+    """
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                        'import %s' % ENTRY_MODULE],
+                       stderr=subprocess.PIPE, universal_newlines=True)
+    if p.returncode:
+        sys.stderr.write(p.stderr)
+        sys.exit(p.returncode)
+
+    modules = {}
+    for line in p.stderr.splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if m:
+            modules[m.group(4)] = int(m.group(2))
+    return modules
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--budget-ms', type=float, default=150,
+                        help='Maximum cumulative import time. Default: 150')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of runs, the fastest is used. Default: 5')
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    entry_us = min(r[ENTRY_MODULE] for r in runs)
+
+    failed = False
+    for module in FORBIDDEN:
+        if any(m == module or m.startswith(module + '.') for m in runs[0]):
+            print("FAIL: %s is imported at startup" % module)
+            failed = True
+
+    print("%s import time: %.1fms (budget %.1fms)" % (
+            ENTRY_MODULE, entry_us / 1000.0, args.budget_ms))
+    if entry_us / 1000.0 > args.budget_ms:
+        print("FAIL: import time over budget")
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Downloads logs from a local HTTP stand-in for the log server through
+|AdaptiveDownloader| and reports how the download and normalization limits
+moved. The server shares a fixed bandwidth between all connections and
+answers a fraction of requests with HTTP 429, so the controllers have
+something to react to.
+
+Usage: python tools/measure_adaptive_downloads.py [--logs N]
+           [--bandwidth MB/s] [--error-rate FRACTION]
+"""
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from logspam import WARNING_RE
+from logspam.logs import normalize_log_to_cache
+from logspam.scheduler import AdaptiveDownloader
+
+CHUNK = 16 * 1024
+
+
+def make_log(lines):
+    log = []
+    for i in range(lines):
+        if i % 50 == 0:
+            log.append('TEST-START | dom/test_%d.html' % (i // 50))
+        if i % 7 == 0:
+            log.append('WARNING: NS_ENSURE_TRUE(mDocShell) failed: '
+                       'file dom/base/nsDocShell.cpp, line %d' % (i % 13))
+        else:
+            log.append('INFO - some test output %d' % i)
+    return ('\n'.join(log) + '\n').encode('utf-8')
+
+
+class TokenBucket(object):
+    """
+    Bandwidth shared by all the server's connections.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 0
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def take(self, n):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.rate,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LogHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            throttle = server.random.random() < server.error_rate
+            # Overloading the server makes it throttle more.
+            throttle = throttle or server.active > server.max_connections
+        try:
+            time.sleep(server.latency)
+            if throttle:
+                with server.lock:
+                    server.throttled += 1
+                self.send_response(429)
+                self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            body = server.log
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            for i in range(0, len(body), CHUNK):
+                server.bucket.take(min(CHUNK, len(body) - i))
+                self.wfile.write(body[i:i + CHUNK])
+        finally:
+            with server.lock:
+                server.active -= 1
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--logs', type=int, default=60)
+    parser.add_argument('--lines', type=int, default=50000,
+                        help='Lines per log')
+    parser.add_argument('--bandwidth', type=float, default=50,
+                        help='Server bandwidth in MB/s')
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='Seconds the server waits before each response')
+    parser.add_argument('--error-rate', type=float, default=0.05,
+                        help='Fraction of requests answered with HTTP 429')
+    parser.add_argument('--max-connections', type=int, default=16,
+                        help='Connections above which every request gets 429')
+    parser.add_argument('--max-downloads', type=int, default=24)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LogHandler)
+    server.log = make_log(args.lines)
+    server.latency = args.latency
+    server.error_rate = args.error_rate
+    server.max_connections = args.max_connections
+    server.bucket = TokenBucket(args.bandwidth * 1e6)
+    server.random = random.Random(0)
+    server.lock = threading.Lock()
+    (server.requests, server.throttled, server.active, server.peak) = (0, 0, 0, 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    jobs = [('http://127.0.0.1:%d/%d' % (server.server_port, i),
+             'mochitest-%d' % i, i) for i in range(args.logs)]
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        downloader = AdaptiveDownloader(cache_dir, WARNING_RE,
+                                        normalize_log_to_cache,
+                                        max_downloads=args.max_downloads)
+        start = time.time()
+        handles = downloader.run(jobs)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(cache_dir)
+        server.shutdown()
+
+    total = len(server.log) * len([h for h in handles if h])
+    print("%d of %d logs of %d bytes in %.1fs, %.1f MB/s" % (
+            len([h for h in handles if h]), args.logs, len(server.log),
+            elapsed, total / elapsed / 1e6))
+    print("requests: %d, throttled: %d, peak connections: %d" % (
+            server.requests, server.throttled, server.peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Simulates `log_spam bisect --parallel K` over a range of pushes where the
+warning starts at a random push, some pushes are skipped and some are
+already cached. Each batch of uncached evaluations counts as one push
+download of wall time, so the waves column approximates how long a
+bisection takes relative to evaluating a single push. The width is the
+number of pushes the final range spans, more than 1 when every push left
+in it was skipped.
+
+Usage: python tools/measure_bisection.py [--pushes N] [--k 1,2,4,8]
+           [--skip FRACTION] [--cached FRACTION] [--trials N]
+"""
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from logspam.kway import BAD, GOOD, SKIP, KWayBisection
+
+
+def simulate(pushes, k, skip, cached, rng):
+    change = rng.randint(1, pushes - 1)
+    revisions = ['%040x' % i for i in range(pushes)]
+    skipped = set(i for i in range(1, pushes - 1) if rng.random() < skip)
+    cache = set(revisions[i] for i in range(1, pushes - 1)
+                if rng.random() < cached)
+    waves = [0]
+
+    def verdict(revision):
+        i = int(revision, 16)
+        if i in skipped:
+            return SKIP
+        return BAD if i >= change else GOOD
+
+    def evaluate_many(batch):
+        if any(r not in cache for r in batch):
+            waves[0] += 1
+        return [verdict(r) for r in batch]
+
+    bisection = KWayBisection(revisions, evaluate_many, k, cache.__contains__)
+    with redirect_stdout(io.StringIO()):
+        (good, bad) = bisection.run()
+    (good, bad) = (int(good, 16), int(bad, 16))
+    return (bisection.rounds, waves[0], bisection.evaluated,
+            good < change <= bad, bad - good)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--pushes', type=int, default=500)
+    parser.add_argument('--k', default='1,2,4,8,16',
+                        help='Comma separated values of K to compare')
+    parser.add_argument('--skip', type=float, default=0.1,
+                        help='Fraction of pushes without enough jobs')
+    parser.add_argument('--cached', type=float, default=0.0,
+                        help='Fraction of pushes already cached')
+    parser.add_argument('--trials', type=int, default=200)
+    args = parser.parse_args()
+
+    print("%4s %8s %8s %10s %8s %6s" % (
+            "k", "rounds", "waves", "evaluated", "correct", "width"))
+    for k in [int(x) for x in args.k.split(',')]:
+        rng = random.Random(0)
+        totals = [0, 0, 0, 0, 0]
+        for _ in range(args.trials):
+            for (i, value) in enumerate(simulate(args.pushes, k, args.skip,
+                                                 args.cached, rng)):
+                totals[i] += value
+        (rounds, waves, evaluated, correct, width) = [
+                t / float(args.trials) for t in totals]
+        print("%4d %8.1f %8.1f %10.1f %7.0f%% %6.2f" % (
+                k, rounds, waves, evaluated, 100 * correct, width))
+
+
+if __name__ == '__main__':
+    main()
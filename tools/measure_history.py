@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Times the change-point detection of `log_spam history` on a synthetic
+warnings x pushes history: Poisson noise around a per-warning rate, steps
+injected into a fraction of the warnings and pushes where some of the jobs
+didn't run. Reports how many of the injected steps were found at the right
+push. With --load the pushes are also written as cache directories and the
+time to load them is reported.
+
+Usage: python tools/measure_history.py [--warnings N] [--pushes N]
+           [--steps FRACTION] [--load]
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from logspam import WARNING_RE
+from logspam.cache import cache_file_path
+from logspam.history import WarningHistory, find_regressions
+from logspam.summary import summary_path, write_summary
+
+
+class FakeLog(object):
+    def __init__(self, job, warnings):
+        self.url = 'http://example.com/%d' % job
+        self.job_name = 'job-%d' % job
+        self.fname = 'job-%d.log' % job
+        self.warnings = warnings
+
+
+def synthesize(warnings, pushes, steps, jobs, seed):
+    rng = np.random.default_rng(seed)
+    rates = rng.lognormal(2, 1.5, size=warnings)
+    rates[rng.random(warnings) < 0.3] = 0
+
+    stepped = np.nonzero(rng.random(warnings) < steps)[0]
+    split = rng.integers(5, pushes - 5, size=len(stepped))
+    factor = rng.uniform(3, 10, size=len(stepped))
+
+    mean = np.repeat(rates[:, None], pushes, axis=1)
+    for (row, at, f) in zip(stepped, split, factor):
+        mean[row, at:] = max(rates[row], 5) * f
+
+    # Some pushes only got part of their jobs.
+    ran = np.full(pushes, jobs)
+    partial = rng.random(pushes) < 0.1
+    ran[partial] = rng.integers(jobs // 4, jobs, size=partial.sum())
+    counts = rng.poisson(mean * (ran / float(jobs))).astype(np.float32)
+
+    return (counts, ran, dict(zip(stepped, split)))
+
+
+def write_pushes(root, counts, jobs):
+    """
+    Writes each push as a cache directory holding just a binary summary,
+    the warnings spread over its jobs. Returns the directories.
+    """
+    cache_dirs = []
+    for push in range(counts.shape[1]):
+        cache_dir = os.path.join(root, 'push-%04d' % push)
+        os.makedirs(cache_dir)
+        logs = [FakeLog(j, Counter()) for j in range(jobs[push])]
+        for row in np.nonzero(counts[:, push])[0]:
+            logs[row % len(logs)].warnings['WARNING: w%d: file a.cpp, line %d' % (
+                    row, row)] = int(counts[row, push])
+
+        results = cache_file_path(cache_dir, WARNING_RE)
+        open(results, 'w').close()
+        write_summary(summary_path(results), logs)
+        cache_dirs.append(cache_dir)
+    return cache_dirs
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--warnings', type=int, default=10000)
+    parser.add_argument('--pushes', type=int, default=1000)
+    parser.add_argument('--steps', type=float, default=0.01,
+                        help='Fraction of warnings that get a step')
+    parser.add_argument('--jobs', type=int, default=20,
+                        help='Jobs per push')
+    parser.add_argument('--load', action='store_true', default=False,
+                        help='Also time loading the pushes from disk')
+    args = parser.parse_args()
+
+    (counts, jobs, injected) = synthesize(args.warnings, args.pushes,
+                                          args.steps, args.jobs, seed=0)
+
+    if args.load:
+        root = tempfile.mkdtemp()
+        try:
+            cache_dirs = write_pushes(root, counts, jobs)
+            start = time.time()
+            history = WarningHistory(cache_dirs, WARNING_RE)
+            print("Loaded %d warnings x %d pushes in %.2fs" % (
+                    len(history.warnings), len(history.labels),
+                    time.time() - start))
+        finally:
+            shutil.rmtree(root)
+    else:
+        history = WarningHistory([], WARNING_RE)
+        history.counts = counts
+        history.jobs = jobs.astype(np.float32)
+        history.labels = ['push-%04d' % i for i in range(args.pushes)]
+        history.warnings = ['WARNING: w%d: file a.cpp, line %d' % (i, i)
+                            for i in range(args.warnings)]
+
+    start = time.time()
+    regressions = find_regressions(history)
+    elapsed = time.time() - start
+
+    found = 0
+    for r in regressions:
+        row = int(r.warning.split(':')[1][2:])
+        if injected.get(row) == int(r.bad.split('-')[1]):
+            found += 1
+
+    print("%d warnings x %d pushes: %.2fs, %d candidates" % (
+            args.warnings, args.pushes, elapsed, len(regressions)))
+    print("%d of %d injected steps found at the right push, %d other candidates" % (
+            found, len(injected), len(regressions) - found))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Measures the peak RSS of the parent process and the time it spends receiving
+and merging results from the log download pool. Logs are synthesized so no
+network access is needed.
+
+  pickle   workers return whole |ParsedLog|s, the parent stores them
+  handles  workers write their results to the cache and return a |LogHandle|
+
+Usage: python tools/measure_merge.py [--jobs N] [--warnings N] [--workers N]
+"""
+
+from argparse import ArgumentParser
+from functools import partial
+from multiprocessing import Pool
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from logspam import WARNING_RE
+from logspam.cache import Cache, ParsedLog
+from logspam.logs import LogHandle
+
+
+def fake_log(job, warning_count):
+    log = ParsedLog('https://example.com/%d/live_backing.log' % job,
+                    'test-linux1804-64/debug-mochitest-%d' % job)
+    for i in range(warning_count):
+        warning = ('WARNING: NS_ENSURE_TRUE(mDocShell) failed %d: file '
+                   'dom/base/nsGlobalWindowOuter%d.cpp, line %d' % (i, i % 50, i))
+        log.add_warning(warning)
+        log.warning_bytes[warning] = 180
+    log.raw_bytes = 50 * 1024 * 1024
+    return log
+
+
+def pickle_worker(job, warning_count, cache_dir):
+    return fake_log(job, warning_count)
+
+
+def handle_worker(job, warning_count, cache_dir):
+    log = fake_log(job, warning_count)
+    path = Cache(cache_dir, WARNING_RE).store_partial(log)
+    return LogHandle(log.job_name, path, sum(log.warnings.values()))
+
+
+def run(mode, jobs, warning_count, workers):
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = Cache(cache_dir, WARNING_RE)
+        worker = pickle_worker if mode == 'pickle' else handle_worker
+
+        pool = Pool(processes=workers)
+        start = time.time()
+        results = pool.map(partial(worker, warning_count=warning_count,
+                                   cache_dir=cache_dir), range(jobs))
+        pool.close()
+
+        if mode == 'pickle':
+            cache.store_results(results)
+        else:
+            results = cache.merge_partials([h.path for h in results])
+        total = sum(sum(log.warnings.values()) for log in results)
+        elapsed = time.time() - start
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print("%-8s %8.2fs %8d MB %10d warnings" % (
+                mode, elapsed, rss // 1024, total))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=400)
+    parser.add_argument('--warnings', type=int, default=5000,
+                        help='Distinct warnings per job')
+    parser.add_argument('--workers', type=int, default=24)
+    parser.add_argument('--mode', choices=('pickle', 'handles'), default=None,
+                        help='Only measure a single mode')
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.jobs, args.warnings, args.workers)
+        return
+
+    # Each mode runs in its own process so the peak RSS isn't shared.
+    print("%-8s %9s %11s" % ("mode", "time", "parent rss"))
+    for mode in ('pickle', 'handles'):
+        subprocess.check_call([sys.executable, __file__, '--mode', mode,
+                               '--jobs', str(args.jobs),
+                               '--warnings', str(args.warnings),
+                               '--workers', str(args.workers)])
+
+
+if __name__ == '__main__':
+    main()
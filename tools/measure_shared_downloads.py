@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Runs several processes downloading the same logs into one cache directory,
+as happens when cron and a human (or a bisect and a report) hit the same
+revision, and reports the total bytes fetched from a local HTTP stand-in
+for the log server. With the cache locks every log is fetched once.
+
+Usage: python tools/measure_shared_downloads.py [--processes N] [--logs N]
+"""
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing import Process
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from logspam import WARNING_RE
+from logspam.cache import ParsedLog
+
+
+def make_log(lines):
+    log = []
+    for i in range(lines):
+        if i % 50 == 0:
+            log.append('TEST-START | dom/test_%d.html' % (i // 50))
+        if i % 7 == 0:
+            log.append('WARNING: NS_ENSURE_TRUE(mDocShell) failed: '
+                       'file dom/base/nsDocShell.cpp, line %d' % (i % 13))
+        else:
+            log.append('INFO - some test output %d' % i)
+    return ('\n'.join(log) + '\n').encode('utf-8')
+
+
+class LogHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.log
+        # Slow enough for the processes to overlap.
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes_served += len(body)
+            self.server.requests += 1
+
+
+def worker(port, cache_dir, logs, seed):
+    order = list(range(logs))
+    random.Random(seed).shuffle(order)
+    for job_id in order:
+        log = ParsedLog('http://127.0.0.1:%d/%d' % (port, job_id),
+                        'mochitest-%d' % job_id, job_id=job_id)
+        log.download(cache_dir, WARNING_RE)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--logs', type=int, default=40)
+    parser.add_argument('--lines', type=int, default=20000,
+                        help='Lines per log')
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='Seconds the server waits before each response')
+    args = parser.parse_args()
+
+    server = HTTPServer(('127.0.0.1', 0), LogHandler)
+    server.log = make_log(args.lines)
+    server.latency = args.latency
+    server.lock = threading.Lock()
+    server.bytes_served = 0
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        procs = [Process(target=worker,
+                         args=(server.server_port, cache_dir, args.logs, i))
+                 for i in range(args.processes)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(cache_dir)
+        server.shutdown()
+
+    print("%d processes x %d logs of %d bytes in %.1fs" % (
+            args.processes, args.logs, len(server.log), elapsed))
+    print("requests: %d, bytes fetched: %d (%.2fx the logs)" % (
+            server.requests, server.bytes_served,
+            float(server.bytes_served) / (args.logs * len(server.log))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Measures template mining on a synthetic corpus of warnings. Each warning type
+has a fixed source location and message with variable counts, pointers, urls
+and paths filled in, so the type each line was generated from is the ideal
+template. Purity is the fraction of lines whose template's most common type
+is their own and split is the number of types spread over several templates.
+
+  stream  every line is fed to a |TemplateMiner| as it would be read
+  cached  the lines are spread over jobs and their results cached, the
+          templates are assigned to the distinct warnings of the push the
+          first time `report --by-template` reads them and stored
+  evict   like the previous per report mining, with a miner limited to
+          --max-templates templates, for comparison
+
+Usage: python tools/measure_templates.py [--lines N] [--types N] [--jobs N]
+           [--max-templates N]
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from logspam import WARNING_RE
+from logspam.cache import Cache, ParsedLog
+from logspam.templates import TemplateMiner
+
+WORDS = ('failed', 'mDocShell', 'NS_ENSURE_TRUE', 'aContent', 'rv', 'channel',
+         'NS_FAILED', 'mWindow', 'IsInComposedDoc', 'docshell', 'listener',
+         'NS_ERROR_FAILURE', 'mPresShell', 'GetParent', 'observer', 'frame')
+
+VALUES = (
+    lambda rng: '%d' % rng.randint(0, 100000),
+    lambda rng: '0x%x' % rng.getrandbits(44),
+    lambda rng: 'https://example.com/tests/%d/file_%d.html' % (
+            rng.randint(0, 5000), rng.randint(0, 50)),
+    lambda rng: '/tmp/tmp%s/profile/prefs.js' % (
+            ''.join(rng.choice('abcdefgh0123456789') for _ in range(8))),
+)
+
+
+def make_types(count, rng):
+    """
+    Returns a list of functions generating the lines of each warning type.
+    """
+    types = []
+    for i in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(2, 5))]
+        values = [rng.choice(VALUES) for _ in range(rng.randint(1, 3))]
+        source = 'file dom/module%d/Source%d.cpp, line %d' % (
+                i % 40, i, rng.randint(10, 5000))
+
+        def generate(rng, words=words, values=values, source=source):
+            return 'WARNING: %s %s: %s' % (
+                    ' '.join(words), ' '.join(v(rng) for v in values), source)
+        types.append(generate)
+    return types
+
+
+def corpus(lines, type_count, seed=0):
+    """
+    Returns the (line, type) pairs of the corpus. Types are Zipf distributed
+    like real warnings.
+    """
+    rng = random.Random(seed)
+    types = make_types(type_count, rng)
+    weights = [1.0 / (i + 1) for i in range(type_count)]
+    chosen = rng.choices(range(type_count), weights=weights, k=lines)
+    return [(types[t](rng), t) for t in chosen]
+
+
+def quality(assigned):
+    """
+    Returns (purity, templates, split types) for the (template id, type,
+    count) triples in |assigned|.
+    """
+    by_template = {}
+    by_type = {}
+    for (template_id, t, count) in assigned:
+        by_template.setdefault(template_id, Counter())[t] += count
+        by_type.setdefault(t, set()).add(template_id)
+
+    total = sum(sum(c.values()) for c in by_template.values())
+    pure = sum(c.most_common(1)[0][1] for c in by_template.values())
+    split = len([t for t in by_type.values() if len(t) > 1])
+    return (float(pure) / total, len(by_template), split)
+
+
+def report(name, elapsed, lines, distinct, purity, templates, split):
+    print("%-7s %9.1fs %12.0f %10d %10d %7.3f %6d" % (
+            name, elapsed, lines / elapsed * 60, distinct, templates, purity,
+            split))
+
+
+def measure_stream(data):
+    miner = TemplateMiner()
+    start = time.time()
+    assigned = [(miner.add(line).id, t, 1) for (line, t) in data]
+    elapsed = time.time() - start
+    distinct = len(set(line for (line, _) in data))
+    report('stream', elapsed, len(data), distinct, *quality(assigned))
+
+
+def push_logs(data, jobs):
+    logs = [ParsedLog('https://example.com/%d/live_backing.log' % job,
+                      'test-linux1804-64/debug-mochitest-%d' % job)
+            for job in range(jobs)]
+    for (i, (line, _)) in enumerate(data):
+        logs[i % jobs].add_warning(line, WARNING_RE)
+    return logs
+
+
+def measure_cached(data, jobs):
+    types = dict(data)
+    logs = push_logs(data, jobs)
+    combined = Counter()
+    for log in logs:
+        combined.update(log.warnings)
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = Cache(cache_dir, WARNING_RE)
+        start = time.time()
+        cache.store_results(logs)
+        templates = cache.read_templates(parsed_logs=logs)
+        elapsed = time.time() - start
+
+        assigned = [(log.template_id(w), types[w], c)
+                    for log in logs for (w, c) in log.warnings.items()]
+        report('cached', elapsed, len(data), len(combined), *quality(assigned))
+
+        # The ids have to survive the summary being rebuilt.
+        os.remove(cache.summary_path)
+        again = cache.read_templates()
+        stable = all(again.template_id(w) == templates.template_id(w)
+                     for w in combined)
+        print("ids stable across reads: %s" % stable)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def measure_evict(data, jobs, max_templates):
+    types = dict(data)
+    logs = push_logs(data, jobs)
+
+    miner = TemplateMiner(max_templates=max_templates)
+    start = time.time()
+    assigned = []
+    for log in sorted(logs, key=lambda l: -sum(l.warnings.values())):
+        for (warning, count) in log.warnings.items():
+            assigned.append((miner.add(warning, count).id, types[warning], count))
+    elapsed = time.time() - start
+    report('evict', elapsed, len(data), len(types), *quality(assigned))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--types', type=int, default=300)
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--max-templates', type=int, default=100,
+                        help='Template limit of the miner in the evict run')
+    args = parser.parse_args()
+
+    data = corpus(args.lines, args.types)
+    print("%-7s %10s %12s %10s %10s %7s %6s" % (
+            "mode", "time", "lines/min", "distinct", "templates", "purity",
+            "split"))
+    measure_stream(data)
+    measure_cached(data, args.jobs)
+    measure_evict(data, args.jobs, args.max_templates)
+
+
+if __name__ == '__main__':
+    main()